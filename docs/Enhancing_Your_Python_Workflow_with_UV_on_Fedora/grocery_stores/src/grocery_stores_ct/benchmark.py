@@ -0,0 +1,786 @@
+"""
+Headless benchmarks for the Grocery Store application, using the local stand-in server.
+
+python -m grocery_stores_ct.benchmark load --rows 100000 --page-size 5000 --window 4
+python -m grocery_stores_ct.benchmark suite --rows 1000 10000 100000 --save baseline.json
+python -m grocery_stores_ct.benchmark suite --rows 1000 10000 100000 --compare baseline.json
+python -m grocery_stores_ct.benchmark filter --rows 1000000 --pushdown 100000
+python -m grocery_stores_ct.benchmark spatial --rows 10000 100000 --queries 1000
+
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import asyncio
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+import httpx
+import textual
+from textual.app import App, ComposeResult
+from textual.widgets import DataTable
+
+from grocery_stores_ct.cache import GroceryCache
+from grocery_stores_ct.columns import RecordColumns
+from grocery_stores_ct.filters import parse_filter
+from grocery_stores_ct.groceries import GroceryStoreApp
+from grocery_stores_ct.portal import PAGE_SIZE, MAX_PAGES_IN_FLIGHT, fetch_pages
+from grocery_stores_ct.spatial import Place, SpatialIndex, places
+from grocery_stores_ct.stand_in import serve, synthetic_records, TOWN_CENTERS
+from grocery_stores_ct.table import GroceryTable, CHUNK_SIZE
+
+PALETTE_QUERY = "quit"
+FILTER_QUERIES = [
+    "city=HARTFORD",
+    'status=ACTIVE city="NEW HAVEN"',
+    "market",
+    "zip>=06500 zip<06600",
+    'name="CORNER MARKET 77"'
+]
+# A metric regresses when its median grows more than this fraction above the baseline spread,
+# and more than the noise floor for its unit
+REGRESSION_THRESHOLD = 0.2
+NOISE_FLOOR = {"_s": 0.005, "_mib": 2.0}
+# Runs of every size, a single one is too noisy to compare
+SUITE_REPEAT = 5
+
+
+class IngestApp(App):
+    """
+    Bare application with a single table, to measure row insertion alone
+    """
+
+    def __init__(self, stock: bool = False):
+        super().__init__()
+        self.stock = stock
+
+    def compose(self) -> ComposeResult:
+        yield DataTable() if self.stock else GroceryTable()
+
+
+async def wait_for_load(app: GroceryStoreApp, pilot: Any, timeout: float) -> None:
+    """
+    Wait until the application finished loading the dataset
+    :param app: Application under test
+    :param pilot: Pilot driving the application
+    :param timeout: Seconds to wait
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while app.load_time is None:
+        if loop.time() > deadline:
+            raise TimeoutError(f"Dataset did not load in {timeout} seconds")
+        await pilot.pause(0.01)
+
+
+async def benchmark_load(  # pylint: disable=too-many-arguments
+        rows: int,
+        page_size: int,
+        window: int,
+        *,
+        latency: float = 0.0,
+        timeout: float = 600.0,
+        warm: bool = False
+) -> dict[str, Any]:
+    """
+    Measure time to first row, total load time and the time until the table finished
+    measuring and rendering the new rows, against the stand-in server
+    :param rows: Number of synthetic records
+    :param page_size: Records per page, 0 to use a single request
+    :param window: Pages in flight
+    :param latency: Simulated server latency per request, in seconds
+    :param timeout: Seconds to wait for the whole dataset
+    :param warm: If True, populate an on-disk cache first and measure the start from the cache
+    :return: Measurements
+    """
+    with serve(synthetic_records(rows), latency=latency) as url, TemporaryDirectory() as cache_dir:
+        cache = GroceryCache(directory=Path(cache_dir)) if warm else None
+        runs = 2 if warm else 1
+        for _ in range(runs):
+            app = GroceryStoreApp(url=url, page_size=page_size, window=window, cache=cache)
+            async with app.run_test() as pilot:
+                await wait_for_load(app, pilot, timeout)
+                await pilot.pause()
+                settle_time = time.perf_counter() - app.load_started
+                await pilot.press("ctrl+q")
+    return {
+        "rows": rows,
+        "page_size": page_size,
+        "window": window,
+        "latency": latency,
+        "warm": warm,
+        "time_to_first_row": app.time_to_first_row,
+        "load_time": app.load_time,
+        "settle_time": settle_time
+    }
+
+
+async def benchmark_ingest(
+        rows: int,
+        chunk_size: int = CHUNK_SIZE,
+        stock: bool = False
+) -> dict[str, Any]:
+    """
+    Measure how fast records are added to the table, including the time the table needs
+    to measure the new cells and render once idle.
+    :param rows: Number of synthetic records
+    :param chunk_size: Rows per chunk
+    :param stock: If True, use the stock DataTable and one add_row call per record, like before
+    :return: Measurements
+    """
+    records = synthetic_records(rows)
+    app = IngestApp(stock=stock)
+    async with app.run_test() as pilot:
+        table = app.query_one(DataTable)
+        start = time.perf_counter()
+        if stock:
+            table.add_columns(*[key.title() for key in records[0].keys()])
+            for row in records:
+                table.add_row(*(row.values()))
+        else:
+            await table.add_records(records, chunk_size=chunk_size)
+        added = time.perf_counter() - start
+        await pilot.pause()
+        settled = time.perf_counter() - start
+        await pilot.press("ctrl+q")
+    return {
+        "rows": rows,
+        "stock": stock,
+        "chunk_size": chunk_size,
+        "add_time": added,
+        "settle_time": settled,
+        "rows_per_second": rows / settled
+    }
+
+
+async def benchmark_sort(rows: int, stock: bool = False) -> dict[str, Any]:
+    """
+    Measure header sorting: first sort of a column, flipping its direction, and sorting
+    again after new rows were added
+    :param rows: Number of synthetic records
+    :param stock: If True, use the stock DataTable.sort
+    :return: Measurements
+    """
+    records = synthetic_records(rows + 1_000)
+    app = IngestApp()
+    async with app.run_test() as pilot:
+        table = app.query_one(GroceryTable)
+        await table.add_records(records[:rows])
+        sort = super(GroceryTable, table).sort if stock else table.sort
+        timings = {}
+        for name, column, reverse in (
+                ("first_sort", "credentialid", False),
+                ("reverse_sort", "credentialid", True),
+                ("text_sort", "city", False)
+        ):
+            start = time.perf_counter()
+            sort(column, reverse=reverse)
+            timings[name] = time.perf_counter() - start
+        await table.add_records(records[rows:])
+        start = time.perf_counter()
+        sort("credentialid", reverse=False)
+        timings["sort_after_add"] = time.perf_counter() - start
+        await pilot.press("ctrl+q")
+    return {"rows": rows, "stock": stock, **timings}
+
+
+async def benchmark_refresh(rows: int, changed: int) -> dict[str, Any]:
+    """
+    Measure how long it takes to apply a new copy of the dataset where only a few records changed
+    :param rows: Number of synthetic records
+    :param changed: Records updated, and also records removed and added
+    :return: Measurements
+    """
+    records = synthetic_records(rows)
+    fresh = [dict(record) for record in records[changed:]]
+    for record in fresh[:changed]:
+        record["status"] = "SUSPENDED"
+    fresh.extend(
+        {**record, "credentialid": f"new-{record['credentialid']}"} for record in records[:changed]
+    )
+    app = IngestApp()
+    async with app.run_test() as pilot:
+        table = app.query_one(GroceryTable)
+        await table.add_records(records)
+        table.sort("name")
+        await pilot.pause()
+        start = time.perf_counter()
+        changes = await table.sync_records(fresh)
+        synced = time.perf_counter() - start
+        await pilot.pause()
+        settled = time.perf_counter() - start
+        await pilot.press("ctrl+q")
+    return {
+        "rows": rows,
+        "inserted": changes.inserted,
+        "updated": changes.updated,
+        "deleted": changes.deleted,
+        "sync_time": synced,
+        "settle_time": settled
+    }
+
+
+async def palette_keystrokes(app: App, pilot: Any, query: str = PALETTE_QUERY) -> list[float]:
+    """
+    Open the command palette and type the query, one key at a time
+    :param app: Application under test
+    :param pilot: Pilot driving the application
+    :param query: Text typed on the palette
+    :return: Seconds from each key press until the palette shows the new matches
+    """
+    app.action_command_palette()
+    await pilot.pause()
+    latencies = []
+    for char in query:
+        start = time.perf_counter()
+        await pilot.press(char)
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        latencies.append(time.perf_counter() - start)
+    await pilot.press("escape")
+    await pilot.pause()
+    return latencies
+
+
+async def benchmark_app(
+        rows: int,
+        page_size: int = PAGE_SIZE,
+        window: int = MAX_PAGES_IN_FLIGHT
+) -> dict[str, Any]:
+    """
+    Measure the whole application against the stand-in server: cold start, time to first row,
+    total load, header sort and command palette latency per keystroke
+    :param rows: Number of synthetic records
+    :param page_size: Records per page, 0 to use a single request
+    :param window: Pages in flight
+    :return: Measurements
+    """
+    with serve(synthetic_records(rows)) as url:
+        start = time.perf_counter()
+        app = GroceryStoreApp(url=url, page_size=page_size, window=window)
+        async with app.run_test() as pilot:
+            cold_start = time.perf_counter() - start
+            await wait_for_load(app, pilot, timeout=600)
+            await pilot.pause()
+            table = app.query_one("#grocery_store_table", GroceryTable)
+            start = time.perf_counter()
+            table.sort("name", reverse=table.sort_reverse("name"))
+            await pilot.pause()
+            sort_time = time.perf_counter() - start
+            latencies = await palette_keystrokes(app, pilot)
+            await pilot.press("ctrl+q")
+    return {
+        "rows": rows,
+        "cold_start_s": cold_start,
+        "first_row_s": app.time_to_first_row,
+        "load_s": app.load_time,
+        "sort_s": sort_time,
+        "palette_keystroke_s": sum(latencies) / len(latencies),
+        "palette_keystroke_max_s": max(latencies)
+    }
+
+
+def benchmark_filter(rows: int, queries: list[str], per_row: bool = True) -> dict[str, Any]:
+    """
+    Measure filter latency on the columnar copy of the dataset, against checking one record at a
+    time
+    :param rows: Number of synthetic records
+    :param queries: Filters, same syntax as the filter bar
+    :param per_row: If True, also time the per-record check
+    :return: Time to build the columns, and matches and latency of each filter
+    """
+    records = synthetic_records(rows)
+    start = time.perf_counter()
+    dataset = RecordColumns()
+    for page in range(0, rows, PAGE_SIZE):
+        dataset.extend(records[page:page + PAGE_SIZE])
+    build_time = time.perf_counter() - start
+    filters = []
+    for query in queries:
+        record_filter = parse_filter(query)
+        start = time.perf_counter()
+        matches = dataset.mask(record_filter.predicates).count(1)
+        columnar = time.perf_counter() - start
+        per_row_time = None
+        if per_row:
+            start = time.perf_counter()
+            if matches != sum(map(record_filter.matches, records)):
+                raise AssertionError(f"Columnar and per-record filters disagree on {query}")
+            per_row_time = time.perf_counter() - start
+        filters.append(
+            {"query": query, "matches": matches, "columnar": columnar, "per_row": per_row_time}
+        )
+    return {"rows": rows, "build_time": build_time, "filters": filters}
+
+
+async def benchmark_pushdown(rows: int, query: str, page_size: int = PAGE_SIZE) -> dict[str, Any]:
+    """
+    Measure how much a filter pushed down to the portal saves, downloading from the stand-in
+    server the whole dataset and then only the matching rows and columns
+    :param rows: Number of synthetic records
+    :param query: Filter, same syntax as the filter bar
+    :param page_size: Records per page
+    :return: Records, bytes and seconds of each download
+    """
+    transferred = []
+
+    async def count_bytes(response: httpx.Response) -> None:
+        await response.aread()
+        transferred[-1] += len(response.content)
+
+    result: dict[str, Any] = {"rows": rows, "query": query}
+    with serve(synthetic_records(rows)) as url:
+        async with httpx.AsyncClient(event_hooks={"response": [count_bytes]}) as client:
+            for name, params in (
+                    ("full", None),
+                    ("pushdown", parse_filter(query).soql_params(GroceryTable.KEY_FIELDS))
+            ):
+                transferred.append(0)
+                start = time.perf_counter()
+                records = 0
+                async for page in fetch_pages(client, url, page_size=page_size, query=params):
+                    records += len(page)
+                result[f"{name}_time"] = time.perf_counter() - start
+                result[f"{name}_records"] = records
+                result[f"{name}_bytes"] = transferred[-1]
+    return result
+
+
+def spatial_queries(
+        located: list[Place],
+        queries: int,
+        seed: int
+) -> tuple[list[tuple[float, float]], list[str]]:
+    """
+    Random points around the towns, and addresses of random stores
+    :param located: Stores with a location
+    :param queries: Points (and addresses) to generate
+    :param seed: Random seed
+    :return: Points and addresses
+    """
+    rnd = random.Random(seed)
+    points = [
+        (lat + rnd.uniform(-0.1, 0.1), lon + rnd.uniform(-0.1, 0.1))
+        for lat, lon in (rnd.choice(list(TOWN_CENTERS.values())) for _ in range(queries))
+    ]
+    addresses = [f"{place.address}, {place.city}" for place in rnd.choices(located, k=queries)]
+    return points, addresses
+
+
+def benchmark_spatial(
+        rows: int,
+        queries: int,
+        k: int = 5,
+        radius_km: float = 1.0
+) -> dict[str, Any]:
+    """
+    Measure the spatial index: build, save and load, and the latency of each kind of query
+    :param rows: Number of synthetic records
+    :param queries: Random points (and addresses) queried
+    :param k: Stores per nearest query
+    :param radius_km: Radius of the within queries
+    :return: Measurements, query latencies are averages per query
+    """
+    located = places(synthetic_records(rows))
+    points, addresses = spatial_queries(located, queries, rows)
+    result: dict[str, Any] = {"rows": rows}
+    start = time.perf_counter()
+    index = SpatialIndex(located)
+    result["build_time"] = time.perf_counter() - start
+    saved = index.to_bytes()
+    result["saved_bytes"] = len(saved)
+    start = time.perf_counter()
+    SpatialIndex.from_bytes(saved)
+    result["load_time"] = time.perf_counter() - start
+    start = time.perf_counter()
+    index.nearest_many(points, k)
+    result["nearest_time"] = (time.perf_counter() - start) / queries
+    start = time.perf_counter()
+    found = sum(len(index.within(lat, lon, radius_km)) for lat, lon in points)
+    result["within_time"] = (time.perf_counter() - start) / queries
+    result["within_found"] = found / queries
+    start = time.perf_counter()
+    index.geocode(addresses)
+    result["geocode_time"] = (time.perf_counter() - start) / queries
+    return result
+
+
+def peak_rss_mib() -> float:
+    """
+    Peak resident memory of this process, Linux reports it in KiB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def environment() -> dict[str, Any]:
+    """
+    Where a baseline was measured
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "textual": textual.__version__,
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+
+def summarize(samples: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Median of every measurement over repeated runs, and its spread
+    :param samples: Results of the same measurement
+    :return: Medians, the number of samples and the spread (largest minus smallest) of each metric
+    """
+    result = dict(samples[0])
+    spread = {}
+    for metric, value in samples[0].items():
+        if isinstance(value, float):
+            values = [sample[metric] for sample in samples if sample.get(metric) is not None]
+            result[metric] = statistics.median(values)
+            spread[metric] = max(values) - min(values)
+    return {**result, "samples": len(samples), "spread": spread}
+
+
+def compare_results(
+        baseline: list[dict[str, Any]],
+        results: list[dict[str, Any]],
+        threshold: float = REGRESSION_THRESHOLD
+) -> list[str]:
+    """
+    Metrics that got worse than on the baseline, matched by dataset size. Every metric is lower
+    is better, and only a median above the baseline median plus its spread counts.
+    :param baseline: Results saved before
+    :param results: New results
+    :param threshold: Growth, as a fraction, flagged as a regression
+    :return: One description per regression
+    """
+    previous = {result["rows"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result["rows"])
+        if old is None:
+            continue
+        for metric, value in result.items():
+            floor = next(
+                (floor for suffix, floor in NOISE_FLOOR.items() if metric.endswith(suffix)), None
+            )
+            if floor is None or old.get(metric) is None or value is None:
+                continue
+            spread = old.get("spread", {}).get(metric, 0.0)
+            limit = old[metric] + spread
+            if value > limit * (1 + threshold) and value - limit > floor:
+                regressions.append(
+                    f"rows={result['rows']:,} {metric}: "
+                    f"{old[metric]:.4f} ±{spread:.4f} -> {value:.4f}"
+                )
+    return regressions
+
+
+def run_suite(
+        sizes: list[int],
+        page_size: int,
+        window: int,
+        repeat: int = SUITE_REPEAT
+) -> list[dict[str, Any]]:
+    """
+    Measure the application at every size, each run on a new process so cold start and peak RSS
+    are not shared
+    :return: Median and spread of the runs of each size
+    """
+    results = []
+    for rows in sizes:
+        samples = []
+        for _ in range(repeat):
+            completed = subprocess.run(
+                [
+                    sys.executable, "-m", "grocery_stores_ct.benchmark", "suite-run",
+                    "--rows", str(rows), "--page-size", str(page_size), "--window", str(window)
+                ],
+                check=True,
+                capture_output=True,
+                text=True
+            )
+            samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        result = summarize(samples)
+        spread = result["spread"]
+        print(" ".join(
+            f"{metric}={value:.4f}" + (f"±{spread[metric]:.4f}" if spread.get(metric) else "")
+            if isinstance(value, float) else f"{metric}={value:,}"
+            for metric, value in result.items() if metric != "spread"
+        ))
+        results.append(result)
+    return results
+
+
+def save_baseline(path: Path, results: list[dict[str, Any]]) -> None:
+    """
+    Save suite results, and where they were measured, as a JSON baseline
+    """
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump({"environment": environment(), "results": results}, baseline_file, indent=2)
+
+
+def compare_baseline(
+        path: Path,
+        results: list[dict[str, Any]],
+        threshold: float = REGRESSION_THRESHOLD
+) -> list[str]:
+    """
+    Compare suite results with a JSON baseline
+    :return: Regressions against the baseline
+    """
+    with open(path, "r", encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"Compared with {path} (commit {baseline['environment'].get('commit')})")
+    return compare_results(baseline["results"], results, threshold)
+
+
+def run_load(options: Namespace) -> None:
+    """
+    Time to first row and total load time, at every size
+    """
+    for rows in options.rows:
+        result = asyncio.run(benchmark_load(
+            rows, options.page_size, options.window, latency=options.latency, warm=options.warm
+        ))
+        print(
+            f"rows={result['rows']:,} page_size={result['page_size']} window={result['window']} "
+            f"warm={result['warm']} "
+            f"first_row={result['time_to_first_row']:.3f}s total={result['load_time']:.3f}s "
+            f"settled={result['settle_time']:.3f}s"
+        )
+
+
+def run_ingest(options: Namespace) -> None:
+    """
+    Rows per second added to the table, at every size
+    """
+    for rows in options.rows:
+        result = asyncio.run(benchmark_ingest(rows, options.chunk_size, options.stock))
+        print(
+            f"rows={result['rows']:,} stock={result['stock']} add={result['add_time']:.3f}s "
+            f"settled={result['settle_time']:.3f}s rows/sec={result['rows_per_second']:,.0f}"
+        )
+
+
+def run_sort(options: Namespace) -> None:
+    """
+    Header sort latency, at every size
+    """
+    for rows in options.rows:
+        result = asyncio.run(benchmark_sort(rows, options.stock))
+        print(
+            f"rows={result['rows']:,} stock={result['stock']} first={result['first_sort']:.4f}s "
+            f"reverse={result['reverse_sort']:.4f}s text={result['text_sort']:.4f}s "
+            f"after_add={result['sort_after_add']:.4f}s"
+        )
+
+
+def run_refresh(options: Namespace) -> None:
+    """
+    Time to apply a new copy of the dataset with few changes, at every size
+    """
+    for rows in options.rows:
+        result = asyncio.run(benchmark_refresh(rows, options.changed))
+        print(
+            f"rows={result['rows']:,} inserted={result['inserted']} updated={result['updated']} "
+            f"deleted={result['deleted']} sync={result['sync_time']:.3f}s "
+            f"settled={result['settle_time']:.3f}s"
+        )
+
+
+def run_suite_command(options: Namespace) -> None:
+    """
+    Run the suite, save and compare it. Exit code is 1 on regressions
+    """
+    results = run_suite(options.rows, options.page_size, options.window, options.repeat)
+    if options.save:
+        save_baseline(options.save, results)
+    regressions = []
+    if options.compare:
+        regressions = compare_baseline(options.compare, results, options.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+def run_suite_run(options: Namespace) -> None:
+    """
+    Single suite measurement, printed as a JSON line
+    """
+    result = asyncio.run(benchmark_app(options.rows, options.page_size, options.window))
+    print(json.dumps({**result, "peak_rss_mib": peak_rss_mib()}))
+
+
+def run_filter(options: Namespace) -> None:
+    """
+    Filter latency at every size, and optionally the pushdown of the first filter
+    """
+    for rows in options.rows:
+        result = benchmark_filter(rows, options.query, not options.no_per_row)
+        print(f"rows={result['rows']:,} build={result['build_time']:.3f}s")
+        for measured in result["filters"]:
+            per_row = "-"
+            if measured["per_row"] is not None:
+                per_row = f"{measured['per_row'] * 1000:.1f}ms"
+            print(
+                f"  {measured['query']}: matches={measured['matches']:,} "
+                f"columnar={measured['columnar'] * 1000:.1f}ms per_row={per_row}"
+            )
+    if options.pushdown:
+        result = asyncio.run(benchmark_pushdown(options.pushdown, options.query[0]))
+        print(
+            f"rows={result['rows']:,} {result['query']}: "
+            f"full={result['full_records']:,} records {result['full_bytes']:,} bytes "
+            f"{result['full_time']:.3f}s "
+            f"pushdown={result['pushdown_records']:,} records {result['pushdown_bytes']:,} bytes "
+            f"{result['pushdown_time']:.3f}s"
+        )
+
+
+def run_spatial(options: Namespace) -> None:
+    """
+    Spatial index build and query latency, at every size
+    """
+    for rows in options.rows:
+        result = benchmark_spatial(rows, options.queries, options.k, options.radius)
+        print(
+            f"rows={result['rows']:,} build={result['build_time']:.3f}s "
+            f"saved={result['saved_bytes']:,} bytes load={result['load_time']:.3f}s "
+            f"nearest={result['nearest_time'] * 1e6:.1f}us "
+            f"within={result['within_time'] * 1e6:.1f}us ({result['within_found']:.1f} stores) "
+            f"geocode={result['geocode_time'] * 1e6:.1f}us"
+        )
+
+
+def build_parser() -> ArgumentParser:
+    """
+    Command line of the benchmarks, every subcommand knows which function runs it
+    """
+    parser = ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    load = subparsers.add_parser("load", help="Time to first row and total load time")
+    load.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000], help="Dataset sizes"
+    )
+    load.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated server latency, in seconds"
+    )
+    load.add_argument(
+        "--warm", action="store_true", default=False, help="Measure a start from the on-disk cache"
+    )
+    load.set_defaults(run=run_load)
+    ingest = subparsers.add_parser("ingest", help="Rows per second added to the table")
+    ingest.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Dataset sizes"
+    )
+    ingest.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per chunk")
+    ingest.add_argument(
+        "--stock", action="store_true", default=False, help="Use the stock DataTable.add_row"
+    )
+    ingest.set_defaults(run=run_ingest)
+    sort = subparsers.add_parser("sort", help="Header sort latency")
+    sort.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000], help="Dataset sizes"
+    )
+    sort.add_argument(
+        "--stock", action="store_true", default=False, help="Use the stock DataTable.sort"
+    )
+    sort.set_defaults(run=run_sort)
+    refresh = subparsers.add_parser(
+        "refresh", help="Apply a new copy of the dataset with few changes"
+    )
+    refresh.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000], help="Dataset sizes"
+    )
+    refresh.add_argument(
+        "--changed", type=int, default=10, help="Records added, updated and removed"
+    )
+    refresh.set_defaults(run=run_refresh)
+    suite = subparsers.add_parser(
+        "suite",
+        help="Cold start, first row, sort, palette keystroke latency and peak RSS at several sizes"
+    )
+    suite.add_argument(
+        "--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Dataset sizes"
+    )
+    suite.add_argument("--save", type=Path, help="Save the results as a JSON baseline")
+    suite.add_argument(
+        "--compare", type=Path, help="JSON baseline to compare with, exit code is 1 on regressions"
+    )
+    suite.add_argument(
+        "--threshold", type=float, default=REGRESSION_THRESHOLD,
+        help="Growth flagged as a regression"
+    )
+    suite.add_argument(
+        "--repeat", type=int, default=SUITE_REPEAT, help="Runs of each size, the median is kept"
+    )
+    suite.set_defaults(run=run_suite_command)
+    suite_run = subparsers.add_parser("suite-run", help="Single suite measurement, in this process")
+    suite_run.add_argument("--rows", type=int, required=True, help="Dataset size")
+    suite_run.set_defaults(run=run_suite_run)
+    for subparser in (load, suite, suite_run):
+        subparser.add_argument(
+            "--page-size", type=int, default=PAGE_SIZE,
+            help="Records per page, 0 for a single request"
+        )
+        subparser.add_argument(
+            "--window", type=int, default=MAX_PAGES_IN_FLIGHT, help="Pages in flight"
+        )
+    filter_parser = subparsers.add_parser(
+        "filter", help="Filter latency on the columnar copy of the dataset"
+    )
+    filter_parser.add_argument(
+        "--rows", type=int, nargs="+", default=[1_000_000], help="Dataset sizes"
+    )
+    filter_parser.add_argument(
+        "--query", nargs="+", default=FILTER_QUERIES, help="Filters to measure"
+    )
+    filter_parser.add_argument(
+        "--no-per-row", action="store_true", default=False, help="Skip the per-record check"
+    )
+    filter_parser.add_argument(
+        "--pushdown", type=int, metavar="ROWS",
+        help="Also measure the first filter pushed down to the stand-in"
+    )
+    filter_parser.set_defaults(run=run_filter)
+    spatial = subparsers.add_parser(
+        "spatial", help="Nearest, within and geocode latency of the spatial index"
+    )
+    spatial.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000], help="Dataset sizes"
+    )
+    spatial.add_argument("--queries", type=int, default=1_000, help="Queries of each kind")
+    spatial.add_argument("-k", type=int, default=5, help="Stores per nearest query")
+    spatial.add_argument(
+        "--radius", type=float, default=1.0, help="Radius of the within queries, in kilometers"
+    )
+    spatial.set_defaults(run=run_spatial)
+    return parser
+
+
+def main():
+    """
+    Run the benchmarks from the command line
+    """
+    options = build_parser().parse_args()
+    options.run(options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+On-disk cache for the grocery dataset.
+Records are stored already parsed (using marshal, which is much faster to load than Json),
+next to a small Json file with the HTTP validators (ETag, Last-Modified) used to revalidate them
+and the spatial index built from them, if any.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import hashlib
+import marshal
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+# pylint: disable=no-name-in-module
+from orjson import loads, dumps, JSONDecodeError
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "grocery_stores"
+MAX_AGE = 24 * 60 * 60
+MAX_SIZE = 256 * 1024 * 1024
+PAYLOAD_SUFFIX = ".marshal"
+META_SUFFIX = ".json"
+SPATIAL_SUFFIX = ".spatial"
+
+
+@dataclass
+class CacheEntry:
+    """
+    Cached copy of a dataset
+    """
+    url: str
+    records: list[dict[str, Any]]
+    validators: dict[str, str] = field(default_factory=dict)
+    fetched_at: float = field(default_factory=time.time)
+    spatial: bytes | None = None  # Serialized SpatialIndex of the records
+
+    @property
+    def age(self) -> float:
+        """
+        Seconds since the dataset was downloaded or revalidated
+        """
+        return time.time() - self.fetched_at
+
+
+class GroceryCache:
+    """
+    Keeps one entry per dataset URL. Entries older than `max_age` seconds must be revalidated
+    before trusting them, and least recently used entries are removed once the cache grows
+    past `max_size` bytes.
+    """
+
+    def __init__(
+            self,
+            directory: Path = CACHE_DIR,
+            max_age: float = MAX_AGE,
+            max_size: int = MAX_SIZE
+    ):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_size = max_size
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.directory / f"{key}{PAYLOAD_SUFFIX}", self.directory / f"{key}{META_SUFFIX}"
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """
+        Check if the entry can be used without revalidation
+        :param entry: Cached entry
+        :return: True if the entry is younger than max_age
+        """
+        return entry.age < self.max_age
+
+    def load(self, url: str) -> CacheEntry | None:
+        """
+        Load the cached copy of a dataset
+        :param url: Dataset URL
+        :return: Cached entry, None if missing, unreadable or written by a different Python version
+        """
+        payload, meta = self._paths(url)
+        try:
+            metadata = loads(meta.read_bytes())
+            if metadata.get("python") != list(sys.version_info[:2]) or metadata.get("url") != url:
+                return None
+            records = marshal.loads(payload.read_bytes())
+            os.utime(payload)  # Mark as recently used
+        except (OSError, EOFError, ValueError, TypeError, JSONDecodeError):
+            return None
+        try:
+            spatial = payload.with_suffix(SPATIAL_SUFFIX).read_bytes()
+        except OSError:
+            spatial = None
+        return CacheEntry(
+            url=url,
+            records=records,
+            validators=metadata.get("validators", {}),
+            fetched_at=metadata.get("fetched_at", 0.0),
+            spatial=spatial
+        )
+
+    def store(self, entry: CacheEntry) -> None:
+        """
+        Save a dataset, then evict old entries if the cache is too big
+        :param entry: Entry to save
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        payload, _ = self._paths(entry.url)
+        self._write(payload, marshal.dumps(entry.records))
+        if entry.spatial is not None:
+            self._write(payload.with_suffix(SPATIAL_SUFFIX), entry.spatial)
+        else:
+            payload.with_suffix(SPATIAL_SUFFIX).unlink(missing_ok=True)
+        self._write_meta(entry.url, entry.validators, entry.fetched_at)
+        self.evict()
+
+    def touch(self, url: str, validators: dict[str, str]) -> None:
+        """
+        Record a successful revalidation, without rewriting the records
+        :param url: Dataset URL
+        :param validators: Validators returned by the server
+        """
+        self._write_meta(url, validators, time.time())
+
+    def evict(self) -> list[Path]:
+        """
+        Remove least recently used entries until the cache fits in max_size
+        :return: Removed payloads
+        """
+        payloads = []
+        for payload in self.directory.glob(f"*{PAYLOAD_SUFFIX}"):
+            try:
+                stat = payload.stat()
+            except FileNotFoundError:
+                continue
+            spatial = payload.with_suffix(SPATIAL_SUFFIX)
+            size = stat.st_size + (spatial.stat().st_size if spatial.exists() else 0)
+            payloads.append((stat.st_mtime, size, payload))
+        total = sum(size for _, size, _ in payloads)
+        removed = []
+        for _, size, payload in sorted(payloads):
+            if total <= self.max_size:
+                break
+            payload.unlink(missing_ok=True)
+            payload.with_suffix(META_SUFFIX).unlink(missing_ok=True)
+            payload.with_suffix(SPATIAL_SUFFIX).unlink(missing_ok=True)
+            total -= size
+            removed.append(payload)
+        return removed
+
+    def _write_meta(self, url: str, validators: dict[str, str], fetched_at: float) -> None:
+        _, meta = self._paths(url)
+        self._write(meta, dumps({
+            "url": url,
+            "python": list(sys.version_info[:2]),
+            "validators": validators,
+            "fetched_at": fetched_at
+        }))
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        """
+        Write to a temporary file first, so readers never see a partial file
+        """
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
@@ -0,0 +1,237 @@
+"""
+Columnar copy of a table, used to sort it without comparing row objects.
+Each column keeps its values in a typed array (numbers are parsed once, when the rows are added)
+and the permutation that sorts it, which is reused for both directions and patched with new,
+updated and removed rows instead of being recomputed.
+
+Shared by the tables of grocery_stores_ct and kodegeek_textualize: the canonical copy is
+grocery_stores_ct/column_store.py, kodegeek_textualize vendors it unchanged and its tests check
+that both copies match. Keep it on the standard library, and compatible with Python 3.9.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+from __future__ import annotations
+
+import math
+from array import array
+from collections.abc import Hashable, Iterable, Sequence
+from heapq import merge
+from itertools import accumulate, chain, zip_longest
+from typing import Any
+
+MISSING = math.inf  # Empty cells go last on numeric columns
+
+
+def parse_number(value: Any) -> float | None:
+    """
+    Parse numbers, and numbers stored as strings like Socrata does
+    :param value: Cell value
+    :return: The number, MISSING for empty cells, None if the value is not a number
+    """
+    if value is None or value == "":
+        return MISSING
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+class ColumnValues:
+    """
+    Values of a single column, numeric while every value parses as a number
+    """
+
+    def __init__(self):
+        self.numbers: array | None = array("d")
+        self.strings: list[str] = []
+        self.order: list[int] | None = None
+        self.ordered_len = 0
+        self.dirty: set[int] = set()
+
+    @staticmethod
+    def as_text(value: Any) -> str:
+        """
+        Text sort key of a cell
+        """
+        return value if isinstance(value, str) else ("" if value is None else str(value))
+
+    def extend(self, values: Sequence[Any]) -> None:
+        """
+        Append values, demoting the column to text once a value is not a number
+        :param values: New values
+        """
+        self.strings.extend(map(self.as_text, values))
+        if self.numbers is not None:
+            parsed = [parse_number(value) for value in values]
+            if None in parsed:
+                self.numbers = None
+                self.order = None
+            else:
+                self.numbers.extend(parsed)
+
+    def replace(self, position: int, value: Any) -> None:
+        """
+        Change the value of a single row, its place in the permutation is fixed on the next argsort
+        :param position: Row position
+        :param value: New value
+        """
+        self.strings[position] = self.as_text(value)
+        if self.numbers is not None:
+            number = parse_number(value)
+            if number is None:
+                self.numbers = None
+                self.order = None
+            else:
+                self.numbers[position] = number
+        if self.order is not None and position < self.ordered_len:
+            self.dirty.add(position)
+
+    def compact(self, keep: Sequence[bool], new_positions: Sequence[int]) -> None:
+        """
+        Drop removed rows
+        :param keep: For each old position, False if the row was removed
+        :param new_positions: For each old position, position after the removal
+        """
+        self.strings = [value for value, kept in zip(self.strings, keep) if kept]
+        if self.numbers is not None:
+            self.numbers = array("d", (value for value, kept in zip(self.numbers, keep) if kept))
+        if self.order is not None:
+            self.order = [new_positions[position] for position in self.order if keep[position]]
+            self.dirty = {new_positions[position] for position in self.dirty if keep[position]}
+            self.ordered_len = sum(keep[:self.ordered_len])
+
+    @property
+    def keys(self) -> Sequence[Any]:
+        """
+        Sort keys, one per row
+        """
+        return self.numbers if self.numbers is not None else self.strings
+
+    def argsort(self) -> list[int]:
+        """
+        Permutation of row positions that sorts this column in ascending order.
+        Rows added or updated since the last call are sorted on their own and merged in.
+        """
+        keys = self.keys
+        size = len(keys)
+        if self.order is None:
+            self.order = sorted(range(size), key=keys.__getitem__)
+        elif self.ordered_len < size or self.dirty:
+            changed = sorted(chain(self.dirty, range(self.ordered_len, size)), key=keys.__getitem__)
+            if self.dirty:
+                dirty = self.dirty
+                self.order = [position for position in self.order if position not in dirty]
+            self.order = list(merge(self.order, changed, key=keys.__getitem__))
+        self.ordered_len = size
+        self.dirty = set()
+        return self.order
+
+
+class ColumnStore:
+    """
+    Rows of a table, stored by column
+    """
+
+    def __init__(self):
+        self.row_keys: list[Hashable] = []
+        self.positions: dict[Hashable, int] = {}
+        self.columns: dict[Hashable, ColumnValues] = {}
+
+    def __len__(self) -> int:
+        return len(self.row_keys)
+
+    def add_column(self, column_key: Hashable, default: Any = None) -> None:
+        """
+        Add a column, pre-existing rows get the default value
+        :param column_key: Column key
+        :param default: Value for the rows already in the store
+        """
+        column = ColumnValues()
+        column.extend([default] * len(self.row_keys))
+        self.columns[column_key] = column
+
+    def extend(
+            self,
+            row_keys: Sequence[Hashable],
+            rows: Sequence[Sequence[Any]],
+            column_keys: Iterable[Hashable]
+    ) -> None:
+        """
+        Append rows
+        :param row_keys: Key of each row
+        :param rows: Cells of each row, in the same order as column_keys. Short rows are padded
+        with None.
+        :param column_keys: Column of each cell
+        """
+        start = len(self.row_keys)
+        self.positions.update(zip(row_keys, range(start, start + len(row_keys))))
+        self.row_keys.extend(row_keys)
+        transposed = zip_longest(*rows, fillvalue=None)
+        for column_key in column_keys:
+            self.columns[column_key].extend(next(transposed, None) or (None,) * len(rows))
+
+    def update(self, row_key: Hashable, column_key: Hashable, value: Any) -> None:
+        """
+        Change a single cell
+        :param row_key: Row key
+        :param column_key: Column key
+        :param value: New value
+        """
+        self.columns[column_key].replace(self.positions[row_key], value)
+
+    def remove(self, row_keys: Iterable[Hashable]) -> None:
+        """
+        Remove rows, in a single pass over the store
+        :param row_keys: Rows to remove
+        """
+        removed = {self.positions[row_key] for row_key in row_keys}
+        if not removed:
+            return
+        keep = [position not in removed for position in range(len(self.row_keys))]
+        new_positions = list(accumulate(keep, initial=-1))[1:]
+        self.row_keys = [row_key for row_key, kept in zip(self.row_keys, keep) if kept]
+        self.positions = {row_key: position for position, row_key in enumerate(self.row_keys)}
+        for column in self.columns.values():
+            column.compact(keep, new_positions)
+
+    def clear(self) -> None:
+        """
+        Remove all the rows, keep the columns
+        """
+        self.row_keys.clear()
+        self.positions.clear()
+        for column_key in self.columns:
+            self.columns[column_key] = ColumnValues()
+
+    def sorted_keys(self, column_key: Hashable, reverse: bool = False) -> list[Hashable]:
+        """
+        Row keys sorted by a column. Descending order walks the ascending permutation backwards,
+        so rows with equal values come out in reverse insertion order.
+        :param column_key: Column to sort by
+        :param reverse: Descending order if True
+        :return: Row keys, in display order
+        """
+        order = self.columns[column_key].argsort()
+        row_keys = self.row_keys
+        if reverse:
+            return [row_keys[position] for position in reversed(order)]
+        return [row_keys[position] for position in order]
+
+
+def sort_reverse(current_sorts: set[Hashable], sort_type: Hashable) -> bool:
+    """
+    Determine if `sort_type` is ascending or descending, each click on a column flips it
+    :param current_sorts: Columns whose next sort is descending, updated in place
+    :param sort_type: Column clicked
+    :return: True if the sort is descending
+    """
+    reverse = sort_type in current_sorts
+    if reverse:
+        current_sorts.remove(sort_type)
+    else:
+        current_sorts.add(sort_type)
+    return reverse
@@ -0,0 +1,189 @@
+"""
+The whole grocery dataset, kept as dictionary encoded columns (RecordColumns), to filter it
+without walking the records: a predicate is evaluated once per distinct value and turned into
+a mask with a single bytes.translate (or map) over the codes of the column.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+from array import array
+from collections.abc import Iterable, Sequence
+from itertools import compress, repeat
+from operator import methodcaller
+from typing import Any
+
+from grocery_stores_ct.column_store import ColumnValues
+from grocery_stores_ct.filters import Predicate, SEARCHES
+
+BYTE_CODES = 256  # Columns with up to this many distinct values use one byte per row
+FEW_CODES = 16  # Up to this many matching values, rows are found by searching their codes
+# Comparisons with the value on the left, 'cell < value' is 'value > cell'
+REFLECTED = {"<": "__gt__", "<=": "__ge__", ">": "__lt__", ">=": "__le__"}
+
+
+class DictionaryColumn:
+    """
+    Text column stored as one code per row and the list of distinct values. Codes take one byte
+    per row until the column has more than BYTE_CODES distinct values, then four.
+    """
+
+    def __init__(self):
+        self.values: list[str] = []
+        self.index: dict[str, int] = {}
+        self.codes: bytearray | array = bytearray()
+        self._upper: list[str] | None = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def extend(self, values: Sequence[Any]) -> None:
+        """
+        Append values, new distinct values get the next code
+        :param values: Cell values, None is stored as an empty string
+        """
+        if set(map(type, values)) - {str}:
+            values = list(map(ColumnValues.as_text, values))
+        index = self.index
+        added = list(set(values).difference(index))
+        if added:
+            index.update(zip(added, range(len(self.values), len(self.values) + len(added))))
+            self.values.extend(added)
+            self._upper = None
+        if isinstance(self.codes, bytearray) and len(index) > BYTE_CODES:
+            self.codes = array("I", list(self.codes))  # Not the bytes buffer, one code per byte
+        self.codes.extend(map(index.__getitem__, values))
+
+    def _upper_values(self) -> list[str]:
+        """
+        Distinct values in upper case, for the searches that ignore case
+        """
+        if self._upper is None:
+            self._upper = [value.upper() for value in self.values]
+        return self._upper
+
+    def lookup(self, predicate: Predicate) -> bytearray:
+        """
+        Evaluate a predicate on the distinct values
+        :param predicate: Condition, the column is ignored
+        :return: One byte per distinct value, 1 if it matches
+        """
+        values = self.values
+        value = predicate.value
+        match predicate.op:
+            case "=" | "!=":
+                found = bytearray(len(values))
+                code = self.index.get(value)
+                if code is not None:
+                    found[code] = 1
+                if predicate.op == "!=":
+                    found = found.translate(bytes([1, 0]) + bytes(254))
+                return found
+            case "~" | "^":
+                search = SEARCHES[predicate.op]
+                return bytearray(map(search, self._upper_values(), repeat(value.upper())))
+            case "<" | "<=" | ">" | ">=":
+                return bytearray(map(getattr(value, REFLECTED[predicate.op]), values))
+        raise ValueError(f"Unknown operator {predicate.op}")
+
+    def mask(self, predicate: Predicate) -> bytes:
+        """
+        Evaluate a predicate on every row
+        :param predicate: Condition, the column is ignored
+        :return: One byte per row, 1 if it matches
+        """
+        found = self.lookup(predicate)
+        codes = self.codes
+        if isinstance(codes, bytearray):
+            return bytes(codes.translate(bytes(found) + bytes(BYTE_CODES - len(found))))
+        if found.count(1) > FEW_CODES:
+            return bytes(map(found.__getitem__, codes))
+        # A few matching values, like an equality on a unique column: search their codes
+        # on the raw array instead of looking up every row
+        mask = bytearray(len(codes))
+        raw = codes.tobytes()
+        size = codes.itemsize
+        code = found.find(1)
+        while code >= 0:
+            pattern = array(codes.typecode, [code]).tobytes()
+            position = raw.find(pattern)
+            while position >= 0:
+                if position % size == 0:
+                    mask[position // size] = 1
+                    position = raw.find(pattern, position + size)
+                else:
+                    position = raw.find(pattern, position + 1)
+            code = found.find(1, code + 1)
+        return bytes(mask)
+
+    def take(self, mask: bytes) -> list[str]:
+        """
+        Values of the rows selected by a mask
+        :param mask: One byte per row
+        :return: Values, in row order
+        """
+        return list(map(self.values.__getitem__, compress(self.codes, mask)))
+
+
+class RecordColumns:
+    """
+    Compact copy of the whole dataset, one DictionaryColumn per field. Used to filter the
+    records locally, when they are on the cache, instead of asking the portal again.
+    """
+
+    def __init__(self, records: Iterable[dict[str, Any]] = ()):
+        self.columns: dict[str, DictionaryColumn] = {}
+        self.size = 0
+        self.extend(list(records))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def extend(self, records: Sequence[dict[str, Any]]) -> None:
+        """
+        Append records, fields not seen before get a new column with empty values for the previous
+        rows
+        :param records: Json records
+        """
+        if not records:
+            return
+        known = self.columns.keys()
+        for record in records:
+            if known >= record.keys():
+                continue
+            for key in record:
+                if key not in self.columns:
+                    column = DictionaryColumn()
+                    column.extend([""] * self.size)
+                    self.columns[key] = column
+        for key, column in self.columns.items():
+            column.extend(list(map(methodcaller("get", key, ""), records)))
+        self.size += len(records)
+
+    def mask(self, predicates: Sequence[Predicate]) -> bytes:
+        """
+        Rows where every predicate matches. Masks of each predicate are combined as big integers,
+        so the AND is done a machine word at a time.
+        :param predicates: Conditions, a column not in the dataset is always empty
+        :return: One byte per row, 1 if the row matches
+        """
+        combined = None
+        for predicate in predicates:
+            column = self.columns.get(predicate.column)
+            if column is None:
+                matched = predicate.matches("")
+                mask = bytes([int(matched)]) * self.size
+            else:
+                mask = column.mask(predicate)
+            combined = mask if combined is None else (
+                int.from_bytes(combined, "little") & int.from_bytes(mask, "little")
+            ).to_bytes(self.size, "little")
+        return combined if combined is not None else b"\x01" * self.size
+
+    def records(self, mask: bytes, columns: Sequence[str] = ()) -> list[dict[str, Any]]:
+        """
+        Rebuild the records selected by a mask, missing values come back as empty strings
+        :param mask: One byte per row, from mask()
+        :param columns: Fields to keep, all of them if empty
+        :return: Json records
+        """
+        names = [name for name in (columns or self.columns) if name in self.columns]
+        values = [self.columns[name].take(mask) for name in names]
+        return [dict(zip(names, row)) for row in zip(*values)]
@@ -0,0 +1,186 @@
+"""
+Filters typed on the filter bar, turned into SoQL for the data portal or evaluated locally.
+
+Each word of the filter is a predicate, all of them must match:
+
+city=HARTFORD           equal (case-sensitive, like SoQL)
+status!=ACTIVE          not equal
+name~market             contains, ignoring case
+name^big                starts with, ignoring case
+zip>=06500              text comparison, also <, <= and >
+market                  a bare word is the same as name~market
+$select=name,city,zip   only these columns (the key fields are always added)
+
+Quote values with spaces: city="NEW HAVEN". Like the portal does with text columns,
+comparisons are done on the text, so numbers must have the same number of digits.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import operator
+import re
+import shlex
+from dataclasses import dataclass, field
+from typing import Any, Sequence
+
+DEFAULT_COLUMN = "name"
+OPERATORS = ("!=", "<=", ">=", "=", "~", "^", "<", ">")
+TOKEN = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)(!=|<=|>=|=|~|\^|<|>)(.*)$", re.DOTALL)
+COLUMN_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# SoQL written by to_where, the stand-in server reads it back with parse_where
+SOQL_FUNCTION = re.compile(
+    r"^(contains|starts_with)\(upper\(([A-Za-z_][A-Za-z0-9_]*)\), '((?:[^']|'')*)'\)$"
+)
+SOQL_COMPARISON = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*) (!=|<=|>=|=|<|>) '((?:[^']|'')*)'$")
+SOQL_FUNCTIONS = {"~": "contains", "^": "starts_with"}
+# Text comparisons, and the searches that ignore case (both sides in upper case)
+COMPARISONS = {
+    "=": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge
+}
+SEARCHES = {"~": str.__contains__, "^": str.startswith}
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """
+    Condition on a single column
+    """
+    column: str
+    op: str
+    value: str
+
+    def matches(self, value: Any) -> bool:
+        """
+        Evaluate the predicate on a single cell, the slow reference for the vectorized version
+        :param value: Cell value, missing cells are empty strings
+        :return: True if the cell matches
+        """
+        text = value if isinstance(value, str) else ("" if value is None else str(value))
+        if self.op in SEARCHES:
+            return SEARCHES[self.op](text.upper(), self.value.upper())
+        if self.op in COMPARISONS:
+            return COMPARISONS[self.op](text, self.value)
+        raise ValueError(f"Unknown operator {self.op}")
+
+    def to_soql(self) -> str:
+        """
+        SoQL condition, values are quoted with single quotes
+        """
+        quoted = self.value.upper() if self.op in SOQL_FUNCTIONS else self.value
+        quoted = "'" + quoted.replace("'", "''") + "'"
+        if self.op in SOQL_FUNCTIONS:
+            return f"{SOQL_FUNCTIONS[self.op]}(upper({self.column}), {quoted})"
+        return f"{self.column} {self.op} {quoted}"
+
+
+@dataclass(frozen=True)
+class RecordFilter:
+    """
+    Predicates that must all match, and the columns to show (all of them if empty)
+    """
+    predicates: tuple[Predicate, ...] = ()
+    select: tuple[str, ...] = ()
+    text: str = field(default="", compare=False)
+
+    def __bool__(self) -> bool:
+        return bool(self.predicates or self.select)
+
+    def matches(self, record: dict[str, Any]) -> bool:
+        """
+        Evaluate the filter on a single record, one predicate at a time
+        :param record: Json record
+        :return: True if every predicate matches
+        """
+        return all(
+            predicate.matches(record.get(predicate.column, "")) for predicate in self.predicates
+        )
+
+    def columns(self, key_fields: Sequence[str]) -> tuple[str, ...]:
+        """
+        Selected columns plus the key fields, so rows keep the same key as in the whole dataset
+        :param key_fields: Identifying fields of a record
+        :return: Columns to retrieve, empty for all of them
+        """
+        if not self.select:
+            return ()
+        return self.select + tuple(key for key in key_fields if key not in self.select)
+
+    def soql_params(self, key_fields: Sequence[str]) -> dict[str, str]:
+        """
+        Push the filter down to the data portal, so only the matching rows and the selected columns
+        are sent
+        :param key_fields: Identifying fields of a record
+        :return: '$where' and '$select' query parameters
+        """
+        params = {}
+        if self.predicates:
+            params["$where"] = to_where(self.predicates)
+        columns = self.columns(key_fields)
+        if columns:
+            params["$select"] = ",".join(columns)
+        return params
+
+
+def parse_filter(text: str) -> RecordFilter:
+    """
+    Parse the text typed on the filter bar
+    :param text: Filter, like 'city="NEW HAVEN" name~market $select=name,zip'
+    :return: Parsed filter, empty if the text is blank
+    """
+    try:
+        words = shlex.split(text)
+    except ValueError as ve:
+        raise ValueError(f"Invalid filter: {ve}") from ve
+    predicates = []
+    select = ()
+    for word in words:
+        if word.startswith("$select="):
+            columns = word[len("$select="):].split(",")
+            select = tuple(column.strip() for column in columns if column.strip())
+            invalid = [column for column in select if not COLUMN_NAME.match(column)]
+            if invalid or not select:
+                raise ValueError(f"Invalid column names on {word}")
+            continue
+        match = TOKEN.match(word)
+        if match:
+            column, op, value = match.groups()
+            predicates.append(Predicate(column, op, value))
+        elif word.startswith("$") or any(op in word for op in OPERATORS):
+            raise ValueError(f"Invalid condition {word}")
+        else:
+            predicates.append(Predicate(DEFAULT_COLUMN, "~", word))
+    return RecordFilter(tuple(predicates), select, text.strip())
+
+
+def to_where(predicates: Sequence[Predicate]) -> str:
+    """
+    SoQL '$where' clause, all the predicates must match
+    :param predicates: Conditions
+    :return: Where clause
+    """
+    return " AND ".join(predicate.to_soql() for predicate in predicates)
+
+
+def parse_where(where: str) -> tuple[Predicate, ...]:
+    """
+    Read back a '$where' clause written by to_where, values of 'contains' and 'starts_with' are
+    already upper case. Anything else is rejected, this is not a SoQL parser.
+    :param where: Where clause
+    :return: Conditions
+    """
+    predicates = []
+    # Split on the ANDs outside quotes
+    where = where.strip()
+    conditions = re.split(r" AND (?=(?:[^']*'[^']*')*[^']*$)", where) if where else ()
+    for condition in conditions:
+        match = SOQL_FUNCTION.match(condition)
+        if match:
+            function, column, value = match.groups()
+            op = next(op for op, name in SOQL_FUNCTIONS.items() if name == function)
+            predicates.append(Predicate(column, op, value.replace("''", "'")))
+            continue
+        match = SOQL_COMPARISON.match(condition)
+        if not match:
+            raise ValueError(f"Unsupported condition {condition}")
+        column, op, value = match.groups()
+        predicates.append(Predicate(column, op, value.replace("''", "'")))
+    return tuple(predicates)
@@ -2,70 +2,533 @@
 Displays the latest Grocery Store data from
 the Connecticut Data portal.
 Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
-Press ctrl+q to exit the application.
+Press ctrl+f to filter the stores (like 'city=HARTFORD name~market'), ctrl+q to exit the
+application.
+Type 'near <address or latitude,longitude>' on the command palette to find the nearest stores.
 """
 
+import asyncio
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from pathlib import Path
+from typing import Any, Sequence
+
 import httpx
 from httpx import HTTPStatusError
 from textual.app import App, ComposeResult
-from textual.widgets import DataTable, Header, Footer
+from textual.binding import Binding
+from textual.command import Hit, Hits, Provider
+from textual.widgets import DataTable, Header, Footer, Input
 from textual import work, on
-# pylint: disable=no-name-in-module
-from orjson import loads
+from textual.timer import Timer
+from textual.worker import Worker
+
+from grocery_stores_ct.cache import GroceryCache, CacheEntry, CACHE_DIR, MAX_AGE, MAX_SIZE
+from grocery_stores_ct.columns import RecordColumns
+from grocery_stores_ct.filters import RecordFilter, parse_filter
+from grocery_stores_ct.instrumentation import (
+    TRACER, InstrumentationOverlay, add_arguments, traced, tracing
+)
+from grocery_stores_ct.portal import (
+    fetch_all, fetch_pages, revalidate, PAGE_SIZE, MAX_PAGES_IN_FLIGHT
+)
+from grocery_stores_ct.spatial import Neighbor, Place, SpatialIndex, places
+from grocery_stores_ct.table import GroceryTable, Changes, CHUNK_SIZE, record_keys
 
 GROCERY_API_URL = "https://data.ct.gov/resource/fv3p-tf5m.json"
+REFRESH_INTERVAL = 60 * 60
+# auto: filter locally when the dataset is cached, on the portal otherwise
+FILTER_MODES = ("auto", "local", "portal")
+NEAREST_STORES = 10
+RADIUS_KM = 2.0
+
+
+class NearestStoreCommands(Provider):
+    """
+    'near <address or latitude,longitude>' lists the nearest stores,
+    selecting one moves the cursor to it
+    """
+    PREFIX = "near "
+
+    async def search(self, query: str) -> Hits:
+        app = self.app
+        spatial = getattr(app, "spatial", None)
+        if spatial is None or not query.lower().startswith(self.PREFIX):
+            return
+        target = query[len(self.PREFIX):].strip()
+        located = spatial.geocode([target])[0] if target else None
+        if located is None:
+            return
+        neighbors = spatial.nearest(located.lat, located.lon, k=NEAREST_STORES)
+        # A filter pushed down to the portal only downloaded, and indexed, the matching stores
+        spatial_filter = getattr(app, "spatial_filter", "")
+        among = f", among the stores that match {spatial_filter}" if spatial_filter else ""
+        for rank, neighbor in enumerate(neighbors):
+            place = neighbor.place
+            yield Hit(
+                1 - rank / NEAREST_STORES,
+                f"{neighbor.distance_km:.2f} km {place.name}, {place.address}, {place.city}",
+                partial(app.show_store, place),
+                help=f"Nearest to {target}, located by {located.precision}{among}"
+            )
 
 
-class GroceryStoreApp(App):
+class GroceryStoreApp(App):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
     TUI application that shows grocery stores in CT
     """
-    current_sorts: set = set()
+    AUTO_FOCUS = "#grocery_store_table"
+    COMMANDS = App.COMMANDS | {NearestStoreCommands}
+    BINDINGS = [Binding("ctrl+f", "focus('filter_bar')", "Filter")]
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            *,
+            url: str = GROCERY_API_URL,
+            page_size: int = PAGE_SIZE,
+            window: int = MAX_PAGES_IN_FLIGHT,
+            cache: GroceryCache | None = None,
+            refresh_interval: float | None = None,
+            overlay: bool = False,
+            record_filter: RecordFilter | None = None,
+            filter_mode: str = "auto"
+    ):
+        """
+        :param url: Dataset URL, can point to a local stand-in server
+        :param page_size: Records per page, 0 retrieves the whole dataset with a single request
+        :param window: Maximum number of pages requested concurrently
+        :param cache: On-disk cache of the dataset, None to always download it
+        :param refresh_interval: Seconds between checks for changes on the dataset, None to disable
+        them
+        :param overlay: Show the event loop lag and the slowest handlers, the tracer must be enabled
+        :param record_filter: Initial filter, parsed with parse_filter
+        :param filter_mode: Where filters run: 'local' keeps a columnar copy of the whole dataset,
+        'portal' pushes them down as SoQL, 'auto' filters locally when the dataset is cached
+        """
+        if filter_mode not in FILTER_MODES:
+            raise ValueError(f"Unknown filter mode {filter_mode}, use one of {FILTER_MODES}")
+        super().__init__()
+        self.url = url
+        self.page_size = page_size
+        self.window = window
+        self.cache = cache
+        self.refresh_interval = refresh_interval
+        self.overlay = overlay
+        self.record_filter = record_filter if record_filter is not None else RecordFilter()
+        self.filter_mode = filter_mode
+        self.dataset: RecordColumns | None = None
+        # Held while rows are added to the dataset and the table, so a new filter does not see half
+        # a page
+        self.table_lock = asyncio.Lock()
+        self.filter_time: float | None = None
+        self.places: list[Place] = []
+        self.spatial: SpatialIndex | None = None
+        # Filter of the stores on the spatial index, empty when it has the whole dataset
+        self.spatial_filter = ""
+        self.refresh_timer: Timer | None = None
+        self.validators: dict[str, str] = {}
+        # SoQL parameters of the request that returned the validators
+        self.validators_query: dict[str, str] = {}
+        self.load_started: float | None = None
+        self.time_to_first_row: float | None = None
+        self.load_time: float | None = None
 
     def compose(self) -> ComposeResult:
         header = Header(show_clock=True)
         yield header
-        table = DataTable(id="grocery_store_table")
+        yield Input(
+            value=self.record_filter.text,
+            placeholder=(
+                "Filter: city=HARTFORD status!=INACTIVE name~market zip>=06500 "
+                "$select=name,city,zip"
+            ),
+            id="filter_bar"
+        )
+        table = GroceryTable(id="grocery_store_table")
         yield table
+        if self.overlay:
+            yield InstrumentationOverlay()
         yield Footer()
 
     @work(exclusive=True)
+    @traced("update_grocery_data")
     async def update_grocery_data(self) -> None:
         """
-        Update the Grocery data table and provide some feedback to the user
+        Update the Grocery data table and provide some feedback to the user.
+        A cached copy is shown right away, and only revalidated with the server once it is too old.
+        A filter pushed down to the portal only downloads the matching stores, and skips the cache.
         :return:
         """
-        table = self.query_one("#grocery_store_table", DataTable)
+        table = self.query_one("#grocery_store_table", GroceryTable)
+        self.load_started = time.perf_counter()
+        self.dataset = RecordColumns() if self.keeps_dataset() else None
+        self.places = []
+        query = self.portal_query()
+
+        entry = self.cache.load(self.url) if self.cache and not query else None
+        if entry:
+            await self.show_records(table, entry.records)
+            await self.build_spatial_index(entry.spatial)
+            self.validators = entry.validators
+            self.validators_query = {}
+            self.loading_complete(table, f"Loaded {len(entry.records)} Grocery Stores from cache")
+            if self.cache.is_fresh(entry):
+                self.schedule_refresh()
+                return
 
         async with httpx.AsyncClient() as client:
-            response = await client.get(GROCERY_API_URL)
             try:
-                response.raise_for_status()
-                groceries_data = loads(response.text)
-                table.add_columns(*[key.title() for key in groceries_data[0].keys()])
-                cnt = 0
-                for row in groceries_data[1:]:
-                    table.add_row(*(row.values()))
-                    cnt += 1
-                table.loading = False
+                if entry:
+                    await self.refresh_from_portal(client, table)
+                else:
+                    records = [] if self.cache and not query else None
+                    if self.page_size:
+                        cnt = await self.stream_pages(client, table, records, query)
+                    else:
+                        records = await fetch_all(client, self.url, self.validators, query)
+                        cnt = await self.show_records(table, records)
+                    self.validators_query = query
+                    await self.build_spatial_index()
+                    if self.cache and not query:
+                        self.cache.store(CacheEntry(
+                            url=self.url,
+                            records=records,
+                            validators=self.validators,
+                            spatial=self.spatial.to_bytes()
+                        ))
+                    self.loading_complete(table, f"Loaded {cnt} Grocery Stores")
+            except HTTPStatusError as hse:
                 self.notify(
-                    message=f"Loaded {cnt} Grocery Stores",
-                    title="Data loading complete",
-                    severity="information"
-                )
-            except HTTPStatusError:
-                self.notify(
-                    message=f"HTTP code={response.status_code}, message={response.text}",
+                    message=f"HTTP code={hse.response.status_code}, message={hse.response.text}",
                     title="Could not download grocery data",
                     severity="error"
                 )
+            except httpx.HTTPError as he:
+                self.notify(
+                    message=f"{he}",
+                    title="Could not reach the CT Data portal",
+                    severity="warning" if entry else "error"
+                )
+        self.schedule_refresh()
+
+    def schedule_refresh(self) -> None:
+        """
+        Start checking for changes on the dataset, once it was loaded
+        """
+        if self.refresh_interval and not self.refresh_timer:
+            self.refresh_timer = self.set_interval(self.refresh_interval, self.refresh_grocery_data)
+
+    @work(exclusive=True, group="refresh")
+    @traced("refresh_grocery_data")
+    async def refresh_grocery_data(self) -> None:
+        """
+        Periodically check if the dataset changed, and apply only the differences to the table
+        :return:
+        """
+        table = self.query_one("#grocery_store_table", GroceryTable)
+        async with httpx.AsyncClient() as client:
+            try:
+                await self.refresh_from_portal(client, table)
+            except httpx.HTTPError as he:
+                self.notify(
+                    message=f"{he}",
+                    title="Could not refresh grocery data",
+                    severity="warning"
+                )
+
+    async def refresh_from_portal(
+            self,
+            client: httpx.AsyncClient,
+            table: GroceryTable
+    ) -> Changes | None:
+        """
+        Revalidate the data shown on the table, download the dataset only if it changed
+        and update the rows that were added, changed or removed.
+        :param client: HTTP client
+        :param table: Grocery table
+        :return: Changes applied to the table, None if the dataset did not change
+        """
+        query = self.portal_query()
+        # Validators of a different query would never match
+        validators = self.validators if query == self.validators_query else {}
+        modified, validators = await revalidate(
+            client, self.url, validators, self.page_size, query
+        )
+        if not modified:
+            if self.cache and not query:
+                self.cache.touch(self.url, validators)
+            return None
+        if self.page_size:
+            records = []
+            async for page in fetch_pages(
+                    client, self.url, page_size=self.page_size, window=self.window,
+                    validators=validators, query=query
+            ):
+                records.extend(page)
+        else:
+            records = await fetch_all(client, self.url, validators, query)
+        async with self.table_lock:
+            if query != self.portal_query():
+                # The filter changed while downloading, these records are from the old one
+                return None
+            visible = records
+            if self.dataset is not None:
+                self.dataset = RecordColumns()
+                await self.keep_records(records)
+                if self.record_filter:
+                    visible = self.filtered_dataset()
+            changes = await table.sync_records(visible)
+        self.validators = validators
+        self.validators_query = query
+        self.places = places(records)
+        await self.build_spatial_index()
+        if self.cache and not query:
+            self.cache.store(CacheEntry(
+                url=self.url,
+                records=records,
+                validators=validators,
+                spatial=self.spatial.to_bytes()
+            ))
+        if changes:
+            self.notify(
+                message=(
+                    f"{changes.inserted} new, {changes.updated} updated, "
+                    f"{changes.deleted} removed"
+                ),
+                title="Grocery data refreshed",
+                severity="information"
+            )
+        return changes
+
+    def loading_complete(self, table: GroceryTable, message: str) -> None:
+        """
+        Record the load time and let the user know the data is ready
+        :param table: Grocery table
+        :param message: Notification message
+        """
+        if self.time_to_first_row is None:
+            self.time_to_first_row = time.perf_counter() - self.load_started
+        self.load_time = time.perf_counter() - self.load_started
+        table.loading = False
+        self.notify(
+            message=message,
+            title="Data loading complete",
+            severity="information"
+        )
+
+    async def stream_pages(  # pylint: disable=too-many-arguments
+            self,
+            client: httpx.AsyncClient,
+            table: GroceryTable,
+            records: list[dict[str, Any]] | None = None,
+            query: dict[str, str] | None = None,
+            *,
+            locked: bool = False
+    ) -> int:
+        """
+        Add each page of the dataset to the table as soon as it arrives
+        :param client: HTTP client
+        :param table: Grocery table
+        :param records: If provided, all the records are collected here
+        :param query: Filter pushed down to the portal, as SoQL parameters
+        :param locked: The caller holds table_lock for the whole download
+        :return: Number of records downloaded
+        """
+        show = self.add_records if locked else self.show_records
+        cnt = 0
+        async for page in fetch_pages(
+                client, self.url, page_size=self.page_size, window=self.window,
+                validators=self.validators, query=query
+        ):
+            await show(table, page)
+            if records is not None:
+                records.extend(page)
+            cnt += len(page)
+            if self.time_to_first_row is None:
+                self.time_to_first_row = time.perf_counter() - self.load_started
+                table.loading = False
+        return cnt
+
+    def keeps_dataset(self) -> bool:
+        """
+        Filters run locally when a columnar copy of the whole dataset is kept
+        """
+        if self.filter_mode == "auto":
+            return self.cache is not None
+        return self.filter_mode == "local"
+
+    def portal_query(self) -> dict[str, str]:
+        """
+        SoQL parameters of the current filter, when it runs on the portal instead of locally
+        """
+        if self.dataset is not None or not self.record_filter:
+            return {}
+        table = self.query_one("#grocery_store_table", GroceryTable)
+        return self.record_filter.soql_params(table.key_fields)
+
+    async def keep_records(self, records: Sequence[dict[str, Any]]) -> None:
+        """
+        Add records to the local copy of the dataset, in chunks so the UI stays responsive
+        """
+        for start in range(0, len(records), CHUNK_SIZE):
+            self.dataset.extend(records[start:start + CHUNK_SIZE])
+            await asyncio.sleep(0)
+
+    def visible_records(self, records: Sequence[dict[str, Any]]) -> Sequence[dict[str, Any]]:
+        """
+        Records that pass the current filter, evaluated on their columns. Records that
+        come from a filter pushed down to the portal already passed it.
+        """
+        if self.dataset is None or not self.record_filter:
+            return records
+        return self.select_records(RecordColumns(records))
+
+    def filtered_dataset(self) -> list[dict[str, Any]]:
+        """
+        Records of the local copy of the dataset that pass the filter, only with the selected
+        columns
+        """
+        with TRACER.span("filter_columns", "filter", rows=len(self.dataset)):
+            return self.select_records(self.dataset)
+
+    def select_records(self, columns: RecordColumns) -> list[dict[str, Any]]:
+        """
+        Records that pass the filter, only with the selected columns and the key fields
+        """
+        key_fields = self.query_one("#grocery_store_table", GroceryTable).key_fields
+        mask = columns.mask(self.record_filter.predicates)
+        return columns.records(mask, self.record_filter.columns(key_fields))
+
+    async def show_records(self, table: GroceryTable, records: Sequence[dict[str, Any]]) -> int:
+        """
+        Keep new records on the local copy of the dataset, and add the ones that pass the filter to
+        the table
+        :param table: Grocery table
+        :param records: Json records
+        :return: Number of records
+        """
+        async with self.table_lock:
+            return await self.add_records(table, records)
+
+    async def add_records(self, table: GroceryTable, records: Sequence[dict[str, Any]]) -> int:
+        """
+        Same as show_records, for callers that already hold table_lock
+        :param table: Grocery table
+        :param records: Json records
+        :return: Number of records
+        """
+        if self.dataset is not None:
+            await self.keep_records(records)
+        self.places.extend(places(records))
+        await table.add_records(self.visible_records(records))
+        return len(records)
+
+    async def build_spatial_index(self, saved: bytes | None = None) -> None:
+        """
+        Index the location of the stores loaded so far, or use the index saved with the cached
+        dataset.
+        The index is built on a thread, so the UI stays responsive on big datasets.
+        :param saved: Serialized index, from the cache
+        """
+        self.spatial_filter = self.record_filter.text if self.portal_query() else ""
+        if saved:
+            try:
+                self.spatial = SpatialIndex.from_bytes(saved)
+                return
+            except (ValueError, TypeError, KeyError, EOFError):
+                pass
+        with TRACER.span("build_spatial_index", "spatial", places=len(self.places)):
+            self.spatial = await asyncio.to_thread(SpatialIndex, self.places)
+
+    def show_store(self, place: Place) -> None:
+        """
+        Move the cursor to a store found on the command palette
+        :param place: Store location
+        """
+        table = self.query_one("#grocery_store_table", GroceryTable)
+        row_key = record_keys([{table.key_fields[0]: place.key}], table.key_fields)[0]
+        if row_key not in table.rows:
+            self.notify(
+                message=f"{place.name} is not on the table, change the filter to see it",
+                title="Store filtered out",
+                severity="warning"
+            )
+            return
+        table.move_cursor(row=table.get_row_index(row_key))
+        table.focus()
+
+    @on(Input.Submitted, "#filter_bar")
+    def on_filter_submitted(self, event: Input.Submitted) -> None:
+        """
+        Apply the filter typed on the filter bar
+        """
+        try:
+            self.record_filter = parse_filter(event.value)
+        except ValueError as ve:
+            self.notify(message=str(ve), title="Invalid filter", severity="error")
+            return
+        self.filter_grocery_data()
+
+    @work(exclusive=True, group="filter")
+    @traced("filter_grocery_data")
+    async def filter_grocery_data(self) -> None:
+        """
+        Show only the stores that pass the filter. With a local copy of the dataset, the columns
+        are filtered in memory, otherwise the filter is sent to the portal and the load starts
+        again.
+        """
+        table = self.query_one("#grocery_store_table", GroceryTable)
+        started = time.perf_counter()
+        if self.dataset is not None:
+            async with self.table_lock:
+                table.clear(columns=True)
+                records = self.filtered_dataset()
+                await table.add_records(records)
+            where = "locally"
+        else:
+            # A load or a refresh still running would add the rows of the previous filter back
+            self.workers.cancel_group(self, "default")
+            self.workers.cancel_group(self, "refresh")
+            records = []
+            query = self.portal_query()
+            async with self.table_lock:
+                table.clear(columns=True)
+                table.loading = True
+                self.places = []
+                self.validators = {}
+                async with httpx.AsyncClient() as client:
+                    try:
+                        await self.stream_pages(client, table, records, query, locked=True)
+                        self.validators_query = query
+                    except httpx.HTTPError as he:
+                        message = he.response.text if isinstance(he, HTTPStatusError) else f"{he}"
+                        self.notify(
+                            message=message, title="Could not filter grocery data",
+                            severity="error"
+                        )
+            await self.build_spatial_index()
+            table.loading = False
+            where = "on the CT Data portal"
+            self.schedule_refresh()
+        self.filter_time = time.perf_counter() - started
+        self.notify(
+            message=(
+                f"{len(records)} Grocery Stores in {self.filter_time * 1000:.0f} ms, "
+                f"filtered {where}"
+            ),
+            title="Filter applied" if self.record_filter else "Filter removed",
+            severity="information"
+        )
 
     def on_mount(self) -> None:
         """
         Render the initial component status
         :return:
         """
-        table = self.query_one("#grocery_store_table", DataTable)
+        TRACER.start(self)
+        table = self.query_one("#grocery_store_table", GroceryTable)
         table.zebra_stripes = True
         table.cursor_type = "row"
         table.loading = True
@@ -77,18 +540,14 @@ class GroceryStoreApp(App):
         )
         self.update_grocery_data()
 
-    def sort_reverse(self, sort_type: str):
+    def on_worker_state_changed(self, event: Worker.StateChanged) -> None:
         """
-        Determine if `sort_type` is ascending or descending.
+        Worker start/finish spans for the trace
         """
-        reverse = sort_type in self.current_sorts
-        if reverse:
-            self.current_sorts.remove(sort_type)
-        else:
-            self.current_sorts.add(sort_type)
-        return reverse
+        TRACER.worker_state(event.worker, event.state)
 
     @on(DataTable.HeaderSelected)
+    @traced("on_header_clicked")
     def on_header_clicked(self, event: DataTable.HeaderSelected):
         """
         Sort rows by column header
@@ -96,12 +555,204 @@ class GroceryStoreApp(App):
         table = event.data_table
         table.sort(
             event.column_key,
-            reverse=self.sort_reverse(event.column_key.value)
+            reverse=table.sort_reverse(event.column_key.value)
+        )
+
+
+async def load_spatial_index(
+        url: str,
+        cache: GroceryCache | None,
+        page_size: int = PAGE_SIZE,
+        window: int = MAX_PAGES_IN_FLIGHT
+) -> SpatialIndex:
+    """
+    Spatial index of the dataset, from the cache while it is fresh, otherwise the dataset is
+    downloaded and cached with its new index
+    :param url: Dataset URL
+    :param cache: On-disk cache, None to always download the dataset
+    :param page_size: Records per page, 0 retrieves the whole dataset with a single request
+    :param window: Maximum number of pages requested concurrently
+    :return: Spatial index
+    """
+    entry = cache.load(url) if cache else None
+    if entry and cache.is_fresh(entry):
+        if entry.spatial:
+            try:
+                return SpatialIndex.from_bytes(entry.spatial)
+            except (ValueError, TypeError, KeyError, EOFError):
+                pass
+        index = SpatialIndex(places(entry.records))
+        entry.spatial = index.to_bytes()
+        cache.store(entry)
+        return index
+    validators: dict[str, str] = {}
+    async with httpx.AsyncClient() as client:
+        if page_size:
+            records = []
+            async for page in fetch_pages(
+                    client, url, page_size=page_size, window=window, validators=validators
+            ):
+                records.extend(page)
+        else:
+            records = await fetch_all(client, url, validators)
+    index = SpatialIndex(places(records))
+    if cache:
+        cache.store(CacheEntry(
+            url=url, records=records, validators=validators, spatial=index.to_bytes()
+        ))
+    return index
+
+
+def print_neighbors(query: str, precision: str, neighbors: list[Neighbor]) -> None:
+    """
+    Show the stores found for a query, nearest first
+    """
+    print(f"{query} (located by {precision}):")
+    for neighbor in neighbors:
+        place = neighbor.place
+        print(
+            f"  {neighbor.distance_km:7.2f} km  "
+            f"{place.name}, {place.address}, {place.city} {place.zip}"
+        )
+
+
+def run_spatial_command(options: Namespace, cache: GroceryCache | None) -> int:
+    """
+    Answer the 'nearest', 'within' and 'geocode' subcommands. Queries are addresses or
+    'latitude,longitude', all of them are geocoded at once; '-' reads one query per line from stdin.
+    :return: Exit code, 1 if a query could not be located
+    """
+    queries = [query for query in options.queries if query != "-"]
+    if "-" in options.queries:
+        queries.extend(line.strip() for line in sys.stdin if line.strip())
+    index = asyncio.run(load_spatial_index(options.url, cache, options.page_size, options.window))
+    located = index.geocode(queries)
+    for query, point in zip(queries, located):
+        if point is None:
+            print(f"{query}: not found", file=sys.stderr)
+        elif options.command == "geocode":
+            print(f"{query}\t{point.lat:.6f},{point.lon:.6f}\t{point.precision}")
+        elif options.command == "nearest":
+            print_neighbors(query, point.precision, index.nearest(point.lat, point.lon, options.k))
+        else:
+            print_neighbors(
+                query, point.precision, index.within(point.lat, point.lon, options.radius)
+            )
+    return 1 if None in located else 0
+
+
+def main():
+    """
+    Parse the command line and run the application, or answer a spatial query
+    """
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--url",
+        default=GROCERY_API_URL,
+        help="Dataset URL, use it to point to a local stand-in server"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=PAGE_SIZE,
+        help="Records per page, 0 downloads the whole dataset with a single request"
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=MAX_PAGES_IN_FLIGHT,
+        help="Maximum number of pages downloaded concurrently"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=CACHE_DIR,
+        help="Where to keep the downloaded dataset"
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=MAX_AGE,
+        help="Seconds before a cached dataset is revalidated with the server"
+    )
+    parser.add_argument(
+        "--max-cache-size",
+        type=int,
+        default=MAX_SIZE,
+        help="Maximum size of the cache in bytes, least recently used datasets are removed first"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Always download the dataset"
+    )
+    parser.add_argument(
+        "--refresh",
+        type=float,
+        default=REFRESH_INTERVAL,
+        help="Seconds between checks for changes on the dataset, 0 to disable them"
+    )
+    parser.add_argument(
+        "--filter",
+        default="",
+        help="Initial filter, like 'city=\"NEW HAVEN\" name~market $select=name,address,zip'"
+    )
+    parser.add_argument(
+        "--filter-mode",
+        choices=FILTER_MODES,
+        default="auto",
+        help=(
+            "Filter a local copy of the dataset, push filters down to the portal, "
+            "or 'auto': local when cached"
+        )
+    )
+    add_arguments(parser)
+    subparsers = parser.add_subparsers(
+        dest="command", help="Answer a spatial query instead of running the application"
+    )
+    nearest = subparsers.add_parser(
+        "nearest", help="Stores nearest to each address or latitude,longitude"
+    )
+    nearest.add_argument("-k", type=int, default=5, help="Stores per query")
+    within = subparsers.add_parser(
+        "within", help="Stores within a radius of each address or latitude,longitude"
+    )
+    within.add_argument("--radius", type=float, default=RADIUS_KM, help="Radius, in kilometers")
+    geocode = subparsers.add_parser(
+        "geocode", help="Latitude and longitude of many addresses at once"
+    )
+    for subparser in (nearest, within, geocode):
+        subparser.add_argument(
+            "queries", nargs="+", help="Addresses or latitude,longitude, '-' reads them from stdin"
+        )
+    options = parser.parse_args()
+    try:
+        record_filter = parse_filter(options.filter)
+    except ValueError as ve:
+        parser.error(str(ve))
+    cache = None
+    if not options.no_cache:
+        cache = GroceryCache(
+            directory=options.cache_dir, max_age=options.max_age, max_size=options.max_cache_size
+        )
+    with tracing(options):
+        if options.command:
+            sys.exit(run_spatial_command(options, cache))
+        app = GroceryStoreApp(
+            url=options.url,
+            page_size=options.page_size,
+            window=options.window,
+            cache=cache,
+            refresh_interval=options.refresh,
+            overlay=options.overlay,
+            record_filter=record_filter,
+            filter_mode=options.filter_mode
         )
+        app.title = "Grocery Stores"
+        app.sub_title = "in Connecticut"
+        app.run()
 
 
 if __name__ == "__main__":
-    app = GroceryStoreApp()
-    app.title = "Grocery Stores"
-    app.sub_title = "in Connecticut"
-    app.run()
+    main()
@@ -0,0 +1,184 @@
+"""
+Helpers to talk with the Socrata (SODA) API used by the Connecticut Data portal.
+Large datasets are retrieved using '$limit'/'$offset' pages, with a bounded number
+of requests in flight, so the caller can show rows as soon as the first page arrives.
+Filters are pushed down as extra SoQL parameters ('$where', '$select'), so the portal
+only sends the matching rows and columns.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator
+
+import httpx
+# pylint: disable=no-name-in-module
+from orjson import loads
+
+from grocery_stores_ct.instrumentation import TRACER
+
+PAGE_SIZE = 1_000
+MAX_PAGES_IN_FLIGHT = 4
+VALIDATOR_HEADERS = ("ETag", "Last-Modified")
+
+
+def page_params(page: int, page_size: int, query: dict[str, str] | None = None) -> dict[str, str]:
+    """
+    SoQL parameters to retrieve a single page. Results are ordered by the internal
+    row id, otherwise Socrata does not guarantee stable pages.
+    :param page: Zero based page number
+    :param page_size: Number of records per page
+    :param query: Extra SoQL parameters, like '$where' and '$select'
+    :return: Query parameters
+    """
+    return {
+        **(query or {}),
+        "$limit": str(page_size),
+        "$offset": str(page * page_size),
+        "$order": ":id"
+    }
+
+
+def get_validators(response: httpx.Response) -> dict[str, str]:
+    """
+    Extract the headers used to revalidate a cached copy of the response
+    :param response: HTTP response
+    :return: ETag and Last-Modified, if present
+    """
+    headers = response.headers
+    return {header: headers[header] for header in VALIDATOR_HEADERS if header in headers}
+
+
+def conditional_headers(validators: dict[str, str]) -> dict[str, str]:
+    """
+    Turn the validators of a cached response into conditional request headers
+    :param validators: ETag and Last-Modified, as returned by get_validators
+    :return: If-None-Match and If-Modified-Since headers
+    """
+    headers = {}
+    if "ETag" in validators:
+        headers["If-None-Match"] = validators["ETag"]
+    if "Last-Modified" in validators:
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+    return headers
+
+
+async def fetch_all(
+        client: httpx.AsyncClient,
+        url: str,
+        validators: dict[str, str] | None = None,
+        query: dict[str, str] | None = None
+) -> list[dict[str, Any]]:
+    """
+    Retrieve the whole dataset with a single request
+    :param client: HTTP client
+    :param url: Dataset URL
+    :param validators: If provided, filled with the validators of the response
+    :param query: Extra SoQL parameters, like '$where' and '$select'
+    :return: List of records
+    """
+    response = await client.get(url, params=query)
+    response.raise_for_status()
+    if validators is not None:
+        validators.update(get_validators(response))
+    with TRACER.span("parse_json", "parse", size=len(response.content)):
+        return loads(response.content)
+
+
+async def revalidate(
+        client: httpx.AsyncClient,
+        url: str,
+        validators: dict[str, str],
+        page_size: int = PAGE_SIZE,
+        query: dict[str, str] | None = None
+) -> tuple[bool, dict[str, str]]:
+    """
+    Ask the server if the dataset changed since it was cached. The request must be the same used
+    to get the validators in the first place: the first page, or the whole dataset if page_size
+    is 0, of the same query. A filtered query is a different resource, with its own validators.
+    :param client: HTTP client
+    :param url: Dataset URL
+    :param validators: Validators of the cached copy
+    :param page_size: Records per page
+    :param query: Extra SoQL parameters that produced the validators, like '$where' and '$select'
+    :return: True and the new validators if the dataset changed, False and the current ones if not
+    """
+    params = page_params(0, page_size, query) if page_size else query or None
+    response = await client.get(url, params=params, headers=conditional_headers(validators))
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        return False, get_validators(response) or validators
+    response.raise_for_status()
+    return True, get_validators(response)
+
+
+async def fetch_page(
+        client: httpx.AsyncClient,
+        url: str,
+        params: dict[str, str],
+        validators: dict[str, str] | None = None
+) -> list[dict[str, Any]]:
+    """
+    Retrieve a single page of the dataset
+    :param client: HTTP client
+    :param url: Dataset URL
+    :param params: Query parameters of the page, from page_params
+    :param validators: If provided, filled with the validators of the response
+    :return: List of records, empty if the page is past the end of the dataset
+    """
+    response = await client.get(url, params=params)
+    response.raise_for_status()
+    if validators is not None:
+        validators.update(get_validators(response))
+    with TRACER.span("parse_json", "parse", size=len(response.content)):
+        return loads(response.content)
+
+
+async def fetch_pages(  # pylint: disable=too-many-arguments
+        client: httpx.AsyncClient,
+        url: str,
+        *,
+        page_size: int = PAGE_SIZE,
+        window: int = MAX_PAGES_IN_FLIGHT,
+        validators: dict[str, str] | None = None,
+        query: dict[str, str] | None = None
+) -> AsyncIterator[list[dict[str, Any]]]:
+    """
+    Retrieve the dataset one page at a time. Up to `window` pages are requested
+    concurrently, but pages are yielded in order. The first short page marks the end
+    of the dataset, any speculative request past it is cancelled.
+    :param client: HTTP client
+    :param url: Dataset URL
+    :param page_size: Number of records per page
+    :param window: Maximum number of requests in flight
+    :param validators: If provided, filled with the validators of the first page
+    :param query: Extra SoQL parameters, like '$where' and '$select'
+    :return: Pages of records, as they become available
+    """
+    if page_size < 1 or window < 1:
+        raise ValueError(f"Invalid page_size={page_size} or window={window}")
+    in_flight: deque[asyncio.Task] = deque()
+    next_page = 0
+    last_page_seen = False
+    try:
+        while True:
+            while not last_page_seen and len(in_flight) < window:
+                page_validators = validators if next_page == 0 else None
+                params = page_params(next_page, page_size, query)
+                in_flight.append(
+                    asyncio.create_task(fetch_page(client, url, params, page_validators))
+                )
+                next_page += 1
+            if not in_flight:
+                break
+            records = await in_flight.popleft()
+            if len(records) < page_size:
+                last_page_seen = True
+                for task in in_flight:
+                    task.cancel()
+            if records:
+                yield records
+            if last_page_seen:
+                break
+    finally:
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
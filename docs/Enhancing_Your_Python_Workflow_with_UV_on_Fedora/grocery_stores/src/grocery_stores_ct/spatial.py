@@ -0,0 +1,399 @@
+"""
+Spatial index of the grocery stores, to find the stores nearest to a point or within a radius.
+
+Store locations (Socrata point or location columns) are projected to kilometers around the
+center of the dataset and bucketed on a uniform grid, with a few stores per cell. Cells are
+kept as a single permutation of the stores plus where each cell starts, so a query only visits
+the cells around the point. The projection is accurate for a state sized area like Connecticut.
+
+The index also geocodes addresses using the dataset itself: a store address, then the center
+of the stores on the same zip code or town.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import heapq
+import marshal
+import math
+import re
+from array import array
+from functools import cached_property
+from itertools import accumulate
+from typing import Any, Iterable, Iterator, NamedTuple, Sequence
+
+KM_PER_DEGREE = 6371.0088 * math.pi / 180
+POINTS_PER_CELL = 4
+FORMAT_VERSION = 1
+ZIP_CODE = re.compile(r"\b(\d{5})(?:-\d{4})?\b")
+POINT = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*[, ]\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+class Place(NamedTuple):
+    """
+    Location of a store, and what is needed to show it
+    """
+    lat: float
+    lon: float
+    name: str
+    address: str
+    city: str
+    zip: str
+    key: str
+
+
+class Neighbor(NamedTuple):
+    """
+    A store found by a query, and how far it is from the point
+    """
+    distance_km: float
+    place: Place
+
+
+class Geocoded(NamedTuple):
+    """
+    Coordinates of an address, precision is 'point', 'address', 'zip' or 'city'
+    """
+    lat: float
+    lon: float
+    precision: str
+
+
+def location(record: dict[str, Any]) -> tuple[float, float] | None:
+    """
+    Latitude and longitude of a record, from the first GeoJSON point or Socrata location field
+    :param record: Json record
+    :return: Latitude and longitude, None if the record has no location
+    """
+    for value in record.values():
+        if not isinstance(value, dict):
+            continue
+        try:
+            if value.get("type") == "Point":
+                lon, lat = value["coordinates"][:2]
+            elif "latitude" in value and "longitude" in value:
+                lat, lon = value["latitude"], value["longitude"]
+            else:
+                continue
+            lat, lon = float(lat), float(lon)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return lat, lon
+    return None
+
+
+def places(records: Iterable[dict[str, Any]], key_field: str = "credentialid") -> list[Place]:
+    """
+    Locations of the records, records without one are skipped
+    :param records: Json records
+    :param key_field: Field that identifies a store
+    :return: One place per located record
+    """
+    located = []
+    for record in records:
+        point = location(record)
+        if point:
+            located.append(Place(
+                point[0], point[1], record.get("name", ""), record.get("address", ""),
+                record.get("city", ""), record.get("zip", ""), record.get(key_field, "")
+            ))
+    return located
+
+
+def normalize(text: str) -> str:
+    """
+    Upper case, without punctuation or repeated blanks, to match addresses
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", text.upper()).split())
+
+
+def parse_point(text: str) -> tuple[float, float] | None:
+    """
+    Read 'latitude,longitude'
+    :param text: Text typed by the user
+    :return: Latitude and longitude, None if the text is not a point
+    """
+    match = POINT.match(text)
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    return (lat, lon) if -90 <= lat <= 90 and -180 <= lon <= 180 else None
+
+
+def centers(
+        keys: Sequence[str],
+        lats: Sequence[float],
+        lons: Sequence[float]
+) -> dict[str, tuple[float, float]]:
+    """
+    Average location of the stores sharing a key, like a zip code or a town
+    """
+    sums: dict[str, list[float]] = {}
+    for key, lat, lon in zip(keys, lats, lons):
+        if key:
+            total = sums.setdefault(key, [0.0, 0.0, 0])
+            total[0] += lat
+            total[1] += lon
+            total[2] += 1
+    return {key: (lat / count, lon / count) for key, (lat, lon, count) in sums.items()}
+
+
+class SpatialIndex:  # pylint: disable=too-many-instance-attributes
+    """
+    Uniform grid over the projected store locations. Build it once per dataset load, then save it
+    with to_bytes next to the cached records.
+    """
+
+    def __init__(self, located: Sequence[Place], points_per_cell: int = POINTS_PER_CELL):
+        """
+        :param located: Store locations
+        :param points_per_cell: Average stores per grid cell
+        """
+        self.places: list[Place] = list(located)
+        count = len(self.places)
+        lats = [place.lat for place in self.places]
+        lons = [place.lon for place in self.places]
+        self.origin = (min(lats, default=0.0), min(lons, default=0.0))
+        self.scale = KM_PER_DEGREE * math.cos(math.radians(sum(lats) / count if count else 0.0))
+        self.xs = array("d", ((lon - self.origin[1]) * self.scale for lon in lons))
+        self.ys = array("d", ((lat - self.origin[0]) * KM_PER_DEGREE for lat in lats))
+        width = max(self.xs, default=0.0)
+        height = max(self.ys, default=0.0)
+        # Square cells sized for the requested density, stores on a line are spread along it
+        if count and width * height > 0:
+            self.cell = math.sqrt(width * height * points_per_cell / count)
+        elif count and max(width, height) > 0:
+            self.cell = max(width, height) * points_per_cell / count
+        else:
+            self.cell = 1.0
+        self.columns = int(width / self.cell) + 1
+        self.rows = int(height / self.cell) + 1
+        cells = [self._cell_of(x, y) for x, y in zip(self.xs, self.ys)]
+        self.order = array("I", sorted(range(count), key=cells.__getitem__))
+        counts = [0] * (self.columns * self.rows)
+        for cell in cells:
+            counts[cell] += 1
+        self.starts = array("I", accumulate(counts, initial=0))
+        self.addresses: dict[str, list[int]] = {}
+        for position, place in enumerate(self.places):
+            address = normalize(f"{place.address} {place.city}")
+            self.addresses.setdefault(address, []).append(position)
+        self.zip_centers = centers([place.zip[:5] for place in self.places], lats, lons)
+        self.city_centers = centers([normalize(place.city) for place in self.places], lats, lons)
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def _cell_of(self, x: float, y: float) -> int:
+        column = min(max(int(x / self.cell), 0), self.columns - 1)
+        row = min(max(int(y / self.cell), 0), self.rows - 1)
+        return row * self.columns + column
+
+    def project(self, lat: float, lon: float) -> tuple[float, float]:
+        """
+        Kilometers east and north of the dataset origin
+        """
+        return (lon - self.origin[1]) * self.scale, (lat - self.origin[0]) * KM_PER_DEGREE
+
+    def _cell_positions(self, column: int, row: int) -> range:
+        cell = row * self.columns + column
+        return range(self.starts[cell], self.starts[cell + 1])
+
+    def _span(self, low: float, high: float, cells: int) -> range:
+        """
+        Cells of one axis that overlap [low, high], clipped to the grid
+        """
+        return range(
+            max(math.floor(low / self.cell), 0), min(math.floor(high / self.cell), cells - 1) + 1
+        )
+
+    def _ring(self, center_column: int, center_row: int, ring: int) -> Iterator[range]:
+        """
+        Cells `ring` cells away from the center, on the border of a square, clipped to the grid
+        """
+        first, last = center_column - ring, center_column + ring
+        for column in range(max(first, 0), min(last, self.columns - 1) + 1):
+            if column in (first, last):
+                rows = range(center_row - ring, center_row + ring + 1)
+            else:
+                rows = range(center_row - ring, center_row + ring + 1, max(2 * ring, 1))
+            for row in rows:
+                if 0 <= row < self.rows:
+                    yield self._cell_positions(column, row)
+
+    def _box(self, x: float, y: float, radius_km: float) -> Iterator[range]:
+        """
+        Cells that overlap the square around a point
+        """
+        columns = self._span(x - radius_km, x + radius_km, self.columns)
+        for row in self._span(y - radius_km, y + radius_km, self.rows):
+            for column in columns:
+                yield self._cell_positions(column, row)
+
+    def _distances(
+            self,
+            cells: Iterable[range],
+            x: float,
+            y: float
+    ) -> list[tuple[float, int]]:
+        """
+        Squared distance from a projected point to every store in the cells, with its position
+        """
+        xs, ys, order = self.xs, self.ys, self.order
+        return [
+            ((xs[position] - x) ** 2 + (ys[position] - y) ** 2, position)
+            for indexes in cells
+            for position in order[indexes.start:indexes.stop]
+        ]
+
+    def nearest(self, lat: float, lon: float, k: int = 5) -> list[Neighbor]:
+        """
+        The k stores nearest to a point. Rings of cells around the point are visited until
+        the next ring cannot be closer than the k-th store found so far.
+        :param lat: Latitude
+        :param lon: Longitude
+        :param k: Number of stores
+        :return: Stores, nearest first
+        """
+        if not self.places or k < 1:
+            return []
+        x, y = self.project(lat, lon)
+        center_column = math.floor(x / self.cell)
+        center_row = math.floor(y / self.cell)
+        # Past this ring every cell of the grid was visited
+        last_ring = max(
+            abs(center_column), abs(self.columns - 1 - center_column),
+            abs(center_row), abs(self.rows - 1 - center_row)
+        )
+        best: list[tuple[float, int]] = []  # Max heap of (-squared distance, position)
+        for ring in range(last_ring + 1):
+            cells = self._ring(center_column, center_row, ring)
+            for distance, position in self._distances(cells, x, y):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, position))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, position))
+            # Stores on the next rings are at least this far
+            if len(best) == k and -best[0][0] <= (ring * self.cell) ** 2:
+                break
+        return [
+            Neighbor(math.sqrt(-distance), self.places[position])
+            for distance, position in sorted(best, reverse=True)
+        ]
+
+    def within(self, lat: float, lon: float, radius_km: float) -> list[Neighbor]:
+        """
+        Stores within a radius of a point, only the cells that overlap the circle are visited
+        :param lat: Latitude
+        :param lon: Longitude
+        :param radius_km: Radius, in kilometers
+        :return: Stores, nearest first
+        """
+        if not self.places or radius_km < 0:
+            return []
+        x, y = self.project(lat, lon)
+        limit = radius_km ** 2
+        found = [
+            store for store in self._distances(self._box(x, y, radius_km), x, y)
+            if store[0] <= limit
+        ]
+        found.sort()
+        return [
+            Neighbor(math.sqrt(distance), self.places[position]) for distance, position in found
+        ]
+
+    def nearest_many(
+            self,
+            points: Iterable[tuple[float, float]],
+            k: int = 5
+    ) -> list[list[Neighbor]]:
+        """
+        The k nearest stores to each point
+        :param points: Latitude and longitude pairs
+        :param k: Stores per point
+        :return: One list of stores per point, nearest first
+        """
+        return [self.nearest(lat, lon, k) for lat, lon in points]
+
+    def geocode(self, addresses: Iterable[str]) -> list[Geocoded | None]:
+        """
+        Locate many addresses at once, like '123 MAIN ST, HARTFORD, CT 06103'. An address of a store
+        gets its location, otherwise the center of its zip code or town is used.
+        :param addresses: Free form addresses, or 'latitude,longitude'
+        :return: One location per address, None if nothing matched
+        """
+        located = []
+        for address in addresses:
+            point = parse_point(address)
+            if point:
+                located.append(Geocoded(point[0], point[1], "point"))
+                continue
+            street, _, rest = address.partition(",")
+            town = (
+                self.town_pattern.search(normalize(rest or street)) if self.city_centers else None
+            )
+            if not rest and town:
+                street = normalize(street)[:town.start()]
+            positions = self.addresses.get(f"{normalize(street)} {town.group(1)}") if town else None
+            zip_code = ZIP_CODE.search(address)
+            if positions:
+                lat = sum(self.places[position].lat for position in positions) / len(positions)
+                lon = sum(self.places[position].lon for position in positions) / len(positions)
+                located.append(Geocoded(lat, lon, "address"))
+            elif zip_code and zip_code.group(1) in self.zip_centers:
+                located.append(Geocoded(*self.zip_centers[zip_code.group(1)], "zip"))
+            elif town:
+                located.append(Geocoded(*self.city_centers[town.group(1)], "city"))
+            else:
+                located.append(None)
+        return located
+
+    @cached_property
+    def town_pattern(self) -> re.Pattern:
+        """
+        Any town of the dataset, longest names first so 'NEW HAVEN' wins over 'HAVEN'
+        """
+        towns = sorted(self.city_centers, key=len, reverse=True)
+        return re.compile(r"\b(" + "|".join(map(re.escape, towns)) + r")\b")
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the index, to keep it with the cached dataset
+        """
+        return marshal.dumps({
+            "version": FORMAT_VERSION,
+            "places": [tuple(place) for place in self.places],
+            "origin": self.origin,
+            "scale": self.scale,
+            "cell": self.cell,
+            "columns": self.columns,
+            "rows": self.rows,
+            "xs": self.xs.tobytes(),
+            "ys": self.ys.tobytes(),
+            "order": self.order.tobytes(),
+            "starts": self.starts.tobytes(),
+            "addresses": self.addresses,
+            "zip_centers": self.zip_centers,
+            "city_centers": self.city_centers
+        })
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SpatialIndex":
+        """
+        Load an index saved with to_bytes, without building it again
+        :param data: Serialized index
+        :return: Spatial index
+        """
+        saved = marshal.loads(data)
+        if not isinstance(saved, dict) or saved.get("version") != FORMAT_VERSION:
+            raise ValueError("Unsupported spatial index format")
+        index = cls.__new__(cls)
+        index.places = [Place(*place) for place in saved["places"]]
+        for name in (
+                "origin", "scale", "cell", "columns", "rows",
+                "addresses", "zip_centers", "city_centers"
+        ):
+            setattr(index, name, saved[name])
+        for name, typecode in (("xs", "d"), ("ys", "d"), ("order", "I"), ("starts", "I")):
+            values = array(typecode)
+            values.frombytes(saved[name])
+            setattr(index, name, values)
+        return index
@@ -0,0 +1,247 @@
+"""
+Local stand-in for the CT Data portal, serves synthetic grocery store records
+and understands the '$limit'/'$offset' paging parameters, plus the '$where' and '$select'
+written by the filter bar.
+Useful to benchmark the application without hitting the real portal:
+
+python -m grocery_stores_ct.stand_in --rows 100000 --port 8080
+grocery_stores --url http://127.0.0.1:8080/resource/fv3p-tf5m.json
+
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import random
+import threading
+import time
+import zlib
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator
+from urllib.parse import urlparse, parse_qs
+
+# pylint: disable=no-name-in-module
+from orjson import dumps
+
+from grocery_stores_ct.filters import RecordFilter, parse_where
+
+RESOURCE_PATH = "/resource/fv3p-tf5m.json"
+TOWNS = [
+    "HARTFORD", "NEW HAVEN", "STAMFORD", "BRIDGEPORT", "WATERBURY", "NORWALK", "DANBURY", "MERIDEN"
+]
+TOWN_CENTERS = {
+    "HARTFORD": (41.7658, -72.6734),
+    "NEW HAVEN": (41.3083, -72.9279),
+    "STAMFORD": (41.0534, -73.5387),
+    "BRIDGEPORT": (41.1865, -73.1952),
+    "WATERBURY": (41.5582, -73.0515),
+    "NORWALK": (41.1177, -73.4082),
+    "DANBURY": (41.3948, -73.4540),
+    "MERIDEN": (41.5382, -72.8070)
+}
+TOWN_RADIUS = 0.05  # Degrees around the town center where its stores are
+NAMES = [
+    "BIG Y FOODS", "THE STOP & SHOP", "PRICE CHOPPER", "TRADER JOE'S", "CORNER MARKET",
+    "FOOD BAZAAR"
+]
+
+
+def synthetic_records(rows: int, seed: int = 42) -> list[dict[str, Any]]:
+    """
+    Generate records that look like the ones returned by the CT Data portal
+    :param rows: Number of records
+    :param seed: Random seed, same seed returns the same records
+    :return: List of records
+    """
+    rnd = random.Random(seed)
+    # Locations come from their own generator, so the other fields do not change with them
+    places = random.Random(seed + 1)
+    records = []
+    for i in range(rows):
+        name = rnd.choice(NAMES)
+        number = 10_000 + i
+        record = {
+            "credentialid": str(100_000 + i),
+            "name": f"{name} {i}",
+            "type": "BUSINESS",
+            "businessname": f"{name} INC",
+            "dba": name,
+            "fullcredentialcode": f"LGB.{number:07d}",
+            "credentialtype": "LGB",
+            "credentialnumber": str(number),
+            "credential": "GROCERY BEER",
+            "status": rnd.choice(["ACTIVE", "INACTIVE"]),
+            "address": f"{rnd.randint(1, 999)} MAIN ST",
+            "city": rnd.choice(TOWNS),
+            "state": "CT",
+            "zip": f"06{rnd.randint(0, 999):03d}"
+        }
+        lat, lon = TOWN_CENTERS[record["city"]]
+        record["geocoded_column"] = {
+            "type": "Point",
+            "coordinates": [
+                round(lon + places.uniform(-TOWN_RADIUS, TOWN_RADIUS), 6),
+                round(lat + places.uniform(-TOWN_RADIUS, TOWN_RADIUS), 6)
+            ]
+        }
+        records.append(record)
+    return records
+
+
+class StandInDataset:
+    """
+    Records served by the stand-in. Like Socrata, the ETag identifies the version
+    of the whole dataset, not the slice returned by each request.
+    """
+
+    def __init__(self, records: list[dict[str, Any]]):
+        self.records: list[dict[str, Any]] = []
+        self.filtered: dict[str, list[dict[str, Any]]] = {}
+        self.etag = '"0"'
+        self.last_modified = formatdate(0, usegmt=True)
+        self.replace(records)
+
+    def replace(self, records: list[dict[str, Any]]) -> None:
+        """
+        Publish a new version of the dataset
+        :param records: New records
+        """
+        self.records = records
+        self.filtered = {}
+        self.etag = f'"{zlib.crc32(dumps(records)):08x}"'
+        self.last_modified = formatdate(time.time(), usegmt=True)
+
+    def etag_of(self, where: str = "", select: str = "") -> str:
+        """
+        ETag of a query. A filtered query is a different resource, so its ETag changes with the
+        dataset and with the '$where' and '$select' parameters.
+        :param where: Where clause
+        :param select: Selected columns
+        :return: ETag
+        """
+        if not where and not select:
+            return self.etag
+        query = zlib.crc32(f"{where}\x1f{select}".encode("utf-8"))
+        return f'{self.etag[:-1]}-{query:08x}"'
+
+    def where(self, where: str) -> list[dict[str, Any]]:
+        """
+        Records that match a '$where' clause, remembered so the following pages do not filter again
+        :param where: Where clause, as written by the filter bar
+        :return: Matching records
+        """
+        if not where:
+            return self.records
+        if where not in self.filtered:
+            record_filter = RecordFilter(parse_where(where))
+            self.filtered[where] = list(filter(record_filter.matches, self.records))
+        return self.filtered[where]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serve a slice of the records, as requested by '$limit' and '$offset', optionally
+    filtered by '$where' and with only the '$select' columns.
+    """
+    dataset: StandInDataset = StandInDataset([])
+    latency: float = 0.0
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Handle a SODA style GET request
+        """
+        url = urlparse(self.path)
+        if url.path != RESOURCE_PATH:
+            self.send_error(404, f"Unknown resource {url.path}")
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        dataset = self.dataset
+        try:
+            offset = int(params.get("$offset", 0))
+            limit = int(params.get("$limit", len(dataset.records)))
+            records = dataset.where(params.get("$where", ""))
+        except ValueError as ve:
+            self.send_error(400, str(ve))
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        etag = dataset.etag_of(params.get("$where", ""), params.get("$select", ""))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        records = records[offset:offset + limit]
+        if "$select" in params:
+            columns = params["$select"].split(",")
+            records = [
+                {column: record[column] for column in columns if column in record}
+                for record in records
+            ]
+        body = dumps(records)
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", dataset.last_modified)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """
+        Keep the console quiet, the TUI owns it
+        """
+
+
+@contextmanager
+def serve(
+        records: list[dict[str, Any]] | StandInDataset,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0
+) -> Iterator[str]:
+    """
+    Run the stand-in server on a background thread
+    :param records: Records to serve, use a StandInDataset to publish new versions while serving
+    :param host: Address to bind
+    :param port: Port to bind, 0 picks a free one
+    :param latency: Seconds to wait before answering each request
+    :return: URL of the dataset
+    """
+    dataset = records if isinstance(records, StandInDataset) else StandInDataset(records)
+    handler = type(
+        "BoundStandInHandler", (StandInHandler,), {"dataset": dataset, "latency": latency}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_address[1]}{RESOURCE_PATH}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def main():
+    """
+    Run the stand-in server until interrupted
+    """
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000, help="Number of synthetic records")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    parser.add_argument("--port", type=int, default=8080, help="Port to bind")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to wait before each response"
+    )
+    options = parser.parse_args()
+    with serve(synthetic_records(options.rows), options.host, options.port, options.latency) as url:
+        print(f"Serving {options.rows} records on {url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
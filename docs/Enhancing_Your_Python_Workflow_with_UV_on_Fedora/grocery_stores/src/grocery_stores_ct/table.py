@@ -0,0 +1,374 @@
+"""
+DataTable tuned to show tens of thousands of grocery store records.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+import asyncio
+import hashlib
+from collections.abc import Container, Iterable, Sequence
+from dataclasses import dataclass
+from itertools import zip_longest
+from operator import itemgetter
+from typing import Any
+
+from rich.cells import cell_len
+from rich.text import TextType
+from textual.coordinate import Coordinate
+from textual.widgets import DataTable
+from textual.widgets.data_table import CellType, ColumnKey, RowKey
+
+from grocery_stores_ct.column_store import ColumnStore, sort_reverse
+from grocery_stores_ct.instrumentation import TRACER, traced
+from grocery_stores_ct.textual_compat import (
+    append_rows, check_internals, delete_rows, set_row_order
+)
+
+CHUNK_SIZE = 5_000
+KEY_FIELDS = ("credentialid",)
+
+
+def record_keys(
+        records: Iterable[dict[str, Any]],
+        key_fields: Sequence[str] = KEY_FIELDS,
+        taken: Container | None = None
+) -> list[str]:
+    """
+    Stable key of each record, a hash of its identifying fields. Records without any of
+    those fields are identified by all their fields. Repeated keys get a counter appended,
+    so every row of the table has a unique key.
+    :param records: Json records
+    :param key_fields: Identifying fields
+    :param taken: Keys already in use, when the dataset is processed one page at a time
+    :return: One key per record
+    """
+    keys = []
+    seen: dict[str, int] = {}
+    taken = taken if taken is not None else ()
+    for record in records:
+        fields = key_fields if any(field in record for field in key_fields) else sorted(record)
+        digest = hashlib.blake2b(digest_size=8)
+        for field in fields:
+            digest.update(str(record.get(field, "")).encode("utf-8"))
+            digest.update(b"\x1f")
+        key = unique = digest.hexdigest()
+        while unique in seen or unique in taken:
+            seen[key] = seen.get(key, 0) + 1
+            unique = f"{key}#{seen[key]}"
+        seen[unique] = 0
+        keys.append(unique)
+    return keys
+
+
+@dataclass
+class Changes:
+    """
+    Rows changed by a refresh of the table
+    """
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+class RecordLayout:
+    """
+    Column order used to turn Json records into table rows. Socrata skips empty fields,
+    so records may miss keys or bring new ones, in any order.
+    """
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self.keys: list[str] = list(keys)
+        self._known = set(self.keys)
+        self._getter = None
+
+    def learn(self, records: Iterable[dict[str, Any]]) -> list[str]:
+        """
+        Add any key not seen before to the layout, in order of appearance
+        :param records: Records to inspect
+        :return: New keys
+        """
+        known = self._known
+        new_keys = []
+        for record in records:
+            if known.issuperset(record):
+                continue
+            for key in record:
+                if key not in known:
+                    known.add(key)
+                    new_keys.append(key)
+        if new_keys:
+            self.keys.extend(new_keys)
+            self._getter = None
+        return new_keys
+
+    def rows(self, records: Iterable[dict[str, Any]]) -> list[tuple[Any, ...]]:
+        """
+        Extract the values of each record, in layout order. Missing values are empty strings.
+        :param records: Records with keys already learned
+        :return: One tuple per record
+        """
+        keys = self.keys
+        if self._getter is None:
+            self._getter = itemgetter(*keys) if len(keys) > 1 else lambda record: (record[keys[0]],)
+        getter = self._getter
+        rows = []
+        for record in records:
+            try:
+                rows.append(getter(record))
+            except KeyError:
+                rows.append(tuple(record.get(key, "") for key in keys))
+        return rows
+
+
+class GroceryTable(DataTable):  # pylint: disable=too-many-instance-attributes
+    """
+    DataTable with a bulk add_rows. The stock implementation adds one row at a time, and then
+    parses and measures every new cell when idle, to compute the column widths. Here the
+    bookkeeping is done once per batch and the widths are computed straight from the strings.
+
+    Rows are also kept in a ColumnStore, so sorting by a single column reuses a memoized
+    permutation instead of sorting the row objects on every header click.
+
+    Rows added from records are keyed by record_keys, so a fresh copy of the dataset can be
+    applied with sync_records, touching only the rows that changed.
+
+    The bulk operations need a few DataTable internals, all of them go through textual_compat.
+    """
+    KEY_FIELDS = KEY_FIELDS
+
+    def __init__(self, *args, key_fields: Sequence[str] = KEY_FIELDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        check_internals(self)
+        self.key_fields = key_fields
+        self.record_layout = RecordLayout()
+        self.store = ColumnStore()
+        self.current_sorts: set = set()
+        self.sorted_by: tuple[ColumnKey | str, bool] | None = None
+
+    def sort_reverse(self, sort_type: str) -> bool:
+        """
+        Determine if `sort_type` is ascending or descending, each click on a column flips it.
+        """
+        return sort_reverse(self.current_sorts, sort_type)
+
+    def sort(self, *columns: ColumnKey | str, key=None, reverse: bool = False):
+        """
+        Sort the rows. A single column without a key function uses the column store,
+        anything else falls back to the stock implementation.
+        """
+        if len(columns) != 1 or key is not None:
+            self.sorted_by = None
+            return super().sort(*columns, key=key, reverse=reverse)
+        self.sorted_by = (columns[0], reverse)
+        ordered = self.store.sorted_keys(columns[0], reverse=reverse)
+        self._set_row_order(ordered)
+        self.refresh()
+        return self
+
+    def _set_row_order(self, row_keys: Iterable[RowKey]) -> None:
+        """
+        Show the rows in the given order, keeping the cursor on the same row
+        """
+        cursor_key = self._cursor_row_key()
+        set_row_order(self, row_keys)
+        if cursor_key is not None and cursor_key in self.rows:
+            self.cursor_coordinate = Coordinate(
+                self.get_row_index(cursor_key), self.cursor_column
+            )
+        else:
+            self.cursor_coordinate = self.cursor_coordinate
+
+    def _cursor_row_key(self) -> RowKey | None:
+        if not self.is_valid_row_index(self.cursor_row):
+            return None
+        return self.coordinate_to_cell_key(Coordinate(self.cursor_row, 0)).row_key
+
+    def add_column(
+            self,
+            label: TextType,
+            *,
+            width: int | None = None,
+            key: str | None = None,
+            default: CellType | None = None
+    ) -> ColumnKey:
+        """
+        Add a column to the table and to the column store
+        """
+        column_key = super().add_column(label, width=width, key=key, default=default)
+        self.store.add_column(column_key, default)
+        return column_key
+
+    def add_row(
+            self,
+            *cells: CellType,
+            height: int | None = 1,
+            key: str | None = None,
+            label: TextType | None = None
+    ) -> RowKey:
+        """
+        Add a single row to the table and to the column store
+        """
+        row_key = super().add_row(*cells, height=height, key=key, label=label)
+        self.store.extend([row_key], [cells], [column.key for column in self.ordered_columns])
+        return row_key
+
+    def remove_row(self, row_key: RowKey | str) -> None:
+        """
+        Remove a single row from the table and from the column store
+        """
+        self.remove_rows([row_key])
+
+    def remove_rows(self, row_keys: Iterable[RowKey | str]) -> None:
+        """
+        Remove rows with a single pass over the table, instead of one pass per row
+        :param row_keys: Rows to remove
+        """
+        removed = {row_key for row_key in row_keys if row_key in self.rows}
+        if not removed:
+            return
+        kept = [row.key for row in self.ordered_rows if row.key not in removed]
+        delete_rows(self, removed)
+        self.store.remove(removed)
+        self._set_row_order(kept)
+        self.refresh(layout=True)
+
+    def update_cell(
+            self,
+            row_key: RowKey | str,
+            column_key: ColumnKey | str,
+            value: CellType,
+            *,
+            update_width: bool = False
+    ) -> None:
+        """
+        Update a cell on the table and on the column store
+        """
+        super().update_cell(row_key, column_key, value, update_width=update_width)
+        self.store.update(row_key, column_key, value)
+
+    def update_row(self, row_key: RowKey | str, cells: Sequence[CellType]) -> bool:
+        """
+        Update the cells of a row that differ from the given ones
+        :param row_key: Row
+        :param cells: New cells, one per column
+        :return: True if any cell changed
+        """
+        current = self.get_row(row_key)
+        if tuple(current) == tuple(cells):
+            return False
+        for column, old, value in zip(self.ordered_columns, current, cells):
+            if old != value:
+                self.update_cell(row_key, column.key, value, update_width=True)
+        return True
+
+    @traced("sync_records", "table", detail=lambda table, records: {"records": len(records)})
+    async def sync_records(self, records: Sequence[dict[str, Any]]) -> Changes:
+        """
+        Make the table match a new copy of the dataset. Only the rows that were added, changed
+        or removed are touched; the cursor stays on the same row and the sort order is kept.
+        :param records: All the records of the dataset
+        :return: What changed
+        """
+        for key in self.record_layout.learn(records):
+            self.add_column(key.title(), key=key, default="")
+        changes = Changes()
+        new_rows = []
+        new_keys = []
+        seen = set()
+        for row_key, row in zip(
+                record_keys(records, self.key_fields), self.record_layout.rows(records)
+        ):
+            seen.add(row_key)
+            if row_key not in self.rows:
+                new_keys.append(row_key)
+                new_rows.append(row)
+            elif self.update_row(row_key, row):
+                changes.updated += 1
+        deleted = [row_key for row_key in self.rows if row_key.value not in seen]
+        changes.deleted = len(deleted)
+        self.remove_rows(deleted)
+        if new_rows:
+            changes.inserted = len(new_rows)
+            self.add_rows(new_rows, keys=new_keys)
+        if self.sorted_by and (changes.inserted or changes.updated):
+            column_key, reverse = self.sorted_by
+            self._set_row_order(self.store.sorted_keys(column_key, reverse=reverse))
+            self.refresh()
+        await asyncio.sleep(0)
+        return changes
+
+    @traced(
+        "add_records", "table", detail=lambda table, records, *_, **__: {"records": len(records)}
+    )
+    async def add_records(
+            self,
+            records: Sequence[dict[str, Any]],
+            chunk_size: int = CHUNK_SIZE
+    ) -> int:
+        """
+        Add records at the bottom of the table in chunks, returning control to the
+        event loop between them so the UI stays responsive.
+        Every refresh of the table walks all its rows, so chunks grow with the table
+        (up to the rows already shown) to keep the total cost linear.
+        :param records: Json records
+        :param chunk_size: Minimum number of rows per chunk
+        :return: Number of rows added
+        """
+        for key in self.record_layout.learn(records):
+            self.add_column(key.title(), key=key, default="")
+        rows = self.record_layout.rows(records)
+        keys = record_keys(records, self.key_fields, taken=self.rows)
+        start = 0
+        while start < len(rows):
+            end = start + max(chunk_size, self.row_count)
+            with TRACER.span("add_rows", "table", rows=min(end, len(rows)) - start):
+                self.add_rows(rows[start:end], keys=keys[start:end])
+            start = end
+            await asyncio.sleep(0)
+        return len(rows)
+
+    def add_rows(
+            self,
+            rows: Iterable[Iterable[CellType]],
+            keys: Iterable[str | None] | None = None
+    ) -> list[RowKey]:
+        """
+        Add a number of rows at the bottom of the table
+        :param rows: Rows, each one with at most one cell per column
+        :param keys: Optional row keys, same order as the rows
+        :return: Keys of the new rows
+        """
+        rows = [tuple(row) for row in rows]
+        if not rows:
+            return []
+        column_keys = [column.key for column in self.ordered_columns]
+        if max(map(len, rows)) > len(column_keys):
+            raise ValueError("More values provided than there are columns.")
+        if keys is not None:
+            row_keys = [RowKey(key) for key in keys]
+        else:
+            row_keys = [RowKey(None) for _ in rows]
+        if len(row_keys) != len(rows):
+            raise ValueError(f"{len(rows)} rows but {len(row_keys)} keys")
+        append_rows(self, row_keys, rows, column_keys)
+        self.store.extend(row_keys, rows, column_keys)
+
+        for column, values in zip(self.ordered_columns, zip_longest(*rows, fillvalue="")):
+            # Longest string first, then its width on screen: close enough, and much cheaper
+            # than measuring every cell
+            widest = cell_len(max(map(str, values), key=len))
+            column.content_width = max(column.content_width, widest)
+        return row_keys
+
+    def clear(self, columns: bool = False):
+        """
+        Clear the table, also forgetting the column layout if the columns are removed
+        """
+        self.sorted_by = None
+        if columns:
+            self.record_layout = RecordLayout()
+            self.store = ColumnStore()
+        else:
+            self.store.clear()
+        return super().clear(columns)
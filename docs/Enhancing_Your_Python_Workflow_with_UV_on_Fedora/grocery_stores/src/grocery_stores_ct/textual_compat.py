@@ -0,0 +1,117 @@
+"""
+The few DataTable internals the tables rely on, kept in one place.
+DataTable adds and removes rows one at a time: every new cell is measured with Rich when the table
+is idle, and every removal renumbers all the rows after it. Its sort always sorts the row objects.
+The bulk versions below need the private row bookkeeping, so they only work with the Textual
+release pinned by the package: missing_internals() checks a live table against PRIVATE_ATTRIBUTES,
+the tables refuse to start when it finds a difference, and the tests fail on any Textual upgrade
+that changes them.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+from __future__ import annotations
+
+from types import MethodType
+from typing import Any, Iterable, Sequence
+
+import textual
+from textual._two_way_dict import TwoWayDict
+from textual.widgets import DataTable
+from textual.widgets.data_table import CellKey, ColumnKey, DuplicateKey, Row, RowKey
+
+# Private attributes of DataTable used here, and their types
+PRIVATE_ATTRIBUTES = {
+    "_row_locations": TwoWayDict,
+    "_data": dict,
+    "_updated_cells": set,
+    "_update_count": int,
+    "_require_update_dimensions": bool,
+    "_highlight_cursor": MethodType
+}
+
+
+def missing_internals(table: DataTable) -> list[str]:
+    """
+    Private attributes this module needs that the table does not have, or that changed type
+    :param table: Table, after DataTable.__init__
+    :return: Names of the missing attributes, empty if the table can be used
+    """
+    return [
+        name for name, kind in PRIVATE_ATTRIBUTES.items()
+        if not isinstance(getattr(table, name, None), kind)
+    ]
+
+
+def check_internals(table: DataTable) -> None:
+    """
+    Fail right away if the installed Textual does not match the internals used here
+    :param table: Table, after DataTable.__init__
+    """
+    missing = missing_internals(table)
+    if missing:
+        raise RuntimeError(
+            f"Textual {textual.__version__} changed the DataTable internals used by "
+            f"{type(table).__name__}: {', '.join(missing)}"
+        )
+
+
+def set_row_order(table: DataTable, row_keys: Iterable[RowKey]) -> None:
+    """
+    Show the rows in the given order, in a single pass
+    :param table: Table
+    :param row_keys: Every row key of the table, in display order
+    """
+    # pylint: disable=protected-access
+    table._row_locations = TwoWayDict({row_key: index for index, row_key in enumerate(row_keys)})
+    table._update_count += 1
+
+
+def append_rows(
+        table: DataTable,
+        row_keys: Sequence[RowKey],
+        rows: Sequence[tuple[Any, ...]],
+        column_keys: Sequence[ColumnKey]
+) -> None:
+    """
+    Add rows at the bottom of the table, without measuring their cells: the caller updates the
+    content_width of the columns
+    :param table: Table
+    :param row_keys: Key of each row
+    :param rows: Cells of each row, at most one per column
+    :param column_keys: Column of each cell
+    """
+    # pylint: disable=protected-access
+    row_locations = table._row_locations
+    data = table._data
+    row_index = table.row_count
+    for row_key, cells in zip(row_keys, rows):
+        if row_key in row_locations:
+            raise DuplicateKey(f"The row key {row_key!r} already exists.")
+        row_locations[row_key] = row_index
+        padding = (None,) * (len(column_keys) - len(cells))
+        data[row_key] = dict(zip(column_keys, cells + padding))
+        table.rows[row_key] = Row(row_key, 1)
+        row_index += 1
+    table._require_update_dimensions = True
+    table.cursor_coordinate = table.cursor_coordinate
+    first_rows = table.row_count == len(rows) and table.columns
+    if first_rows and table.show_cursor and table.cursor_type != "none":
+        table._highlight_cursor()
+    table._update_count += 1
+    table.check_idle()
+
+
+def delete_rows(table: DataTable, row_keys: Iterable[RowKey]) -> None:
+    """
+    Remove the cells of some rows. The rows left must be renumbered with a single call to
+    set_row_order, instead of one pass over the table per row.
+    :param table: Table
+    :param row_keys: Rows to remove, all of them on the table
+    """
+    # pylint: disable=protected-access
+    for row_key in row_keys:
+        for column_key in table._data[row_key]:
+            table._updated_cells.discard(CellKey(row_key, column_key))
+        del table.rows[row_key]
+        del table._data[row_key]
+    table._require_update_dimensions = True
+    table.check_idle()
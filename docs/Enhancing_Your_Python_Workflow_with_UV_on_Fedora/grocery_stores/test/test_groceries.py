@@ -2,9 +2,21 @@
 Unit tests for Groceries application
 https://textual.textualize.io/guide/testing/
 """
+import json
+import math
+
+import httpx
 import pytest
+from textual.widgets import DataTable, Input
 
+from grocery_stores_ct.benchmark import wait_for_load, benchmark_app, compare_results, summarize
+from grocery_stores_ct.cache import GroceryCache, CacheEntry
+from grocery_stores_ct.filters import parse_filter
 from grocery_stores_ct.groceries import GroceryStoreApp
+from grocery_stores_ct.instrumentation import TRACER
+from grocery_stores_ct.spatial import SpatialIndex, places
+from grocery_stores_ct.stand_in import serve, synthetic_records, StandInDataset
+from grocery_stores_ct.table import GroceryTable
 
 
 @pytest.mark.asyncio
@@ -12,3 +24,243 @@ async def test_groceries_app():
     groceries_app = GroceryStoreApp()
     async with groceries_app.run_test() as pilot:
         await pilot.press("ctrl+q")  # Quit
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_paged_load():
+    with serve(synthetic_records(2_500)) as url:
+        groceries_app = GroceryStoreApp(url=url, page_size=1_000, window=2)
+        async with groceries_app.run_test() as pilot:
+            await wait_for_load(groceries_app, pilot, timeout=30)
+            table = groceries_app.query_one("#grocery_store_table", DataTable)
+            assert table.row_count == 2_500
+            assert groceries_app.time_to_first_row <= groceries_app.load_time
+            await pilot.press("ctrl+q")  # Quit
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_cache(tmp_path):
+    records = synthetic_records(100)
+    with serve(records) as url:
+        cache = GroceryCache(directory=tmp_path, max_age=0)
+        for _ in range(2):
+            groceries_app = GroceryStoreApp(url=url, cache=cache)
+            async with groceries_app.run_test() as pilot:
+                await wait_for_load(groceries_app, pilot, timeout=30)
+                await groceries_app.workers.wait_for_complete()
+                table = groceries_app.query_one("#grocery_store_table", DataTable)
+                assert table.row_count == 100
+                await pilot.press("ctrl+q")  # Quit
+        entry = cache.load(url)
+        assert entry.records == records
+        assert "ETag" in entry.validators
+
+
+def test_cache_eviction(tmp_path):
+    cache = GroceryCache(directory=tmp_path, max_size=1)
+    cache.store(CacheEntry(url="http://localhost/a.json", records=synthetic_records(10)))
+    assert cache.load("http://localhost/a.json") is None
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_refresh():
+    records = synthetic_records(50)
+    dataset = StandInDataset(records)
+    with serve(dataset) as url:
+        groceries_app = GroceryStoreApp(url=url, page_size=20)
+        async with groceries_app.run_test() as pilot:
+            await wait_for_load(groceries_app, pilot, timeout=30)
+            table = groceries_app.query_one("#grocery_store_table", GroceryTable)
+            table.sort("name", reverse=table.sort_reverse("name"))
+            table.move_cursor(row=10)
+            cursor_key = table.coordinate_to_cell_key(table.cursor_coordinate).row_key
+
+            changed = [dict(record) for record in records[1:]]  # First record removed
+            changed[5]["status"] = "SUSPENDED"  # One record updated
+            changed.append({**records[0], "credentialid": "1", "name": "AAA MARKET"})  # One record added
+            dataset.replace(changed)
+
+            worker = groceries_app.refresh_grocery_data()
+            await worker.wait()
+            await pilot.pause()
+            assert table.row_count == 50
+            assert table.get_row_at(0)[1] == "AAA MARKET"  # Sort order kept
+            assert table.coordinate_to_cell_key(table.cursor_coordinate).row_key == cursor_key
+            await pilot.press("ctrl+q")  # Quit
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_local_filter():
+    records = synthetic_records(300)
+    expected = [record for record in records if parse_filter("city=HARTFORD market").matches(record)]
+    with serve(records) as url:
+        groceries_app = GroceryStoreApp(url=url, page_size=100, filter_mode="local")
+        async with groceries_app.run_test() as pilot:
+            await wait_for_load(groceries_app, pilot, timeout=30)
+            await groceries_app.workers.wait_for_complete()
+            await pilot.press("ctrl+f")
+            groceries_app.query_one("#filter_bar", Input).value = "city=HARTFORD market $select=name"
+            await pilot.press("enter")
+            await groceries_app.workers.wait_for_complete()
+            await pilot.pause()
+            table = groceries_app.query_one("#grocery_store_table", GroceryTable)
+            assert table.row_count == len(expected)
+            assert [column.key.value for column in table.ordered_columns] == ["name", "credentialid"]
+            assert len(groceries_app.dataset) == 300
+            await pilot.press("ctrl+q")  # Quit
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_pushdown_filter(tmp_path):
+    records = synthetic_records(300)
+    expected = [record for record in records if record["city"] == "NEW HAVEN"]
+    with serve(records) as url:
+        cache = GroceryCache(directory=tmp_path)
+        groceries_app = GroceryStoreApp(
+            url=url, page_size=50, cache=cache, record_filter=parse_filter('city="NEW HAVEN"'), filter_mode="portal"
+        )
+        async with groceries_app.run_test() as pilot:
+            await wait_for_load(groceries_app, pilot, timeout=30)
+            await groceries_app.workers.wait_for_complete()
+            table = groceries_app.query_one("#grocery_store_table", GroceryTable)
+            assert groceries_app.dataset is None
+            assert table.row_count == len(expected)
+            assert cache.load(url) is None  # Filtered copies are not cached
+            await pilot.press("ctrl+f", "enter")  # Same filter
+            await groceries_app.workers.wait_for_complete()
+            assert table.row_count == len(expected)
+            await pilot.press("ctrl+q")  # Quit
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_pushdown_filter_refresh():
+    records = synthetic_records(300)
+    expected = [record for record in records if record["city"] == "NEW HAVEN"]
+    dataset = StandInDataset(records)
+    with serve(dataset) as url:
+        groceries_app = GroceryStoreApp(url=url, page_size=50, filter_mode="portal")
+        async with groceries_app.run_test() as pilot:
+            await wait_for_load(groceries_app, pilot, timeout=30)
+            await groceries_app.workers.wait_for_complete()
+            await pilot.press("ctrl+f")
+            groceries_app.query_one("#filter_bar", Input).value = 'city="NEW HAVEN"'
+            await pilot.press("enter")
+            await groceries_app.workers.wait_for_complete()
+            table = groceries_app.query_one("#grocery_store_table", GroceryTable)
+            assert table.row_count == len(expected)
+            async with httpx.AsyncClient() as client:
+                # Revalidated with the filter that produced the validators: nothing downloaded
+                assert await groceries_app.refresh_from_portal(client, table) is None
+
+            dataset.replace(records + [{**expected[0], "credentialid": "1", "name": "AAA MARKET"}])
+            worker = groceries_app.refresh_grocery_data()
+            await worker.wait()
+            await pilot.pause()
+            assert table.row_count == len(expected) + 1
+            await pilot.press("ctrl+q")  # Quit
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_pushdown_filter_during_refresh():
+    records = synthetic_records(300)
+    expected = [record for record in records if record["city"] == "NEW HAVEN"]
+    dataset = StandInDataset(records)
+    with serve(dataset, latency=0.2) as url:
+        groceries_app = GroceryStoreApp(url=url, page_size=100, filter_mode="portal")
+        async with groceries_app.run_test() as pilot:
+            await wait_for_load(groceries_app, pilot, timeout=30)
+            await groceries_app.workers.wait_for_complete()
+            assert groceries_app.spatial_filter == ""
+            dataset.replace(records + [{**records[0], "credentialid": "1", "city": "HARTFORD"}])
+            # The refresh asks for the whole dataset, the filter must not get its rows back
+            groceries_app.refresh_grocery_data()
+            await pilot.pause()
+            await pilot.press("ctrl+f")
+            groceries_app.query_one("#filter_bar", Input).value = 'city="NEW HAVEN"'
+            await pilot.press("enter")
+            await groceries_app.workers.wait_for_complete()
+            await pilot.pause(0.5)
+            table = groceries_app.query_one("#grocery_store_table", GroceryTable)
+            assert table.row_count == len(expected)
+            # Nearest store searches say they only see the filtered stores
+            assert groceries_app.spatial_filter == 'city="NEW HAVEN"'
+            assert len(groceries_app.spatial) == len(expected)
+            await pilot.press("ctrl+q")  # Quit
+
+
+def test_spatial_index():
+    located = places(synthetic_records(3_000))
+    index = SpatialIndex.from_bytes(SpatialIndex(located).to_bytes())
+    for lat, lon in ((41.7658, -72.6734), (41.30, -72.95), (42.5, -71.0)):
+        x, y = index.project(lat, lon)
+        distances = sorted(math.hypot(px - x, py - y) for px, py in zip(index.xs, index.ys))
+        assert [round(n.distance_km, 9) for n in index.nearest(lat, lon, 7)] == [round(d, 9) for d in distances[:7]]
+        assert len(index.within(lat, lon, 3.0)) == sum(1 for distance in distances if distance <= 3.0)
+    store = located[10]
+    found = index.geocode([f"{store.address}, {store.city}", f"1 NOWHERE RD, {store.zip}", "new haven", "41.3,-72.9", "?"])
+    assert [point.precision if point else None for point in found] == ["address", "zip", "city", "point", None]
+    assert index.nearest(found[0].lat, found[0].lon, 1)[0].distance_km < 0.1
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_nearest_store(tmp_path):
+    records = synthetic_records(200)
+    with serve(records) as url:
+        cache = GroceryCache(directory=tmp_path)
+        groceries_app = GroceryStoreApp(url=url, cache=cache)
+        async with groceries_app.run_test() as pilot:
+            await wait_for_load(groceries_app, pilot, timeout=30)
+            await groceries_app.workers.wait_for_complete()
+            assert len(groceries_app.spatial) == 200
+            groceries_app.action_command_palette()
+            await pilot.pause()
+            for char in "near 41.7658,-72.6734":
+                await pilot.press(char)
+            await groceries_app.workers.wait_for_complete()
+            await pilot.pause(0.2)
+            await pilot.press("enter")
+            await pilot.pause()
+            table = groceries_app.query_one("#grocery_store_table", GroceryTable)
+            nearest = groceries_app.spatial.nearest(41.7658, -72.6734, 1)[0].place
+            assert table.get_row_at(table.cursor_row)[1] == nearest.name
+            await pilot.press("ctrl+q")  # Quit
+        assert cache.load(url).spatial  # Saved with the dataset
+
+
+@pytest.mark.asyncio
+async def test_benchmark_app():
+    result = await benchmark_app(200, page_size=100, window=2)
+    assert result["first_row_s"] <= result["load_s"]
+    assert result["palette_keystroke_s"] <= result["palette_keystroke_max_s"]
+    slower = {**result, "sort_s": result["sort_s"] * 2 + 1}
+    assert [regression.split()[1] for regression in compare_results([result], [slower])] == ["sort_s:"]
+    # Within the spread of a baseline that had the slower run as well
+    baseline = summarize([result, slower, result])
+    assert baseline["sort_s"] == result["sort_s"] and baseline["samples"] == 3
+    assert not compare_results([baseline], [slower])
+    slowest = {**result, "sort_s": slower["sort_s"] * 2}
+    assert [regression.split()[1] for regression in compare_results([baseline], [slowest])] == ["sort_s:"]
+
+
+@pytest.mark.asyncio
+async def test_groceries_app_trace(tmp_path):
+    TRACER.enable()
+    try:
+        with serve(synthetic_records(500)) as url:
+            groceries_app = GroceryStoreApp(url=url, page_size=200, overlay=True)
+            async with groceries_app.run_test() as pilot:
+                await wait_for_load(groceries_app, pilot, timeout=30)
+                await groceries_app.workers.wait_for_complete()
+                await pilot.click("#grocery_store_table", offset=(2, 0))  # Header of the first column
+                await pilot.pause(0.2)
+                await pilot.press("ctrl+q")  # Quit
+        TRACER.save(tmp_path / "trace.json")
+        events = json.loads((tmp_path / "trace.json").read_text(encoding="utf-8"))["traceEvents"]
+        names = {event["name"] for event in events}
+        assert {"update_grocery_data", "worker update_grocery_data", "parse_json", "add_records"} <= names
+        assert {"on_header_clicked", "event loop lag"} <= names
+        assert "Loop lag" in TRACER.summary()
+    finally:
+        TRACER.enabled = False
+        TRACER.events.clear()
+        TRACER.stats.clear()
@@ -0,0 +1,162 @@
+"""
+Unit tests for the grocery table
+"""
+import pytest
+from textual.app import App, ComposeResult
+from textual.widgets import DataTable
+
+from grocery_stores_ct.column_store import ColumnStore
+from grocery_stores_ct.columns import RecordColumns
+from grocery_stores_ct.filters import parse_filter, parse_where
+from grocery_stores_ct.stand_in import synthetic_records
+from grocery_stores_ct.table import GroceryTable, RecordLayout, record_keys
+from grocery_stores_ct.textual_compat import check_internals, missing_internals
+
+
+class TableApp(App):
+    def compose(self) -> ComposeResult:
+        yield GroceryTable()
+
+
+def test_record_layout_missing_and_reordered_keys():
+    layout = RecordLayout()
+    records = [
+        {"name": "BIG Y", "city": "HARTFORD"},
+        {"city": "STAMFORD", "name": "PRICE CHOPPER"},
+        {"name": "CORNER MARKET", "zip": "06510"},
+    ]
+    assert layout.learn(records) == ["name", "city", "zip"]
+    assert layout.rows(records) == [
+        ("BIG Y", "HARTFORD", ""),
+        ("PRICE CHOPPER", "STAMFORD", ""),
+        ("CORNER MARKET", "", "06510"),
+    ]
+    assert not layout.learn(records)
+
+
+@pytest.mark.asyncio
+async def test_add_records_in_chunks():
+    app = TableApp()
+    async with app.run_test() as pilot:
+        table = app.query_one(GroceryTable)
+        records = [{"name": f"STORE {i}", "city": "HARTFORD"} for i in range(25)]
+        assert await table.add_records(records, chunk_size=10) == 25
+        assert await table.add_records([{"name": "LAST", "zip": "06001"}]) == 1
+        await pilot.pause()
+        assert table.row_count == 26
+        assert [column.value for column in table.columns] == ["name", "city", "zip"]
+        assert table.get_row_at(0) == ["STORE 0", "HARTFORD", ""]
+        assert table.get_row_at(25) == ["LAST", "", "06001"]
+        await pilot.press("ctrl+q")
+
+
+def test_datatable_internals():
+    # The bulk operations use private DataTable attributes: a Textual upgrade that changes them
+    # must fail here, not corrupt the table
+    table = DataTable()
+    assert missing_internals(table) == []
+    del table._update_count
+    table._data = []
+    assert missing_internals(table) == ["_data", "_update_count"]
+    with pytest.raises(RuntimeError, match="_data, _update_count"):
+        check_internals(table)
+
+
+@pytest.mark.asyncio
+async def test_remove_rows_keeps_cursor():
+    app = TableApp()
+    async with app.run_test() as pilot:
+        table = app.query_one(GroceryTable)
+        await table.add_records([{"credentialid": str(i), "name": f"STORE {i}"} for i in range(10)])
+        table.sort("name", reverse=True)
+        table.move_cursor(row=5)
+        cursor_key = table.coordinate_to_cell_key(table.cursor_coordinate).row_key
+        removed = [table.coordinate_to_cell_key((row, 0)).row_key for row in (0, 2, 7)]
+        table.remove_rows(removed)
+        await pilot.pause()
+        assert table.row_count == 7
+        assert [row[1] for row in map(table.get_row_at, range(7))] == [
+            "STORE 8", "STORE 6", "STORE 5", "STORE 4", "STORE 3", "STORE 1", "STORE 0"
+        ]
+        assert table.coordinate_to_cell_key(table.cursor_coordinate).row_key == cursor_key
+        assert set(table.store.row_keys) == set(table.rows)
+        await pilot.press("ctrl+q")
+
+
+def test_column_store_sort():
+    store = ColumnStore()
+    for column in ("id", "name"):
+        store.add_column(column)
+    store.extend(["a", "b", "c"], [("10", "PRICE CHOPPER"), ("9", "BIG Y"), ("", "CORNER MARKET")], ["id", "name"])
+    assert store.columns["id"].numbers is not None
+    assert store.sorted_keys("id") == ["b", "a", "c"]  # Numeric order, empty cells last
+    assert store.sorted_keys("id", reverse=True) == ["c", "a", "b"]
+    assert store.sorted_keys("name") == ["b", "c", "a"]
+    store.extend(["d"], [("1", "ALDI")], ["id", "name"])
+    assert store.sorted_keys("id") == ["d", "b", "a", "c"]
+    store.extend(["e"], [("N/A", "ZIP MART")], ["id", "name"])
+    assert store.columns["id"].numbers is None
+    assert store.sorted_keys("id")[0] == "c"
+
+
+@pytest.mark.asyncio
+async def test_header_sort_state_is_per_table():
+    app = TableApp()
+    async with app.run_test() as pilot:
+        table = app.query_one(GroceryTable)
+        await table.add_records([{"id": str(i), "name": f"STORE {i}"} for i in (3, 1, 2)])
+        table.sort("id", reverse=table.sort_reverse("id"))
+        assert [row[0] for row in (table.get_row_at(i) for i in range(3))] == ["1", "2", "3"]
+        table.sort("id", reverse=table.sort_reverse("id"))
+        assert table.get_row_at(0)[0] == "3"
+        assert not GroceryTable().current_sorts
+        await pilot.press("ctrl+q")
+
+
+def test_column_store_update_and_remove():
+    store = ColumnStore()
+    store.add_column("id")
+    store.extend(["a", "b", "c", "d"], [("4",), ("3",), ("2",), ("1",)], ["id"])
+    assert store.sorted_keys("id") == ["d", "c", "b", "a"]
+    store.update("d", "id", "5")
+    store.remove(["b"])
+    assert store.sorted_keys("id") == ["c", "a", "d"]
+    assert store.positions == {"a": 0, "c": 1, "d": 2}
+
+
+def test_record_keys_are_unique():
+    records = [{"credentialid": "1"}, {"credentialid": "1"}, {"name": "NO ID"}]
+    keys = record_keys(records)
+    assert len(set(keys)) == 3
+    assert record_keys(records[1:2], taken=set(keys[:1])) == keys[1:2]
+
+
+def test_parse_filter_to_soql():
+    record_filter = parse_filter("""city="NEW HAVEN" "joe's" zip>=06500 $select=name,zip""")
+    assert [(p.column, p.op, p.value) for p in record_filter.predicates] == [
+        ("city", "=", "NEW HAVEN"), ("name", "~", "joe's"), ("zip", ">=", "06500")
+    ]
+    params = record_filter.soql_params(["credentialid"])
+    assert params == {
+        "$where": "city = 'NEW HAVEN' AND contains(upper(name), 'JOE''S') AND zip >= '06500'",
+        "$select": "name,zip,credentialid"
+    }
+    assert [p.value for p in parse_where(params["$where"])] == ["NEW HAVEN", "JOE'S", "06500"]
+    assert not parse_filter("  ")
+    with pytest.raises(ValueError):
+        parse_filter("$select=name;drop")
+
+
+def test_record_columns_filter():
+    records = synthetic_records(2_000)  # Unique names need wide codes, cities fit in a byte
+    for record in records[::5]:
+        del record["zip"]
+    dataset = RecordColumns()
+    for start in range(0, len(records), 300):
+        dataset.extend(records[start:start + 300])
+    for text in ('city="NEW HAVEN" status!=ACTIVE', "market", "name^big", 'name="PRICE CHOPPER 7"',
+                 "zip<06300", 'zip=""', "unknown=1"):
+        record_filter = parse_filter(text)
+        expected = [record for record in records if record_filter.matches(record)]
+        selected = dataset.records(dataset.mask(record_filter.predicates), ["credentialid"])
+        assert selected == [{"credentialid": record["credentialid"]} for record in expected], text
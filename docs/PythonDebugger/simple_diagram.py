@@ -6,7 +6,11 @@ try:
     import sys
     import argparse
     from argparse import ArgumentTypeError
+    import os
+    import tempfile
+    import time
     import traceback
+    from typing import List, Tuple
     from diagrams import Cluster, Diagram
     from diagrams.onprem.workflow import Airflow
     from diagrams.onprem.queue import Celery
@@ -19,25 +23,86 @@ except ImportError:
     breakpoint()
     raise
 
+MAX_WORKERS = 100_000
+# Workers per sub-cluster, and how many of them are drawn one by one (the rest become a single node with a count)
+GROUP_SIZE = 10
+SHOWN_PER_GROUP = 5
+# Groups drawn, with more workers than fit the groups get bigger
+MAX_GROUPS = 20
 
-def generate_diagram(diagram_file: str, workers_n: int):
+
+def plan_topology(
+        workers_n: int,
+        group_size: int = GROUP_SIZE,
+        shown_per_group: int = SHOWN_PER_GROUP,
+        max_groups: int = MAX_GROUPS
+) -> List[Tuple[str, List[str]]]:
+    """
+    Split the workers into groups, in one pass, and pick the label of each node to draw
+    @param workers_n: Number of workers
+    @param group_size: Workers per group, grows if needed to keep max_groups
+    @param shown_per_group: Workers drawn on each group, the rest of the group is one aggregated node
+    @param max_groups: Most groups
+    @return: Group label and node labels, a single unnamed group when all the workers fit on one
+    """
+    if workers_n <= group_size:
+        return [("", [f"Worker {i + 1}" for i in range(workers_n)])]
+    group_size = max(group_size, -(-workers_n // max_groups))
+    groups = []
+    for start in range(0, workers_n, group_size):
+        end = min(start + group_size, workers_n)
+        labels = [f"Worker {i + 1}" for i in range(start, min(end, start + shown_per_group))]
+        if end - start > shown_per_group:
+            hidden = start + shown_per_group
+            labels.append(f"Workers {hidden + 1}-{end}\n({end - hidden} workers)")
+        groups.append((f"Workers {start + 1}-{end}" if end - start > 1 else f"Worker {end}", labels))
+    return groups
+
+
+def generate_diagram(
+        diagram_file: str,
+        workers_n: int,
+        group_size: int = GROUP_SIZE,
+        shown_per_group: int = SHOWN_PER_GROUP,
+        max_groups: int = MAX_GROUPS
+):
     """
     Generate the network diagram for the given number of workers
     @param diagram_file: Where to save the diagram
     @param workers_n: Number of workers
+    @param group_size: Workers per sub-cluster, when there are more workers than this
+    @param shown_per_group: Workers drawn on each sub-cluster
+    @param max_groups: Most sub-clusters
     """
     with Diagram("Airflow topology", filename=diagram_file, show=False):
         with Cluster("Airflow"):
             airflow = Airflow("Airflow")
 
         with Cluster("Celery workers"):
-            workers = []
-            for i in range(workers_n):
-                workers.append(Celery(f"Worker {i + 1}"))
-        airflow - workers
+            for group, labels in plan_topology(workers_n, group_size, shown_per_group, max_groups):
+                if group:
+                    with Cluster(group):
+                        airflow - [Celery(label) for label in labels]
+                else:
+                    airflow - [Celery(label) for label in labels]
 
 
-def valid_range(value: str, upper: int = 10):
+def benchmark(worker_counts: List[int], group_size: int, shown_per_group: int, max_groups: int):
+    """
+    Time to generate the diagram, and its size, for each number of workers
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        for workers_n in worker_counts:
+            diagram_file = os.path.join(directory, f"airflow_{workers_n}")
+            nodes = sum(len(labels) for _, labels in plan_topology(workers_n, group_size, shown_per_group, max_groups))
+            started = time.perf_counter()
+            generate_diagram(diagram_file, workers_n, group_size, shown_per_group, max_groups)
+            elapsed = time.perf_counter() - started
+            size = os.path.getsize(f"{diagram_file}.png")
+            print(f"workers={workers_n:>7} nodes={nodes + 1:>5} time={elapsed:7.2f}s size={size / 1024:9.1f} KiB")
+
+
+def valid_range(value: str, upper: int = MAX_WORKERS):
     try:
         int_val = int(value)
         if 1 <= int_val <= upper:
@@ -59,11 +124,44 @@ if __name__ == "__main__":
         default=1,
         help="Number of workers"
     )
+    PARSER.add_argument(
+        '--group_size',
+        action='store',
+        type=valid_range,
+        default=GROUP_SIZE,
+        help="Workers per sub-cluster, when there are more workers than this"
+    )
+    PARSER.add_argument(
+        '--shown_per_group',
+        action='store',
+        type=valid_range,
+        default=SHOWN_PER_GROUP,
+        help="Workers drawn on each sub-cluster, the rest are shown as one node with a count"
+    )
+    PARSER.add_argument(
+        '--max_groups',
+        action='store',
+        type=valid_range,
+        default=MAX_GROUPS,
+        help="Most sub-clusters, they get bigger when there are more workers"
+    )
+    PARSER.add_argument(
+        '--benchmark',
+        action='store',
+        type=lambda value: [valid_range(count) for count in value.split(',')],
+        help="Comma separated worker counts, time the diagram for each instead of saving it"
+    )
     PARSER.add_argument(
         'diagram',
         action='store',
+        nargs='?',
         help="Name of the network diagram to generate"
     )
     ARGS = PARSER.parse_args()
 
-    generate_diagram(ARGS.diagram, ARGS.workers)
+    if ARGS.benchmark:
+        benchmark(ARGS.benchmark, ARGS.group_size, ARGS.shown_per_group, ARGS.max_groups)
+    elif ARGS.diagram:
+        generate_diagram(ARGS.diagram, ARGS.workers, ARGS.group_size, ARGS.shown_per_group, ARGS.max_groups)
+    else:
+        PARSER.error("the diagram name is required")
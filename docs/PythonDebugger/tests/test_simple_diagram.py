@@ -0,0 +1,92 @@
+"""
+Layouts chosen by plan_topology: flat up to GROUP_SIZE workers, clustered after that, with the groups
+getting bigger once MAX_GROUPS are used
+"""
+import importlib.util
+import re
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+# simple_diagram.py starts the debugger when diagrams is missing
+if importlib.util.find_spec("diagrams"):
+    from simple_diagram import GROUP_SIZE, MAX_GROUPS, MAX_WORKERS, SHOWN_PER_GROUP, plan_topology
+else:
+    raise unittest.SkipTest("Needs the diagrams module")
+
+AGGREGATED = re.compile(r"Workers (\d+)-(\d+)\n\((\d+) workers\)")
+
+
+def workers_drawn(groups) -> list:
+    """
+    Worker numbers each group stands for, from the node labels
+    """
+    drawn = []
+    for _, labels in groups:
+        for label in labels:
+            aggregated = AGGREGATED.fullmatch(label)
+            if aggregated:
+                first, last, count = map(int, aggregated.groups())
+                assert last - first + 1 == count, label
+                drawn.extend(range(first, last + 1))
+            else:
+                drawn.append(int(label.removeprefix("Worker ")))
+    return drawn
+
+
+class PlanTopologyTestCase(unittest.TestCase):
+
+    def test_flat(self):
+        self.assertEqual([("", ["Worker 1"])], plan_topology(1))
+        groups = plan_topology(GROUP_SIZE)
+        self.assertEqual(1, len(groups))
+        self.assertEqual("", groups[0][0])
+        self.assertEqual([f"Worker {i}" for i in range(1, GROUP_SIZE + 1)], groups[0][1])
+
+    def test_clustered(self):
+        groups = plan_topology(GROUP_SIZE + 1)
+        self.assertEqual([f"Workers 1-{GROUP_SIZE}", f"Worker {GROUP_SIZE + 1}"], [group for group, _ in groups])
+        first = groups[0][1]
+        self.assertEqual(SHOWN_PER_GROUP + 1, len(first))
+        self.assertEqual(
+            f"Workers {SHOWN_PER_GROUP + 1}-{GROUP_SIZE}\n({GROUP_SIZE - SHOWN_PER_GROUP} workers)", first[-1]
+        )
+        self.assertEqual([f"Worker {GROUP_SIZE + 1}"], groups[1][1])
+
+    def test_aggregated_threshold(self):
+        # A group with exactly SHOWN_PER_GROUP workers draws them all, one more and they are aggregated
+        last = plan_topology(GROUP_SIZE + SHOWN_PER_GROUP)[-1]
+        self.assertEqual(SHOWN_PER_GROUP, len(last[1]))
+        self.assertFalse(any(AGGREGATED.fullmatch(label) for label in last[1]))
+        last = plan_topology(GROUP_SIZE + SHOWN_PER_GROUP + 1)[-1]
+        self.assertEqual(SHOWN_PER_GROUP + 1, len(last[1]))
+        self.assertRegex(last[1][-1], AGGREGATED)
+
+    def test_groups_grow(self):
+        fixed = GROUP_SIZE * MAX_GROUPS
+        groups = plan_topology(fixed)
+        self.assertEqual(MAX_GROUPS, len(groups))
+        self.assertEqual(f"Workers 1-{GROUP_SIZE}", groups[0][0])
+        groups = plan_topology(fixed + 1)
+        self.assertLessEqual(len(groups), MAX_GROUPS)
+        self.assertEqual(f"Workers 1-{GROUP_SIZE + 1}", groups[0][0])
+
+    def test_every_worker_once(self):
+        for workers_n in (1, GROUP_SIZE, GROUP_SIZE + 1, 99, GROUP_SIZE * MAX_GROUPS + 1, 12_345, MAX_WORKERS):
+            with self.subTest(workers_n=workers_n):
+                groups = plan_topology(workers_n)
+                self.assertEqual(list(range(1, workers_n + 1)), workers_drawn(groups))
+                self.assertLessEqual(len(groups), MAX_GROUPS)
+                nodes = sum(len(labels) for _, labels in groups)
+                self.assertLessEqual(nodes, MAX_GROUPS * (SHOWN_PER_GROUP + 1))
+
+    def test_custom_limits(self):
+        groups = plan_topology(7, group_size=3, shown_per_group=2, max_groups=2)
+        self.assertEqual(["Workers 1-4", "Workers 5-7"], [group for group, _ in groups])
+        self.assertEqual(["Worker 1", "Worker 2", "Workers 3-4\n(2 workers)"], groups[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
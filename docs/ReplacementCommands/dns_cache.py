@@ -0,0 +1,104 @@
+"""
+Caching and in-flight deduplication for bulk DNS lookups, kept apart from mx_list.py so they can be
+used (and tested) without the ldns bindings
+kodegeek.com@protonmail.com
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+# Used when a negative answer has no SOA record to take the TTL from (RFC 2308)
+NEGATIVE_TTL = 300
+# SOA fields: MNAME, RNAME, SERIAL, REFRESH, RETRY, EXPIRE, MINIMUM
+SOA_MINIMUM = 6
+
+
+def negative_ttl(soa_records: Iterable) -> int:
+    """
+    How long a 'domain does not exist' or 'no such record' answer can be cached
+    :param soa_records: SOA records of the authority section (ldns_rr, or anything with ttl() and rdf())
+    :return: The smaller of the SOA TTL and its MINIMUM field, NEGATIVE_TTL without SOA
+    """
+    record = next(iter(soa_records), None)
+    if record is None:
+        return NEGATIVE_TTL
+    return min(record.ttl(), int(str(record.rdf(SOA_MINIMUM))))
+
+
+class TtlCache:
+    """
+    Answers by domain, each one kept as long as its TTL says. Negative answers are cached too.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.entries: Dict[str, Tuple[float, Dict]] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, domain: str) -> Optional[Dict]:
+        with self.lock:
+            entry = self.entries.get(domain)
+            if entry is not None and entry[0] > self.clock():
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[domain]
+            self.misses += 1
+            return None
+
+    def put(self, domain: str, answer: Dict, ttl: int) -> None:
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[domain] = (self.clock() + ttl, answer)
+
+
+def bulk_resolve(
+        domains: Iterable[str],
+        resolve: Callable[[str], Tuple[Dict, int, float]],
+        workers: int = 16,
+        cache: Optional[TtlCache] = None
+) -> Iterator[Dict]:
+    """
+    Resolve many domains with at most `workers` queries in flight, yielding the answers as they arrive.
+    Repeated domains come from the cache, or wait for the query already in flight.
+    :param resolve: Called on a worker thread, returns the answer, its TTL and the seconds it took
+    """
+    cache = cache if cache is not None else TtlCache()
+    # Domain -> how many more times it was asked while its query was in flight
+    pending: Dict[str, int] = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        iterator = iter(domains)
+        exhausted = False
+        while not exhausted or running:
+            while not exhausted and len(running) < 2 * workers:
+                domain = next(iterator, None)
+                if domain is None:
+                    exhausted = True
+                    break
+                answer = cache.get(domain)
+                if answer is not None:
+                    yield {**answer, "cached": True}
+                elif domain in pending:
+                    pending[domain] += 1
+                else:
+                    pending[domain] = 0
+                    running[executor.submit(resolve, domain)] = domain
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                domain = running.pop(future)
+                repeats = pending.pop(domain)
+                try:
+                    answer, ttl, elapsed = future.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    answer, ttl, elapsed = {"domain": domain, "status": "ERROR", "error": str(error), "mx": []}, 0, 0.0
+                cache.put(domain, answer, ttl)
+                yield {**answer, "ttl": ttl, "cached": False, "elapsed_ms": round(elapsed * 1000, 3)}
+                for _ in range(repeats):
+                    yield {**answer, "cached": True}
@@ -3,15 +3,192 @@
 List MX records for a particular domain, using the host resolver settings
 kodegeek.com@protonmail.com
 """
+import json
+import socketserver
+import struct
 import sys
+import threading
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
 import ldns
 
+from dns_cache import TtlCache, bulk_resolve, negative_ttl
+
+MAX_WORKERS = 64
+
+
+def new_resolver(nameserver: Optional[str] = None, port: int = 53):
+    """
+    Resolver from /etc/resolv.conf, or talking to a single name server (for example a local stub)
+    """
+    if nameserver is None:
+        return ldns.ldns_resolver.new_frm_file("/etc/resolv.conf")
+    resolver = ldns.ldns_resolver.new()
+    resolver.push_nameserver(ldns.ldns_rdf.new_frm_str(nameserver, ldns.LDNS_RDF_TYPE_A))
+    resolver.set_port(port)
+    return resolver
+
+
+def query_mx(resolver, domain: str) -> Tuple[Dict, int]:
+    """
+    MX records of a domain
+    :return: Answer, ready for JSON, and how many seconds it can be cached
+    """
+    pkt = resolver.query(domain, ldns.LDNS_RR_TYPE_MX, ldns.LDNS_RR_CLASS_IN)
+    if not pkt:
+        # Timeout or no server answered, not cached
+        return {"domain": domain, "status": "TIMEOUT", "mx": []}, 0
+    rcode = pkt.get_rcode()
+    mx = pkt.rr_list_by_type(ldns.LDNS_RR_TYPE_MX, ldns.LDNS_SECTION_ANSWER)
+    if rcode == ldns.LDNS_RCODE_NOERROR and mx:
+        mx.sort()
+        records = [{"preference": int(str(rr.rdf(0))), "exchange": str(rr.rdf(1))} for rr in mx.rrs()]
+        return {"domain": domain, "status": "NOERROR", "mx": records}, min(rr.ttl() for rr in mx.rrs())
+    if rcode == ldns.LDNS_RCODE_NXDOMAIN:
+        status = "NXDOMAIN"
+    elif rcode == ldns.LDNS_RCODE_NOERROR:
+        status = "NODATA"
+    else:
+        # SERVFAIL, REFUSED: try again next time
+        return {"domain": domain, "status": f"RCODE{rcode}", "mx": []}, 0
+    soa = pkt.rr_list_by_type(ldns.LDNS_RR_TYPE_SOA, ldns.LDNS_SECTION_AUTHORITY)
+    ttl = negative_ttl(soa.rrs() if soa else ())
+    return {"domain": domain, "status": status, "mx": []}, ttl
+
+
+def read_domains(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        domain = line.strip().rstrip('.').lower()
+        if domain and not domain.startswith('#'):
+            yield domain
+
+
+def bulk_mx(
+        domains: Iterable[str],
+        workers: int = 16,
+        nameserver: Optional[str] = None,
+        port: int = 53,
+        cache: Optional[TtlCache] = None,
+        query: Callable = query_mx
+) -> Iterator[Dict]:
+    """
+    Resolve many domains with at most `workers` queries in flight, yielding the answers as they arrive.
+    Each worker thread builds its resolver once and reuses it, repeated domains come from the cache
+    or wait for the query already in flight.
+    """
+    local = threading.local()
+
+    def resolve(domain: str) -> Tuple[Dict, int, float]:
+        if not hasattr(local, "resolver"):
+            local.resolver = new_resolver(nameserver, port)
+        started = time.perf_counter()
+        answer, ttl = query(local.resolver, domain)
+        return answer, ttl, time.perf_counter() - started
+
+    return bulk_resolve(domains, resolve, workers, cache)
+
+
+def encode_name(name: str) -> bytes:
+    labels = [label.encode() for label in name.rstrip('.').split('.') if label]
+    return b"".join(struct.pack('B', len(label)) + label for label in labels) + b"\0"
+
+
+class StubDnsHandler(socketserver.BaseRequestHandler):
+    """
+    Answers every MX query with 'mail.<domain>', except for names starting with 'nx', that do not exist.
+    Only meant to benchmark the client without touching the network.
+    """
+    delay = 0.0
+    ttl = 300
+
+    def handle(self):
+        data, sock = self.request
+        if len(data) < 12:
+            return
+        query_id, _, questions = struct.unpack('!HHH', data[:6])
+        position = 12
+        labels = []
+        while position < len(data) and data[position]:
+            length = data[position]
+            labels.append(data[position + 1:position + 1 + length].decode(errors='replace'))
+            position += length + 1
+        question_end = position + 5
+        if questions != 1 or question_end > len(data):
+            return
+        qtype = struct.unpack('!H', data[position + 1:position + 3])[0]
+        domain = ".".join(labels)
+        question = data[12:question_end]
+        if self.delay:
+            time.sleep(self.delay)
+        answers = b""
+        authority = b""
+        flags = 0x8180
+        if labels and labels[0].startswith("nx"):
+            flags |= 3  # NXDOMAIN
+        if qtype == 15 and not flags & 3:
+            exchange = encode_name(f"mail.{domain}")
+            answers = struct.pack('!HHHIHH', 0xC00C, 15, 1, self.ttl, len(exchange) + 2, 10) + exchange
+        else:
+            soa = encode_name(f"ns.{domain}") + encode_name(f"hostmaster.{domain}") + struct.pack('!IIIII', 1, 3600, 600, 86400, 60)
+            authority = struct.pack('!HHHIH', 0xC00C, 6, 1, self.ttl, len(soa)) + soa
+        header = struct.pack('!HHHHHH', query_id, flags, 1, 1 if answers else 0, 1 if authority else 0, 0)
+        sock.sendto(header + question + answers + authority, self.client_address)
+
+
+def serve_stub(port: int, delay: float = 0.0):
+    StubDnsHandler.delay = delay
+    with socketserver.ThreadingUDPServer(("127.0.0.1", port), StubDnsHandler) as server:
+        print(f"Stub DNS server on 127.0.0.1:{port}, Ctrl-C to stop", file=sys.stderr)
+        server.serve_forever()
+
+
 if __name__ == "__main__":
-    for domain in sys.argv[1:]:
-        resolver = ldns.ldns_resolver.new_frm_file("/etc/resolv.conf")
-        pkt = resolver.query(domain, ldns.LDNS_RR_TYPE_MX, ldns.LDNS_RR_CLASS_IN)
-        if pkt:
-            mx = pkt.rr_list_by_type(ldns.LDNS_RR_TYPE_MX, ldns.LDNS_SECTION_ANSWER)
-            if mx:
-                mx.sort()
-                print(f"{mx}")
+    PARSER = ArgumentParser(description=__doc__)
+    PARSER.add_argument("domains", nargs="*", help="Domains to check")
+    PARSER.add_argument(
+        "--bulk",
+        metavar="FILE",
+        help="Read domains from a file, one per line ('-' for standard input), and print answers as JSON lines"
+    )
+    PARSER.add_argument("--workers", type=int, default=16, help=f"Queries in flight on bulk mode, up to {MAX_WORKERS}")
+    PARSER.add_argument("--nameserver", help="Ask this server (IPv4 address) instead of the ones on /etc/resolv.conf")
+    PARSER.add_argument("--port", type=int, default=53, help="Name server port")
+    PARSER.add_argument(
+        "--stub_server",
+        action="store_true",
+        default=False,
+        help="Run a local stub DNS server on --port instead, to benchmark --bulk offline"
+    )
+    PARSER.add_argument("--stub_delay", type=float, default=0.0, help="Seconds the stub server waits before answering")
+    OPTIONS = PARSER.parse_args()
+    try:
+        if OPTIONS.stub_server:
+            serve_stub(OPTIONS.port, OPTIONS.stub_delay)
+        elif OPTIONS.bulk:
+            SOURCE = sys.stdin if OPTIONS.bulk == "-" else open(OPTIONS.bulk, "r")
+            STARTED = time.perf_counter()
+            COUNT = 0
+            with SOURCE:
+                for ANSWER in bulk_mx(
+                        read_domains(SOURCE),
+                        workers=max(1, min(MAX_WORKERS, OPTIONS.workers)),
+                        nameserver=OPTIONS.nameserver,
+                        port=OPTIONS.port
+                ):
+                    print(json.dumps(ANSWER))
+                    COUNT += 1
+            ELAPSED = time.perf_counter() - STARTED
+            print(f"{COUNT} domains in {ELAPSED:.2f} s ({COUNT / max(ELAPSED, 1e-9):.1f}/s)", file=sys.stderr)
+        else:
+            RESOLVER = new_resolver(OPTIONS.nameserver, OPTIONS.port)
+            for domain in OPTIONS.domains:
+                pkt = RESOLVER.query(domain, ldns.LDNS_RR_TYPE_MX, ldns.LDNS_RR_CLASS_IN)
+                if pkt:
+                    mx = pkt.rr_list_by_type(ldns.LDNS_RR_TYPE_MX, ldns.LDNS_SECTION_ANSWER)
+                    if mx:
+                        mx.sort()
+                        print(f"{mx}")
+    except KeyboardInterrupt:
+        pass
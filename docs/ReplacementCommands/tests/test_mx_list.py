@@ -0,0 +1,148 @@
+"""
+TTL cache, negative caching and in-flight deduplication of the bulk MX resolver
+"""
+import importlib.util
+import socketserver
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from dns_cache import NEGATIVE_TTL, TtlCache, bulk_resolve, negative_ttl  # noqa: E402
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeSoa:
+    """
+    Stands in for an ldns_rr SOA record: rdf() values are printed as text, like ldns does
+    """
+
+    def __init__(self, ttl: int, minimum: int):
+        self._ttl = ttl
+        self.fields = ["ns.example.", "hostmaster.example.", "1", "3600", "600", "86400", str(minimum)]
+
+    def ttl(self) -> int:
+        return self._ttl
+
+    def rdf(self, index: int) -> str:
+        return self.fields[index]
+
+
+class TtlCacheTestCase(unittest.TestCase):
+
+    def test_expiry(self):
+        clock = FakeClock()
+        cache = TtlCache(clock)
+        answer = {"domain": "example.com", "status": "NOERROR", "mx": [{"preference": 10, "exchange": "mail."}]}
+        cache.put("example.com", answer, 60)
+        clock.now += 59.9
+        self.assertIs(answer, cache.get("example.com"))
+        clock.now += 0.1
+        self.assertIsNone(cache.get("example.com"))
+        self.assertNotIn("example.com", cache.entries)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_not_cached(self):
+        cache = TtlCache(FakeClock())
+        cache.put("timeout.example", {"domain": "timeout.example", "status": "TIMEOUT", "mx": []}, 0)
+        self.assertIsNone(cache.get("timeout.example"))
+        self.assertEqual({}, cache.entries)
+
+    def test_negative(self):
+        clock = FakeClock()
+        cache = TtlCache(clock)
+        ttl = negative_ttl([FakeSoa(ttl=3600, minimum=60)])
+        self.assertEqual(60, ttl)
+        cache.put("nx.example", {"domain": "nx.example", "status": "NXDOMAIN", "mx": []}, ttl)
+        clock.now += 59
+        self.assertEqual("NXDOMAIN", cache.get("nx.example")["status"])
+        clock.now += 1
+        self.assertIsNone(cache.get("nx.example"))
+
+    def test_negative_ttl(self):
+        self.assertEqual(30, negative_ttl([FakeSoa(ttl=30, minimum=60)]))
+        self.assertEqual(60, negative_ttl(iter([FakeSoa(ttl=3600, minimum=60), FakeSoa(ttl=1, minimum=1)])))
+        self.assertEqual(NEGATIVE_TTL, negative_ttl(()))
+
+
+class BulkResolveTestCase(unittest.TestCase):
+
+    def test_dedupe(self):
+        release = threading.Event()
+        calls = []
+
+        def resolve(domain: str):
+            calls.append(domain)
+            if domain == "slow.example":
+                release.wait(5)
+            return {"domain": domain, "status": "NOERROR", "mx": []}, 300, 0.001
+
+        def domains():
+            yield from ("slow.example", "fast.example", "slow.example", "slow.example")
+            release.set()
+            yield "fast.example"
+
+        cache = TtlCache(FakeClock())
+        answers = list(bulk_resolve(domains(), resolve, workers=2, cache=cache))
+        self.assertEqual(["fast.example", "slow.example"], sorted(calls))
+        self.assertEqual(5, len(answers))
+        slow = [answer for answer in answers if answer["domain"] == "slow.example"]
+        self.assertEqual([False, True, True], [answer["cached"] for answer in slow])
+        self.assertEqual(300, slow[0]["ttl"])
+        fast = [answer for answer in answers if answer["domain"] == "fast.example"]
+        self.assertEqual([False, True], [answer["cached"] for answer in fast])
+        self.assertIsNotNone(cache.get("slow.example"))
+
+    def test_errors_not_cached(self):
+        calls = []
+
+        def resolve(domain: str):
+            calls.append(domain)
+            raise OSError("unreachable")
+
+        cache = TtlCache(FakeClock())
+        answers = list(bulk_resolve(["down.example"], resolve, workers=1, cache=cache))
+        answers += list(bulk_resolve(["down.example"], resolve, workers=1, cache=cache))
+        self.assertEqual(["ERROR", "ERROR"], [answer["status"] for answer in answers])
+        self.assertEqual(2, len(calls))
+
+
+@unittest.skipUnless(importlib.util.find_spec("ldns"), "Needs the ldns bindings (python3-ldns)")
+class StubServerTestCase(unittest.TestCase):
+
+    def test_bulk_mx(self):
+        from mx_list import StubDnsHandler, bulk_mx  # pylint: disable=import-outside-toplevel
+        with socketserver.ThreadingUDPServer(("127.0.0.1", 0), StubDnsHandler) as server:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                port = server.server_address[1]
+                domains = ["example.com", "nx.example.com", "example.com"]
+                answers = list(bulk_mx(domains, workers=2, nameserver="127.0.0.1", port=port))
+            finally:
+                server.shutdown()
+        by_domain = {}
+        for answer in answers:
+            by_domain.setdefault(answer["domain"], []).append(answer)
+        self.assertEqual(
+            [{"preference": 10, "exchange": "mail.example.com."}], by_domain["example.com"][0]["mx"]
+        )
+        self.assertEqual([False, True], [answer["cached"] for answer in by_domain["example.com"]])
+        nx_answer = by_domain["nx.example.com"][0]
+        self.assertEqual("NXDOMAIN", nx_answer["status"])
+        # SOA TTL 300, MINIMUM 60
+        self.assertEqual(60, nx_answer["ttl"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,52 +1,761 @@
 #!/usr/bin/env python
 """
-Simple script to simulate light activity on NFS drives
+Simple script to simulate light activity on NFS drives, or heavier load with latency histograms
 Author Jose Vicente Nunez (kodegeek.com@protonmail.com)
 """
 import concurrent
+import ctypes
+import ctypes.util
+import glob
+import json
+import mmap
+import multiprocessing
 import os
+import queue
+import random
+import select
+import struct
+import sys
+import tempfile
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, ALL_COMPLETED
+from dataclasses import dataclass, field
 from pathlib import Path
 from argparse import ArgumentParser
 import logging
+from typing import Any, Dict, Iterator, List, Optional
 
 logging.basicConfig(format='%(asctime)s %(message)s', encoding='utf-8', level=logging.DEBUG)
 
+CHUNK_SIZE = 1024 * 1024
+# Polling interval of the original loop
+LEGACY_POLL = 0.1
+# Adaptive polling starts fast after new data, and backs off while the file is idle. It is the
+# fallback on NFS, where an idle follower then wakes up about once per MAX_POLL instead of every LEGACY_POLL.
+MIN_POLL = 0.005
+MAX_POLL = 1.0
+# Even with inotify, check for truncation and rotation this often
+INOTIFY_TIMEOUT = 5.0
+# inotify only sees changes made by this machine on these
+REMOTE_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'fuse.sshfs', '9p')
+FOLLOW_MODES = ('auto', 'inotify', 'poll', 'sleep')
 
-def forever_read(the_file: Path, verbose: bool = False):
-    for line in continuous_read(the_file=the_file):
-        if verbose:
-            logging.warning(line.strip())
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
 
 
-def continuous_read(the_file: Path):
+def filesystem_type(the_file: Path) -> str:
+    """
+    Type of the filesystem holding the file, from the longest matching mount point on /proc/mounts
+    """
+    path = str(Path(the_file).resolve())
+    best = ""
+    fs_type = "unknown"
+    try:
+        with open('/proc/mounts', 'r') as mounts:
+            for mount in mounts:
+                fields = mount.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+                if inside and len(mount_point) >= len(best):
+                    best = mount_point
+                    fs_type = fields[2]
+    except OSError:
+        pass
+    return fs_type
+
+
+class Inotify:
+    """
+    Minimal inotify through libc, watching one directory for changes to one file name
+    """
+
+    def __init__(self, the_file: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.name = Path(the_file).name.encode()
+        mask = IN_MODIFY | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        # The directory is watched, so a rotated file is still seen when it is created again
+        directory = str(Path(the_file).resolve().parent).encode()
+        if libc.inotify_add_watch(self.fd, directory, mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for a change to the file
+        :param timeout: Seconds
+        :return: False if nothing happened before the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.poller.poll(remaining * 1000):
+                return False
+            if self._relevant(os.read(self.fd, 64 * 1024)):
+                return True
+
+    def _relevant(self, events: bytes) -> bool:
+        found = False
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(events):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(events, offset)
+            offset += INOTIFY_EVENT.size
+            name = events[offset:offset + length].rstrip(b'\0')
+            offset += length
+            found = found or name == self.name
+        return found
+
+    def close(self):
+        os.close(self.fd)
+
+
+@dataclass
+class FollowStats:
+    """
+    Counters for a follower. Latencies are only known when the writer puts a timestamp on each line.
+    """
+    wakeups: int = 0
+    chunks: int = 0
+    bytes_read: int = 0
+    lines: int = 0
+    truncations: int = 0
+    rotations: int = 0
+    started: float = field(default_factory=time.monotonic)
+    latencies: List[float] = field(default_factory=list)
+
+    def wakeup_rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.wakeups / elapsed if elapsed > 0 else 0.0
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    def summary(self) -> str:
+        text = (
+            f"wakeups={self.wakeups} ({self.wakeup_rate():.1f}/s), chunks={self.chunks}, "
+            f"bytes={self.bytes_read}, lines={self.lines}, truncations={self.truncations}, rotations={self.rotations}"
+        )
+        if self.latencies:
+            text += (
+                f", latency p50={self.percentile(50) * 1000:.1f} ms p99={self.percentile(99) * 1000:.1f} ms "
+                f"max={max(self.latencies) * 1000:.1f} ms"
+            )
+        return text
+
+
+class Follower:
+    """
+    Follow a file like 'tail -F': reads new bytes in big chunks, waits with inotify when the filesystem
+    supports it and polls with exponential backoff when it does not (NFS), and copes with truncation and rotation.
+    """
+
+    def __init__(
+            self,
+            the_file: Path,
+            mode: str = 'auto',
+            chunk_size: int = CHUNK_SIZE,
+            from_start: bool = False,
+            stats: Optional[FollowStats] = None,
+            max_poll: float = MAX_POLL
+    ):
+        self.the_file = Path(the_file)
+        self.max_poll = max_poll
+        self.chunk_size = chunk_size
+        self.stats = stats if stats is not None else FollowStats()
+        self.inotify = None
+        if mode == 'auto':
+            mode = 'poll' if filesystem_type(self.the_file).startswith(REMOTE_FILESYSTEMS) else 'inotify'
+        if mode == 'inotify':
+            try:
+                self.inotify = Inotify(self.the_file)
+            except (OSError, AttributeError) as os_error:
+                logging.warning(f"inotify not available for {self.the_file} ({os_error}), polling instead")
+                mode = 'poll'
+        self.mode = mode
+        self.delay = MIN_POLL
+        self.fd = os.open(self.the_file, os.O_RDONLY)
+        self.position = 0 if from_start else os.lseek(self.fd, 0, os.SEEK_END)
+
+    def chunks(self) -> Iterator[bytes]:
+        try:
+            while True:
+                data = os.read(self.fd, self.chunk_size)
+                if data:
+                    self.position += len(data)
+                    self.stats.chunks += 1
+                    self.stats.bytes_read += len(data)
+                    self.delay = MIN_POLL
+                    yield data
+                    continue
+                # Everything written so far was read, see if the file was replaced before waiting
+                if self._check_file():
+                    continue
+                self._wait()
+        finally:
+            self.close()
+
+    def lines(self) -> Iterator[str]:
+        partial = b""
+        for data in self.chunks():
+            data = partial + data
+            end = data.rfind(b"\n") + 1
+            partial = data[end:]
+            if not end:
+                continue
+            lines = data[:end].decode('utf-8', errors='replace').splitlines(keepends=True)
+            self.stats.lines += len(lines)
+            yield from lines
+
+    def _check_file(self) -> bool:
+        """
+        Handle truncation and rotation
+        :return: True if reading should start again
+        """
+        current = os.fstat(self.fd)
+        if current.st_size < self.position:
+            logging.warning(f"{self.the_file} was truncated, reading from the start")
+            self.position = os.lseek(self.fd, 0, os.SEEK_SET)
+            self.stats.truncations += 1
+            return True
+        try:
+            latest = os.stat(self.the_file)
+        except FileNotFoundError:
+            # Rotated, the new file is not there yet
+            return False
+        if (latest.st_ino, latest.st_dev) != (current.st_ino, current.st_dev):
+            logging.warning(f"{self.the_file} was rotated, following the new file")
+            os.close(self.fd)
+            self.fd = os.open(self.the_file, os.O_RDONLY)
+            self.position = 0
+            self.stats.rotations += 1
+            return True
+        return False
+
+    def _wait(self):
+        if self.mode == 'inotify':
+            self.inotify.wait(INOTIFY_TIMEOUT)
+        elif self.mode == 'poll':
+            time.sleep(self.delay)
+            self.delay = min(self.delay * 2, self.max_poll)
+        else:
+            time.sleep(LEGACY_POLL)
+        self.stats.wakeups += 1
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+
+def forever_read(the_file: Path, verbose: bool = False, mode: str = 'auto', max_poll: float = MAX_POLL):
+    stats = FollowStats()
+    try:
+        for line in continuous_read(the_file=the_file, mode=mode, stats=stats, max_poll=max_poll):
+            if verbose:
+                logging.warning(line.strip())
+    finally:
+        logging.info(f"Follow {the_file}: {stats.summary()}")
+
+
+def continuous_read(
+        the_file: Path,
+        mode: str = 'auto',
+        stats: Optional[FollowStats] = None,
+        max_poll: float = MAX_POLL
+):
     """
     Continuously read the contents of file
     :param the_file:
+    :param mode: How to wait for new data: inotify, poll (adaptive backoff), sleep (fixed 100 ms) or auto
+    :param stats: Wakeups and bytes read
+    :param max_poll: Longest wait between polls while the file is idle
     :return:
     """
-    with open(the_file, 'r') as file_data:
-        file_data.seek(0, os.SEEK_END)
+    yield from Follower(the_file, mode=mode, stats=stats, max_poll=max_poll).lines()
+
+
+def compare_follow(directory: Path, seconds: float, rate: float, modes: List[str], max_poll: float = MAX_POLL):
+    """
+    Append timestamped lines to a scratch file at a steady rate and follow it with each mode,
+    to compare wakeups and the delay between a write and the read that sees it
+    :param directory: Where the scratch file goes, use the NFS mount to test it
+    :param seconds: Time per mode
+    :param rate: Lines written per second
+    :param modes: Follow modes
+    :param max_poll: Longest wait between polls while the file is idle
+    :return:
+    """
+    for mode in modes:
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='follow-', suffix='.log') as scratch:
+            stats = FollowStats()
+            follower = Follower(Path(scratch.name), mode=mode, stats=stats, max_poll=max_poll)
+
+            def write():
+                deadline = time.monotonic() + seconds
+                while time.monotonic() < deadline:
+                    scratch.write(f"{time.time()} payload\n")
+                    scratch.flush()
+                    time.sleep(1 / rate)
+                scratch.write("STOP\n")
+                scratch.flush()
+
+            writer = threading.Thread(target=write, daemon=True)
+            writer.start()
+            for line in follower.lines():
+                if line.startswith("STOP"):
+                    break
+                stats.latencies.append(time.time() - float(line.split(maxsplit=1)[0]))
+            writer.join()
+            follower.close()
+            logging.info(f"{follower.mode:<8} {stats.summary()}")
+
+
+# Histogram buckets: exact up to 2 * SUB_BUCKETS microseconds, then SUB_BUCKETS per power of two (~1.5% error)
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_LATENCY_US = 3_600_000_000
+DEFAULT_FILE_SIZE = 64 * 1024 * 1024
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of latencies in microseconds: log-linear buckets with fixed relative precision,
+    cheap to record and to merge, so each worker keeps its own and they are added up at the end
+    """
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * (self._index(MAX_LATENCY_US) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < 2 * SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return 2 * SUB_BUCKETS + (shift - 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def _highest(index: int) -> int:
+        """
+        Largest value that lands on the bucket
+        """
+        if index < 2 * SUB_BUCKETS:
+            return index
+        shift = (index - 2 * SUB_BUCKETS) // SUB_BUCKETS + 1
+        sub_bucket = (index - 2 * SUB_BUCKETS) % SUB_BUCKETS + SUB_BUCKETS
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, seconds: float) -> None:
+        value = min(MAX_LATENCY_US, max(0, int(seconds * 1_000_000)))
+        self.counts[self._index(value)] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        self.max = max(self.max, value)
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if not other.count:
+            return
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.min = other.min if not self.count else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, percent: float) -> int:
+        """
+        Latency in microseconds at or below which percent of the operations finished
+        """
+        if not self.count:
+            return 0
+        wanted = max(1, int(round(self.count * percent / 100)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'min_ms': self.min / 1000,
+            'mean_ms': self.total / self.count / 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(50) / 1000,
+            'p99_ms': self.percentile(99) / 1000,
+            'p999_ms': self.percentile(99.9) / 1000,
+            'max_ms': self.max / 1000
+        }
+
+
+@dataclass
+class FileLoad:
+    """
+    What the workers did to one file
+    """
+    reads: LatencyHistogram = field(default_factory=LatencyHistogram)
+    writes: LatencyHistogram = field(default_factory=LatencyHistogram)
+    bytes_read: int = 0
+    bytes_written: int = 0
+    errors: int = 0
+
+    def merge(self, other: "FileLoad") -> None:
+        self.reads.merge(other.reads)
+        self.writes.merge(other.writes)
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        self.errors += other.errors
+
+    def report(self, seconds: float) -> Dict[str, Any]:
+        operations = self.reads.count + self.writes.count
+        return {
+            'ops_s': operations / seconds,
+            'read_mb_s': self.bytes_read / seconds / 2 ** 20,
+            'write_mb_s': self.bytes_written / seconds / 2 ** 20,
+            'errors': self.errors,
+            'reads': self.reads.summary(),
+            'writes': self.writes.summary()
+        }
+
+
+@dataclass
+class WorkerPlan:
+    worker: int
+    files: List[str]
+    read_ratio: float
+    # Operations per second for this worker, 0 runs as fast as possible
+    rate: float
+    block_sizes: List[int]
+    duration: float
+    interval: float
+
+
+def run_worker(plan: WorkerPlan, progress) -> Dict[str, FileLoad]:
+    """
+    Random reads and writes of random block sizes, paced to the plan rate.
+    Latency is measured from when the operation was due, not when it started, so a slow server
+    that makes the worker fall behind shows up on the histogram (no coordinated omission).
+    Every interval the worker puts (operations, bytes, histogram) for that interval on progress.
+    """
+    rnd = random.Random(plan.worker)
+    writes = plan.read_ratio < 1.0
+    descriptors = {path: os.open(path, os.O_RDWR if writes else os.O_RDONLY) for path in plan.files}
+    sizes = {path: os.fstat(fd).st_size for path, fd in descriptors.items()}
+    payload = memoryview(os.urandom(max(plan.block_sizes)))
+    loads = {path: FileLoad() for path in plan.files}
+    interval = LatencyHistogram()
+    interval_bytes = 0
+    started = time.monotonic()
+    end = started + plan.duration
+    next_report = started + plan.interval
+    due = started
+    try:
         while True:
-            line = file_data.readline()
-            if not line:
-                time.sleep(0.1)
+            now = time.monotonic()
+            if now >= end:
+                break
+            if plan.rate:
+                due += 1 / plan.rate
+                if due > now:
+                    time.sleep(due - now)
+            else:
+                due = now
+            path = rnd.choice(plan.files)
+            fd = descriptors[path]
+            size = rnd.choice(plan.block_sizes)
+            offset = rnd.randrange(0, max(1, sizes[path] - size + 1))
+            load = loads[path]
+            try:
+                if rnd.random() < plan.read_ratio:
+                    transferred = len(os.pread(fd, size, offset))
+                    load.bytes_read += transferred
+                    histogram = load.reads
+                else:
+                    transferred = os.pwrite(fd, payload[:size], offset)
+                    load.bytes_written += transferred
+                    histogram = load.writes
+            except OSError as os_error:
+                load.errors += 1
+                logging.debug(f"{path}: {os_error}")
+                continue
+            latency = time.monotonic() - due
+            histogram.record(latency)
+            interval.record(latency)
+            interval_bytes += transferred
+            if progress is not None and time.monotonic() >= next_report:
+                progress.put((interval.count, interval_bytes, interval))
+                interval = LatencyHistogram()
+                interval_bytes = 0
+                next_report += plan.interval
+    finally:
+        for fd in descriptors.values():
+            os.close(fd)
+    if progress is not None and interval.count:
+        progress.put((interval.count, interval_bytes, interval))
+    return loads
+
+
+def prepare_files(patterns: List[str], file_size: int, writes: bool, allow_overwrite: bool) -> List[str]:
+    """
+    Expand globs, and create the files that do not exist yet, filled with random data.
+    Only files created here get written to, unless allow_overwrite is set.
+    """
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isdir(path):
                 continue
-            yield line
+            if not os.path.exists(path):
+                logging.info(f"Creating {path} ({file_size} bytes)")
+                block = os.urandom(min(file_size, 1024 * 1024))
+                with open(path, 'wb') as new_file:
+                    for start in range(0, file_size, len(block)):
+                        new_file.write(block[:file_size - start])
+            elif writes and not allow_overwrite:
+                raise ValueError(f"{path} already exists, refusing to write on it (see --allow_overwrite)")
+            files.append(path)
+    if not files:
+        raise ValueError(f"No files matched {patterns}")
+    return files
 
 
-def quick_read(the_file: Path, verbose: bool = False):
+def generate_load(
+        patterns: List[str],
+        read_ratio: float = 1.0,
+        rate: float = 0,
+        block_sizes: Optional[List[int]] = None,
+        workers: int = 4,
+        pool: str = 'thread',
+        duration: float = 30,
+        interval: float = 1,
+        file_size: int = DEFAULT_FILE_SIZE,
+        allow_overwrite: bool = False
+) -> Dict[str, Any]:
+    """
+    Run the load and return the report, per file and in total
+    :param patterns: Files or globs, files that do not exist are created
+    :param read_ratio: Fraction of the operations that are reads
+    :param rate: Target operations per second across all the workers, 0 for no limit
+    :param block_sizes: Bytes per operation, one is picked at random each time
+    :param workers: Threads or processes
+    :param pool: thread or process
+    :param duration: Seconds
+    :param interval: Seconds between live summaries
+    :param file_size: Size of the files created
+    :param allow_overwrite: Write on files that already existed
+    :return: Report, ready for JSON
+    """
+    block_sizes = block_sizes or [4096]
+    files = prepare_files(patterns, file_size, read_ratio < 1.0, allow_overwrite)
+    plans = [
+        WorkerPlan(worker, files, read_ratio, rate / workers, block_sizes, duration, interval)
+        for worker in range(workers)
+    ]
+    if pool == 'process':
+        manager = multiprocessing.Manager()
+        progress = manager.Queue()
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        manager = None
+        progress = queue.Queue()
+        executor = ThreadPoolExecutor(max_workers=workers)
+    started = time.monotonic()
+    with executor:
+        futures = [executor.submit(run_worker, plan, progress) for plan in plans]
+        last = started
+        operations = transferred = 0
+        window = LatencyHistogram()
+        while not all(future.done() for future in futures) or not progress.empty():
+            try:
+                count, data, histogram = progress.get(timeout=0.2)
+                operations += count
+                transferred += data
+                window.merge(histogram)
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if now - last >= interval and operations:
+                logging.info(
+                    f"t={now - started:6.1f}s ops={operations / (now - last):10.1f}/s "
+                    f"{transferred / (now - last) / 2 ** 20:8.1f} MB/s "
+                    f"p50={window.percentile(50) / 1000:.2f} ms p99={window.percentile(99) / 1000:.2f} ms"
+                )
+                last = now
+                operations = transferred = 0
+                window = LatencyHistogram()
+        results = [future.result() for future in futures]
+    elapsed = time.monotonic() - started
+    if manager is not None:
+        manager.shutdown()
+    per_file = {path: FileLoad() for path in files}
+    total = FileLoad()
+    for loads in results:
+        for path, load in loads.items():
+            per_file[path].merge(load)
+            total.merge(load)
+    return {
+        'duration_s': elapsed,
+        'workers': workers,
+        'pool': pool,
+        'read_ratio': read_ratio,
+        'target_ops_s': rate,
+        'block_sizes': block_sizes,
+        'files': {path: load.report(elapsed) for path, load in per_file.items()},
+        'total': total.report(elapsed)
+    }
+
+
+READ_MODES = ('lines', 'readinto', 'mmap', 'fadvise', 'direct')
+BULK_BUFFER = 1024 * 1024
+
+
+def drop_cache(the_file: Path) -> None:
+    """
+    Ask the kernel to forget the cached pages of the file, so the next read goes to the server.
+    On NFS this empties the client cache only, the server may still have the data in memory.
+    """
+    fd = os.open(the_file, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _read_fd(fd: int, buffer) -> int:
+    total = 0
+    while True:
+        read = os.readv(fd, [buffer])
+        if not read:
+            return total
+        total += read
+
+
+def bulk_read(the_file: Path, mode: str, buffer_size: int = BULK_BUFFER) -> int:
+    """
+    Read the whole file without decoding it, into one reused buffer
+    :param the_file:
+    :param mode: readinto, mmap (with a sequential access hint), fadvise (sequential hint, then read) or direct (O_DIRECT)
+    :param buffer_size: Bytes per read
+    :return: Bytes read
+    """
+    if mode == 'readinto':
+        buffer = bytearray(buffer_size)
+        total = 0
+        with open(the_file, 'rb', buffering=0) as file_data:
+            while read := file_data.readinto(buffer):
+                total += read
+        return total
+    if mode == 'mmap':
+        with open(the_file, 'rb') as file_data:
+            size = os.fstat(file_data.fileno()).st_size
+            if not size:
+                return 0
+            with mmap.mmap(file_data.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                # Touching one byte per page is enough to fault the whole file in, without copying it
+                for offset in range(0, size, mmap.PAGESIZE):
+                    mapped[offset]
+            return size
+    if mode == 'fadvise':
+        fd = os.open(the_file, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            return _read_fd(fd, bytearray(buffer_size))
+        finally:
+            os.close(fd)
+    if mode == 'direct':
+        # O_DIRECT needs aligned buffers, an anonymous map is page aligned
+        buffer_size = max(mmap.PAGESIZE, buffer_size // mmap.PAGESIZE * mmap.PAGESIZE)
+        fd = os.open(the_file, os.O_RDONLY | os.O_DIRECT)
+        try:
+            with mmap.mmap(-1, buffer_size) as buffer:
+                return _read_fd(fd, buffer)
+        finally:
+            os.close(fd)
+    raise ValueError(f"Unknown read mode {mode}")
+
+
+def quick_read(
+        the_file: Path,
+        verbose: bool = False,
+        mode: str = 'lines',
+        buffer_size: int = BULK_BUFFER,
+        cold: bool = False
+) -> float:
     """
     Red the whole file and close it once done
     :param verbose:
     :param the_file:
-    :return:
+    :param mode: lines decodes and splits the file (the only mode that can print it), the rest are bulk reads
+    :param buffer_size: Bytes per read on the bulk modes
+    :param cold: Drop the cached pages of the file first
+    :return: MB/s
     """
-    with open(the_file, 'r') as file_data:
-        for line in file_data:
-            if verbose:
-                logging.warning(line.strip())
+    if cold:
+        drop_cache(the_file)
+    started = time.perf_counter()
+    if mode == 'lines' or verbose:
+        total = 0
+        # Binary, so the total is in bytes like the bulk modes, and each line is decoded on its own
+        with open(the_file, 'rb') as file_data:
+            for raw_line in file_data:
+                total += len(raw_line)
+                line = raw_line.decode('utf-8', errors='replace')
+                if verbose:
+                    logging.warning(line.strip())
+    else:
+        total = bulk_read(the_file, mode, buffer_size)
+    elapsed = time.perf_counter() - started
+    throughput = total / elapsed / 2 ** 20 if elapsed > 0 else 0.0
+    logging.info(
+        f"{the_file}: {mode:<8} {'cold' if cold else 'warm'} {total} bytes in {elapsed:.3f} s, {throughput:.1f} MB/s"
+    )
+    return throughput
+
+
+def compare_read(the_file: Path, buffer_size: int = BULK_BUFFER):
+    """
+    Every read mode, first with a cold cache and then with a warm one
+    """
+    for mode in READ_MODES:
+        for cold in (True, False):
+            try:
+                quick_read(the_file, mode=mode, buffer_size=buffer_size, cold=cold)
+            except OSError as os_error:
+                # O_DIRECT is not supported everywhere (tmpfs for example)
+                logging.warning(f"{the_file}: {mode} is not supported here ({os_error})")
+                break
 
 
 if __name__ == "__main__":
@@ -60,22 +769,137 @@ if __name__ == "__main__":
     PARSER.add_argument(
         '--quick_read',
         type=Path,
-        required=True,
         help='Read a file once'
     )
+    PARSER.add_argument(
+        '--read_mode',
+        choices=READ_MODES,
+        default='lines',
+        help='How --quick_read reads the file. lines decodes every line, the others read raw bytes to measure throughput'
+    )
+    PARSER.add_argument(
+        '--buffer_size',
+        type=int,
+        default=BULK_BUFFER,
+        help='Bytes per read for the bulk read modes'
+    )
+    PARSER.add_argument(
+        '--cold',
+        action='store_true',
+        default=False,
+        help='Drop the cached pages of the --quick_read file before reading it'
+    )
+    PARSER.add_argument(
+        '--compare_read',
+        action='store_true',
+        default=False,
+        help='Read the --quick_read file with every read mode, cold and warm, and report MB/s'
+    )
     PARSER.add_argument(
         '--follow',
         type=Path,
-        required=True,
         help='Read a file continuously'
     )
+    PARSER.add_argument(
+        '--follow_mode',
+        choices=FOLLOW_MODES,
+        default='auto',
+        help='How to wait for new data. auto uses inotify, or polling on network filesystems where inotify misses remote writes'
+    )
+    PARSER.add_argument(
+        '--max_poll',
+        type=float,
+        default=MAX_POLL,
+        help='Longest wait between polls, in seconds, while a polled file is idle. Longer waits mean fewer wakeups on NFS, '
+             'and more delay before the first line written after a quiet period is seen'
+    )
+    PARSER.add_argument(
+        '--compare_follow',
+        type=float,
+        help='Instead of following, compare the follow modes for this many seconds each, on a scratch file next to --follow'
+    )
+    PARSER.add_argument(
+        '--rate',
+        type=float,
+        default=50,
+        help='Lines per second written by --compare_follow'
+    )
+    LOAD = PARSER.add_argument_group('Load generator')
+    LOAD.add_argument(
+        '--load',
+        nargs='+',
+        metavar='FILE_OR_GLOB',
+        help='Generate load on these files instead of following one. Files that do not exist are created'
+    )
+    LOAD.add_argument('--read_ratio', type=float, default=1.0, help='Fraction of operations that are reads, the rest are writes')
+    LOAD.add_argument('--ops', type=float, default=0, help='Target operations per second, all workers together. 0 means no limit')
+    LOAD.add_argument('--block_sizes', type=int, nargs='+', default=[4096], help='Bytes per operation, picked at random')
+    LOAD.add_argument('--workers', type=int, default=4, help='Number of threads or processes')
+    LOAD.add_argument('--pool', choices=('thread', 'process'), default='thread', help='Run workers on threads or processes')
+    LOAD.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    LOAD.add_argument('--interval', type=float, default=1, help='Seconds between live summaries')
+    LOAD.add_argument('--file_size', type=int, default=DEFAULT_FILE_SIZE, help='Size of the files created by --load')
+    LOAD.add_argument('--allow_overwrite', action='store_true', default=False, help='Allow writes on files that already existed')
+    LOAD.add_argument('--json', type=Path, help='Write the report here, - for standard output')
     OPTIONS = PARSER.parse_args()
+    if OPTIONS.compare_read and not OPTIONS.quick_read:
+        PARSER.error("--compare_read needs --quick_read")
+    if not OPTIONS.follow and not OPTIONS.load and not OPTIONS.compare_read:
+        PARSER.error("one of --follow, --load or --compare_read is required")
+    if OPTIONS.max_poll < MIN_POLL:
+        PARSER.error(f"--max_poll must be at least {MIN_POLL} seconds")
     try:
-        with ThreadPoolExecutor(max_workers=3) as tpe:
-            futures = [
-                tpe.submit(forever_read, OPTIONS.follow, OPTIONS.verbose),
-                tpe.submit(quick_read, OPTIONS.quick_read, OPTIONS.verbose)
-            ]
-            concurrent.futures.wait(futures, return_when=ALL_COMPLETED)
+        if OPTIONS.load:
+            try:
+                REPORT = generate_load(
+                    OPTIONS.load,
+                    read_ratio=OPTIONS.read_ratio,
+                    rate=OPTIONS.ops,
+                    block_sizes=OPTIONS.block_sizes,
+                    workers=OPTIONS.workers,
+                    pool=OPTIONS.pool,
+                    duration=OPTIONS.duration,
+                    interval=OPTIONS.interval,
+                    file_size=OPTIONS.file_size,
+                    allow_overwrite=OPTIONS.allow_overwrite
+                )
+            except ValueError as value_error:
+                PARSER.error(str(value_error))
+            for PATH, FILE_REPORT in REPORT['files'].items():
+                logging.info(
+                    f"{PATH}: {FILE_REPORT['ops_s']:.1f} ops/s, read {FILE_REPORT['read_mb_s']:.1f} MB/s, "
+                    f"write {FILE_REPORT['write_mb_s']:.1f} MB/s, "
+                    f"read p50/p99/p999={FILE_REPORT['reads']['p50_ms']:.2f}/{FILE_REPORT['reads']['p99_ms']:.2f}/"
+                    f"{FILE_REPORT['reads']['p999_ms']:.2f} ms, "
+                    f"write p50/p99/p999={FILE_REPORT['writes']['p50_ms']:.2f}/{FILE_REPORT['writes']['p99_ms']:.2f}/"
+                    f"{FILE_REPORT['writes']['p999_ms']:.2f} ms"
+                )
+            if OPTIONS.json:
+                if str(OPTIONS.json) == '-':
+                    json.dump(REPORT, sys.stdout, indent=2)
+                else:
+                    with open(OPTIONS.json, 'w') as json_file:
+                        json.dump(REPORT, json_file, indent=2)
+        elif OPTIONS.compare_read:
+            compare_read(OPTIONS.quick_read, OPTIONS.buffer_size)
+        elif OPTIONS.compare_follow:
+            compare_follow(
+                OPTIONS.follow.parent, OPTIONS.compare_follow, OPTIONS.rate, ['sleep', 'poll', 'inotify'], OPTIONS.max_poll
+            )
+        else:
+            with ThreadPoolExecutor(max_workers=3) as tpe:
+                futures = [
+                    tpe.submit(forever_read, OPTIONS.follow, OPTIONS.verbose, OPTIONS.follow_mode, OPTIONS.max_poll)
+                ]
+                if OPTIONS.quick_read:
+                    futures.append(tpe.submit(
+                        quick_read,
+                        OPTIONS.quick_read,
+                        OPTIONS.verbose,
+                        OPTIONS.read_mode,
+                        OPTIONS.buffer_size,
+                        OPTIONS.cold
+                    ))
+                concurrent.futures.wait(futures, return_when=ALL_COMPLETED)
     except KeyboardInterrupt:
-        pass
\ No newline at end of file
+        pass
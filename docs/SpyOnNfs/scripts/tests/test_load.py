@@ -0,0 +1,104 @@
+"""
+Histogram math and pacing of the load generator of test_script.py
+"""
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from test_script import MAX_LATENCY_US, SUB_BUCKETS, LatencyHistogram, generate_load  # noqa: E402
+
+# Relative error of a bucket, above the exact range
+PRECISION = 1 / SUB_BUCKETS
+
+
+def histogram_of(latencies_us) -> LatencyHistogram:
+    histogram = LatencyHistogram()
+    for value in latencies_us:
+        histogram.record((value + 0.5) / 1_000_000)
+    return histogram
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+
+    def test_exact_range(self):
+        histogram = histogram_of(range(1, 2 * SUB_BUCKETS + 1))
+        self.assertEqual(SUB_BUCKETS, histogram.percentile(50))
+        self.assertEqual(2 * SUB_BUCKETS, histogram.percentile(100))
+        self.assertEqual(1, histogram.min)
+
+    def test_percentiles(self):
+        latencies = range(1, 100_001)
+        histogram = histogram_of(latencies)
+        for percent, expected in ((50, 50_000), (99, 99_000), (99.9, 99_900)):
+            with self.subTest(percent=percent):
+                found = histogram.percentile(percent)
+                self.assertGreaterEqual(found, expected)
+                self.assertLessEqual(found, expected * (1 + PRECISION))
+        self.assertEqual(100_000, histogram.percentile(100))
+        summary = histogram.summary()
+        self.assertEqual(100_000, summary['count'])
+        self.assertAlmostEqual(50.0005, summary['mean_ms'], places=3)
+
+    def test_buckets(self):
+        for value in (2 * SUB_BUCKETS, 1_000, 65_535, 1_000_000, MAX_LATENCY_US):
+            with self.subTest(value=value):
+                highest = LatencyHistogram._highest(LatencyHistogram._index(value))
+                self.assertGreaterEqual(highest, value)
+                self.assertLessEqual(highest - value, value * PRECISION)
+                self.assertEqual(LatencyHistogram._index(value), LatencyHistogram._index(highest))
+
+    def test_merge(self):
+        merged = histogram_of(range(1, 5_001))
+        merged.merge(histogram_of(range(5_001, 10_001)))
+        merged.merge(LatencyHistogram())
+        whole = histogram_of(range(1, 10_001))
+        self.assertEqual(whole.counts, merged.counts)
+        self.assertEqual((whole.count, whole.total, whole.min, whole.max),
+                         (merged.count, merged.total, merged.min, merged.max))
+
+    def test_clamped(self):
+        histogram = LatencyHistogram()
+        histogram.record(-1)
+        histogram.record(10 * MAX_LATENCY_US)
+        self.assertEqual(0, histogram.min)
+        self.assertEqual(MAX_LATENCY_US, histogram.max)
+        self.assertEqual(MAX_LATENCY_US, histogram.percentile(99.9))
+
+
+class GenerateLoadTestCase(unittest.TestCase):
+
+    def test_rate_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            report = generate_load(
+                [str(Path(directory) / 'load.bin')],
+                rate=200,
+                workers=2,
+                duration=1.0,
+                interval=0.5,
+                file_size=64 * 1024
+            )
+        total = report['total']
+        self.assertEqual(0, total['errors'])
+        self.assertEqual(0, total['writes']['count'])
+        # Each worker does rate / workers operations per second, finishing the last one it was due
+        self.assertGreaterEqual(total['reads']['count'], 190)
+        self.assertLessEqual(total['reads']['count'], 204)
+        self.assertLess(total['ops_s'], 200 * 1.1)
+
+    def test_unlimited(self):
+        with tempfile.TemporaryDirectory() as directory:
+            report = generate_load(
+                [str(Path(directory) / 'load.bin')],
+                workers=1,
+                duration=0.3,
+                interval=0.5,
+                file_size=64 * 1024
+            )
+        self.assertGreater(report['total']['ops_s'], 1_000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the widgets on this package, they run headless:
+
+python -m kodegeek_textualize.benchmarks log-memory --lines 1000000
+python -m kodegeek_textualize.benchmarks palette-search --rows 500000
+python -m kodegeek_textualize.benchmarks table-startup --rows 10000000
+python -m kodegeek_textualize.benchmarks suite --rows 1000 10000 100000 --save baseline.json
+python -m kodegeek_textualize.benchmarks suite --compare baseline.json
+Author: Jose Vicente Nunez
+"""
+import asyncio
+import csv
+import gc
+import json
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import textual
+from textual.app import App, ComposeResult
+from textual.fuzzy import Matcher
+from textual.widgets import Log
+
+from kodegeek_textualize.columnar_table import ColumnarTable
+from kodegeek_textualize.data_sources import ColumnarSource, CsvSource, SqliteSource
+from kodegeek_textualize.log_scroller import OsApp, LogScreen
+from kodegeek_textualize.ring_buffer import BufferedLog
+from kodegeek_textualize.search_index import SearchIndex, MAX_RESULTS
+from kodegeek_textualize.table_with_detail_screen import CompetitorsApp, MY_DATA
+from kodegeek_textualize.virtual_table import VirtualTable
+
+BATCH = 1_000
+SUITE_APPS = ("os", "competitors", "competitors-columnar")
+PALETTE_QUERY = "manu"
+# A metric regresses when its median grows more than this fraction above the baseline spread, and more
+# than the noise floor for its unit
+REGRESSION_THRESHOLD = 0.2
+NOISE_FLOOR = {"_s": 0.005, "_mib": 2.0}
+# Runs of every application and size, a single one is too noisy to compare
+SUITE_REPEAT = 5
+
+
+class LogApp(App):
+    """
+    Just a log, filling the screen
+    """
+
+    def __init__(self, factory: Callable[[], Log]):
+        super().__init__()
+        self.factory = factory
+
+    def compose(self) -> ComposeResult:
+        yield self.factory()
+
+
+def sample_lines(start: int, count: int) -> list:
+    return [f"{i:>9} sample output line, like the ones lshw -json prints: {{'id': 'memory:{i % 64}'}}" for i in range(start, start + count)]
+
+
+async def measure_log(name: str, factory: Callable[[], Log], lines: int) -> None:
+    app = LogApp(factory)
+    async with app.run_test() as pilot:
+        event_log = app.query_one(Log)
+        gc.collect()
+        tracemalloc.start()
+        base, _ = tracemalloc.get_traced_memory()
+        started = time.perf_counter()
+        for start in range(0, lines, BATCH):
+            event_log.write_lines(sample_lines(start, min(BATCH, lines - start)))
+            if start % (BATCH * 100) == 0:
+                await pilot.pause()
+        await pilot.pause()
+        elapsed = time.perf_counter() - started
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{name:<22} kept={event_log.line_count:>9,} "
+            f"memory={(current - base) / 2 ** 20:>8.1f} MiB peak={(peak - base) / 2 ** 20:>8.1f} MiB "
+            f"time={elapsed:.2f} s"
+        )
+
+
+async def log_memory(options: Namespace) -> None:
+    await measure_log("Log (max_lines=None)", lambda: Log(max_lines=None), options.lines)
+    await measure_log("Log (max_lines=10000)", lambda: Log(max_lines=10_000), options.lines)
+    await measure_log("BufferedLog", lambda: BufferedLog(max_lines=None), options.lines)
+    await measure_log("BufferedLog (spill)", lambda: BufferedLog(max_lines=None, spill=True), options.lines)
+
+
+def random_names(rows: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    return [
+        "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(4, 10))).title()
+        for _ in range(rows)
+    ]
+
+
+async def palette_search(options: Namespace) -> None:
+    names = random_names(options.rows)
+    queries = ["a", "ma", "man", "manu", "zq", "xyzw", "qqqqq"]
+    started = time.perf_counter()
+    index = SearchIndex()
+    index.add_all(enumerate(names))
+    print(f"Index of {options.rows:,} rows built in {time.perf_counter() - started:.2f} s")
+    for query in queries:
+        matcher = Matcher(query)
+        started = time.perf_counter()
+        scan = [(score, key) for key, name in enumerate(names) if (score := matcher.match(name)) > 0]
+        scan_time = time.perf_counter() - started
+        matcher = Matcher(query)
+        started = time.perf_counter()
+        hits = index.search(query, matcher.match, limit=MAX_RESULTS)
+        index_time = time.perf_counter() - started
+        print(
+            f"{query!r:>8}: scan {scan_time * 1000:>8.1f} ms ({len(scan):,} matches), "
+            f"index {index_time * 1000:>7.1f} ms (top {len(hits)})"
+        )
+
+
+TABLE_MODES = ("datatable", "columnar", "sqlite", "csv")
+
+
+def competitors(rows: int, seed: int = 42):
+    rnd = random.Random(seed)
+    levels = ("Green", "Red", "Purple", "Blue", "Gold")
+    countries = ("MYS", "JPN", "ITA", "VEN", "ESP", "USA", "MEX", "IND")
+    for _ in range(rows):
+        name = "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(4, 10))).title()
+        yield rnd.choice(levels), name, rnd.choice("MF"), rnd.choice(countries), rnd.randint(18, 99)
+
+
+def make_table_data(directory: Path, rows: int) -> None:
+    """
+    Same competitors as a CSV file and as a SQLite table, written only once per size
+    """
+    data_csv = directory / f"competitors-{rows}.csv"
+    if not data_csv.exists():
+        print(f"Writing {data_csv}")
+        with open(data_csv, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(MY_DATA[0])
+            writer.writerows(competitors(rows))
+    data_db = directory / f"competitors-{rows}.db"
+    if not data_db.exists():
+        print(f"Writing {data_db}")
+        with sqlite3.connect(data_db) as connection, open(data_csv, newline="") as csv_file:
+            reader = csv.reader(csv_file)
+            next(reader)
+            connection.execute("CREATE TABLE competitors(level, name, gender, country, age INTEGER)")
+            connection.executemany("INSERT INTO competitors VALUES (?, ?, ?, ?, ?)", reader)
+
+
+async def table_startup_run(options: Namespace) -> None:
+    """
+    Start CompetitorsApp in this process and report the time until the first rows are on screen, and the peak RSS
+    """
+    directory = Path(options.directory)
+    data_csv = directory / f"competitors-{options.rows}.csv"
+    started = time.perf_counter()
+    loaded = options.rows
+    if options.mode == "csv":
+        app = CompetitorsApp(source=CsvSource(data_csv))
+    elif options.mode == "sqlite":
+        app = CompetitorsApp(source=SqliteSource(directory / f"competitors-{options.rows}.db", "competitors"))
+    elif options.mode == "columnar":
+        with open(data_csv, newline="") as csv_file:
+            reader = csv.reader(csv_file)
+            app = CompetitorsApp(source=ColumnarSource.from_rows(next(reader), list(reader)))
+    else:
+        # The DataTable copies every row, only a slice of the file is loaded
+        loaded = min(options.rows, options.datatable_rows)
+        app = CompetitorsApp()
+    async with app.run_test() as pilot:
+        if options.mode == "datatable":
+            table = app.query_one("#competitors_table")
+            with open(data_csv, newline="") as csv_file:
+                reader = csv.reader(csv_file)
+                next(reader)
+                table.add_rows(row for _, row in zip(range(loaded), reader))
+        await pilot.pause()
+        elapsed = time.perf_counter() - started
+        if options.mode != "datatable":
+            app.query_one(VirtualTable).filter("name", "man")
+            await pilot.pause()
+        filtered = time.perf_counter() - started - elapsed
+    # Linux reports KiB
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{options.mode:<10} rows={loaded:>11,} startup={elapsed:>7.2f} s filter={filtered:>6.2f} s max_rss={rss:>8.1f} MiB")
+
+
+async def table_startup(options: Namespace) -> None:
+    directory = Path(options.directory or tempfile.gettempdir())
+    make_table_data(directory, options.rows)
+    for mode in options.modes:
+        # One process per mode, so the peak RSS of one does not hide the others
+        subprocess.run(
+            [
+                sys.executable, "-m", "kodegeek_textualize.benchmarks", "table-startup-run",
+                "--mode", mode, "--rows", str(options.rows), "--directory", str(directory),
+                "--datatable-rows", str(options.datatable_rows)
+            ],
+            check=True
+        )
+
+
+def peak_rss_mib() -> float:
+    # Linux reports KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def wait_until(pilot, condition: Callable[[], bool], timeout: float = 600.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"Gave up after {timeout} seconds")
+        await pilot.pause(0.001)
+
+
+async def palette_keystrokes(app: App, pilot, query: str = PALETTE_QUERY) -> List[float]:
+    """
+    Open the command palette and type the query, one key at a time
+    :return: Seconds from each key press until the palette shows the new matches
+    """
+    app.action_command_palette()
+    await pilot.pause()
+    latencies = []
+    for char in query:
+        started = time.perf_counter()
+        await pilot.press(char)
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        latencies.append(time.perf_counter() - started)
+    await pilot.press("escape")
+    await pilot.pause()
+    return latencies
+
+
+def palette_metrics(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "palette_keystroke_s": sum(latencies) / len(latencies),
+        "palette_keystroke_max_s": max(latencies)
+    }
+
+
+async def measure_os(rows: int) -> Dict[str, Any]:
+    """
+    OsApp running a fake command that prints the given number of lines, instead of lshw and friends
+    """
+    command = f"{sys.executable} -c 'for i in range({rows}): print(i, \"sample output line\", i % 64)'"
+    started = time.perf_counter()
+    app = OsApp(cache=None)
+    async with app.run_test() as pilot:
+        cold_start = time.perf_counter() - started
+        screen = LogScreen(selections=[command], cache=None)
+        started = time.perf_counter()
+        await app.push_screen(screen)
+        await wait_until(pilot, lambda: screen.last_writer == command or screen.scheduler.done)
+        await pilot.pause()
+        first_row = time.perf_counter() - started
+        await wait_until(pilot, lambda: screen.scheduler.done)
+        await pilot.pause()
+        load = time.perf_counter() - started
+        kept = screen.query_one(BufferedLog).line_count
+        await pilot.press("q")
+    return {"cold_start_s": cold_start, "first_row_s": first_row, "load_s": load, "kept_lines": kept}
+
+
+async def measure_competitors(rows: int, columnar: bool = False) -> Dict[str, Any]:
+    """
+    CompetitorsApp with synthetic competitors, copied into the table or read from a columnar source
+    """
+    data = list(competitors(rows))
+    started = time.perf_counter()
+    app = CompetitorsApp(source=ColumnarSource.from_rows(MY_DATA[0], data) if columnar else None)
+    async with app.run_test() as pilot:
+        cold_start = time.perf_counter() - started
+        if columnar:
+            table = app.query_one(VirtualTable)
+            # The source is there before the first frame
+            first_row = cold_start
+        else:
+            table = app.query_one(ColumnarTable)
+            started = time.perf_counter()
+            table.add_rows(data)
+            await pilot.pause()
+            first_row = time.perf_counter() - started
+        started = time.perf_counter()
+        # Both tables take the column name
+        table.sort("age", reverse=table.sort_reverse("age"))
+        await pilot.pause()
+        sort = time.perf_counter() - started
+        latencies = await palette_keystrokes(app, pilot)
+        await pilot.press("q")
+    return {"cold_start_s": cold_start, "first_row_s": first_row, "sort_s": sort, **palette_metrics(latencies)}
+
+
+async def suite_run(options: Namespace) -> None:
+    """
+    One application at one size, in this process. Prints the measurements as a JSON line.
+    """
+    if options.app == "os":
+        measured = await measure_os(options.rows)
+    else:
+        measured = await measure_competitors(options.rows, columnar=options.app == "competitors-columnar")
+    print(json.dumps({"app": options.app, "rows": options.rows, **measured, "peak_rss_mib": peak_rss_mib()}))
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "textual": textual.__version__,
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Median of every measurement over repeated runs, and its spread (largest minus smallest sample)
+    """
+    result = dict(samples[0])
+    spread = {}
+    for metric, value in samples[0].items():
+        if isinstance(value, float):
+            values = [sample[metric] for sample in samples if sample.get(metric) is not None]
+            result[metric] = statistics.median(values)
+            spread[metric] = max(values) - min(values)
+    return {**result, "samples": len(samples), "spread": spread}
+
+
+def compare_results(
+        baseline: List[Dict[str, Any]],
+        results: List[Dict[str, Any]],
+        threshold: float = REGRESSION_THRESHOLD
+) -> List[str]:
+    """
+    Metrics that got worse than on the baseline, matched by application and size. Every metric is
+    lower is better, and only a median above the baseline median plus its spread counts.
+    :return: One description per regression
+    """
+    previous = {(result["app"], result["rows"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get((result["app"], result["rows"]))
+        if old is None:
+            continue
+        for metric, value in result.items():
+            floor = next((floor for suffix, floor in NOISE_FLOOR.items() if metric.endswith(suffix)), None)
+            if floor is None or old.get(metric) is None or value is None:
+                continue
+            spread = old.get("spread", {}).get(metric, 0.0)
+            limit = old[metric] + spread
+            if value > limit * (1 + threshold) and value - limit > floor:
+                regressions.append(
+                    f"{result['app']} rows={result['rows']:,} {metric}: {old[metric]:.4f} ±{spread:.4f} -> {value:.4f} "
+                    f"(+{value / old[metric] - 1 if old[metric] else float('inf'):.0%})"
+                )
+    return regressions
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    spread = result.get("spread", {})
+    metrics = " ".join(
+        f"{metric}={value:.4f}" + (f"±{spread[metric]:.4f}" if spread.get(metric) else "")
+        if isinstance(value, float) else f"{metric}={value}"
+        for metric, value in result.items() if metric not in ("app", "rows", "spread")
+    )
+    print(f"{result['app']:<21} rows={result['rows']:>9,} {metrics}")
+
+
+async def suite(options: Namespace) -> None:
+    """
+    Every application at every size, each one on a new process, so cold start and peak RSS are not shared
+    """
+    results = []
+    for app in options.apps:
+        for rows in options.rows:
+            samples = []
+            for _ in range(options.repeat):
+                completed = subprocess.run(
+                    [sys.executable, "-m", "kodegeek_textualize.benchmarks", "suite-run", "--app", app, "--rows", str(rows)],
+                    check=True,
+                    capture_output=True,
+                    text=True
+                )
+                samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            result = summarize(samples)
+            print_result(result)
+            results.append(result)
+    if options.save:
+        with open(options.save, "w") as baseline_file:
+            json.dump({"environment": environment(), "results": results}, baseline_file, indent=2)
+    if options.compare:
+        with open(options.compare, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_results(baseline["results"], results, options.threshold)
+        print(f"Compared with {options.compare} (commit {baseline['environment'].get('commit')})")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    memory = commands.add_parser("log-memory", help="Memory used by Log and BufferedLog to keep the same output")
+    memory.add_argument("--lines", type=int, default=1_000_000, help="Lines of output")
+    memory.set_defaults(benchmark=log_memory)
+    search = commands.add_parser("palette-search", help="Command palette search, linear scan against the index")
+    search.add_argument("--rows", type=int, default=500_000, help="Rows on the table")
+    search.set_defaults(benchmark=palette_search)
+    for name, benchmark, description in (
+            ("table-startup", table_startup, "Startup time and memory of CompetitorsApp, DataTable against the data sources"),
+            ("table-startup-run", table_startup_run, "Single table-startup measurement, in this process")
+    ):
+        startup = commands.add_parser(name, help=description)
+        startup.add_argument("--rows", type=int, default=10_000_000, help="Rows on the table")
+        startup.add_argument("--directory", help="Where the CSV and SQLite files are written, reused between runs")
+        startup.add_argument(
+            "--datatable-rows",
+            type=int,
+            default=100_000,
+            help="Most rows copied into the DataTable, it keeps Python objects for every cell"
+        )
+        if name == "table-startup":
+            startup.add_argument("--modes", nargs="+", choices=TABLE_MODES, default=TABLE_MODES)
+        else:
+            startup.add_argument("--mode", choices=TABLE_MODES, required=True)
+        startup.set_defaults(benchmark=benchmark)
+    suite_parser = commands.add_parser(
+        "suite",
+        help="Cold start, first row, sort, palette keystroke latency and peak RSS of the applications, at several sizes"
+    )
+    suite_parser.add_argument("--apps", nargs="+", choices=SUITE_APPS, default=SUITE_APPS)
+    suite_parser.add_argument("--rows", nargs="+", type=int, default=[1_000, 10_000, 100_000], help="Rows, or lines of output")
+    suite_parser.add_argument("--save", type=Path, help="Save the results as a JSON baseline")
+    suite_parser.add_argument("--compare", type=Path, help="JSON baseline to compare with, exit code is 1 on regressions")
+    suite_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Growth flagged as a regression")
+    suite_parser.add_argument(
+        "--repeat", type=int, default=SUITE_REPEAT, help="Runs of each application and size, the median is kept"
+    )
+    suite_parser.set_defaults(benchmark=suite)
+    suite_run_parser = commands.add_parser("suite-run", help="Single suite measurement, in this process")
+    suite_run_parser.add_argument("--app", choices=SUITE_APPS, required=True)
+    suite_run_parser.add_argument("--rows", type=int, required=True)
+    suite_run_parser.set_defaults(benchmark=suite_run)
+    options = parser.parse_args()
+    asyncio.run(options.benchmark(options))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+DataTable backed by a columnar copy of its rows, to sort big tables without comparing row objects.
+Numbers (and strings that look like numbers) are parsed once, when the row is added, and each column
+remembers the permutation that sorts it. Flipping the direction walks the same permutation backwards,
+and new, updated and removed rows are patched into it instead of sorting everything again.
+The column store and the DataTable internals are shared with the grocery_stores_ct table, see
+column_store.py and textual_compat.py.
+Author: Jose Vicente Nunez
+"""
+from typing import Dict, Hashable, Optional, Sequence, Tuple
+
+from rich.text import TextType
+from textual.widgets import DataTable
+from textual.widgets.data_table import CellType, ColumnKey, RowKey
+
+from kodegeek_textualize.column_store import ColumnStore, sort_reverse
+from kodegeek_textualize.search_index import SearchIndex
+from kodegeek_textualize.textual_compat import check_internals, set_row_order
+
+
+class ColumnarTable(DataTable):
+    """
+    Drop-in DataTable. Sorting by a single column uses the memoized permutations,
+    and the direction of each column flips on every call to sort_reverse, per table.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        check_internals(self)
+        # Rows in insertion order, by column
+        self.store = ColumnStore()
+        self.current_sorts: set = set()
+        self.search_indexes: Dict[Tuple[Hashable, ...], SearchIndex] = {}
+        # Bumped on every change, each row remembers the version of its last change
+        self.data_version = 0
+        self.row_versions: Dict[RowKey, int] = {}
+
+    def sort_reverse(self, sort_type: str) -> bool:
+        return sort_reverse(self.current_sorts, sort_type)
+
+    def add_column(
+            self,
+            label: TextType,
+            *,
+            width: Optional[int] = None,
+            key: Optional[str] = None,
+            default: Optional[CellType] = None
+    ) -> ColumnKey:
+        column_key = super().add_column(label, width=width, key=key, default=default)
+        self.store.add_column(column_key, default)
+        for row_key in self.store.row_keys:
+            self._touch(row_key)
+        return column_key
+
+    def add_row(
+            self,
+            *cells: CellType,
+            height: Optional[int] = 1,
+            key: Optional[str] = None,
+            label: Optional[TextType] = None
+    ) -> RowKey:
+        row_key = super().add_row(*cells, height=height, key=key, label=label)
+        self.store.extend([row_key], [cells], [column.key for column in self.ordered_columns])
+        self._touch(row_key)
+        for column_keys, index in self.search_indexes.items():
+            index.add(row_key, self.searchable_text(row_key, column_keys))
+        return row_key
+
+    def update_cell(self, row_key, column_key, value: CellType, *, update_width: bool = False) -> None:
+        super().update_cell(row_key, column_key, value, update_width=update_width)
+        self.store.update(row_key, column_key, value)
+        self._touch(row_key)
+        for column_keys, index in self.search_indexes.items():
+            if column_key in column_keys:
+                index.add(row_key, self.searchable_text(row_key, column_keys))
+
+    def remove_row(self, row_key) -> None:
+        super().remove_row(row_key)
+        self.store.remove([row_key])
+        self.row_versions.pop(row_key, None)
+        for index in self.search_indexes.values():
+            index.remove(row_key)
+
+    def clear(self, columns: bool = False):
+        self.row_versions = {}
+        if columns:
+            self.store = ColumnStore()
+            self.search_indexes = {}
+        else:
+            self.store.clear()
+            for index in self.search_indexes.values():
+                index.clear()
+        return super().clear(columns)
+
+    def _touch(self, row_key: RowKey) -> None:
+        self.data_version += 1
+        self.row_versions[row_key] = self.data_version
+
+    def row_version(self, row_key: RowKey) -> int:
+        return self.row_versions[row_key]
+
+    def searchable_text(self, row_key: RowKey, column_keys: Sequence[Hashable]) -> str:
+        return " ".join(str(self.get_cell(row_key, column_key)) for column_key in column_keys)
+
+    def search_index(self, *column_keys: Hashable) -> SearchIndex:
+        """
+        Text index over some columns, built on first use and kept up to date as rows are added, changed or removed
+        """
+        index = self.search_indexes.get(column_keys)
+        if index is None:
+            index = SearchIndex()
+            index.add_all((row_key, self.searchable_text(row_key, column_keys)) for row_key in self.store.row_keys)
+            self.search_indexes[column_keys] = index
+        return index
+
+    def sorted_row_keys(self, column_key: Hashable, reverse: bool = False) -> Sequence[RowKey]:
+        return self.store.sorted_keys(column_key, reverse)
+
+    def sort(self, *columns, key=None, reverse: bool = False):
+        if len(columns) != 1 or key is not None:
+            return super().sort(*columns, key=key, reverse=reverse)
+        set_row_order(self, self.sorted_row_keys(columns[0], reverse))
+        self.refresh()
+        return self
@@ -0,0 +1,444 @@
+"""
+Row sources for VirtualTable. A source owns the rows, sorts and filters them, and hands out small
+windows of the current view, so the table never holds more than what is on screen.
+Three flavours: columns kept in compact arrays, a SQLite table and a memory mapped CSV file.
+Author: Jose Vicente Nunez
+"""
+import csv
+import mmap
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Columns with fewer distinct values than this are stored as codes into a list of values
+MAX_CATEGORIES = 256
+CSV_BLOCK = 64 * 1024
+
+
+class DataSource(ABC):
+    """
+    Rows on a view that can be sorted by one column and filtered with a case-insensitive substring.
+    Sources may be used from a worker thread, calls are serialized with `lock`.
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns: List[str] = list(columns)
+        self.lock = threading.RLock()
+        self.sorted_by: Optional[Tuple[str, bool]] = None
+        self.filtered_by: Optional[Tuple[str, str]] = None
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """
+        Rows on the current view
+        """
+
+    @abstractmethod
+    def rows(self, start: int, count: int) -> List[Tuple[Any, ...]]:
+        """
+        Rows of the current view, from position start
+        """
+
+    @abstractmethod
+    def sort(self, column: str, reverse: bool = False) -> None:
+        pass
+
+    @abstractmethod
+    def filter(self, column: str, text: str) -> None:
+        """
+        Keep only the rows where column contains text, an empty text removes the filter
+        """
+
+    def search(self, column: str, text: str, limit: int) -> List[Tuple[Any, ...]]:
+        """
+        First rows of the current view where column contains text
+        """
+        text = text.lower()
+        position = self.columns.index(column)
+        found = []
+        with self.lock:
+            for start in range(0, len(self), 10_000):
+                for row in self.rows(start, 10_000):
+                    if text in str(row[position]).lower():
+                        found.append(row)
+                        if len(found) == limit:
+                            return found
+        return found
+
+    def close(self) -> None:
+        pass
+
+
+class StringColumn:
+    """
+    Strings stored as one UTF-8 blob plus an offset per value
+    """
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.offsets = array('Q', [0])
+        self.blob = bytearray()
+        for value in values:
+            self.blob += value.encode('utf-8')
+            self.offsets.append(len(self.blob))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> str:
+        return self.blob[self.offsets[position]:self.offsets[position + 1]].decode('utf-8')
+
+    def matches(self, text: str) -> bytearray:
+        """
+        One flag per value, set if the value contains text ignoring case
+        """
+        text = text.lower()
+        if not text.isascii():
+            return bytearray(text in self[position].lower() for position in range(len(self)))
+        # Search the whole blob at once, then map each hit to its value
+        mask = bytearray(len(self))
+        needle = text.encode('utf-8')
+        haystack = self.blob.lower()
+        offsets = self.offsets
+        found = haystack.find(needle)
+        while found >= 0:
+            position = bisect_right(offsets, found) - 1
+            end = offsets[position + 1]
+            if found + len(needle) <= end:
+                mask[position] = 1
+                found = haystack.find(needle, end)
+            else:
+                found = haystack.find(needle, found + 1)
+        return mask
+
+
+class CategoryColumn:
+    """
+    Few distinct values, stored as one byte codes
+    """
+
+    def __init__(self, values: Sequence[Any], codes: array):
+        self.values = list(values)
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, position: int) -> Any:
+        return self.values[self.codes[position]]
+
+
+def make_column(values: Sequence[Any]):
+    """
+    Compact storage for a column: a typed array for numbers, codes for low cardinality values, a blob otherwise
+    """
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return array('q', values)
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return array('d', values)
+    distinct: Dict[Any, int] = {}
+    for value in values:
+        if value not in distinct:
+            if len(distinct) == MAX_CATEGORIES:
+                return StringColumn(map(str, values))
+            distinct[value] = len(distinct)
+    return CategoryColumn(list(distinct), array('B', map(distinct.__getitem__, values)))
+
+
+class ColumnarSource(DataSource):
+    """
+    Columns in memory. The view is an array of row positions, None when it is every row in insertion order.
+    """
+
+    def __init__(self, columns: Dict[str, Sequence[Any]]):
+        super().__init__(list(columns))
+        self.data = [values if isinstance(values, (array, StringColumn, CategoryColumn)) else make_column(values)
+                     for values in columns.values()]
+        self.size = len(self.data[0]) if self.data else 0
+        self.view: Optional[array] = None
+        self._orders: Dict[str, array] = {}
+
+    @classmethod
+    def from_rows(cls, header: Sequence[str], rows: Sequence[Sequence[Any]]) -> "ColumnarSource":
+        return cls({name: [row[i] for row in rows] for i, name in enumerate(header)})
+
+    def __len__(self) -> int:
+        return self.size if self.view is None else len(self.view)
+
+    def rows(self, start: int, count: int) -> List[Tuple[Any, ...]]:
+        with self.lock:
+            end = min(start + count, len(self))
+            positions = range(start, end) if self.view is None else self.view[start:end]
+            return [tuple(column[position] for column in self.data) for position in positions]
+
+    def _order(self, column: str) -> array:
+        """
+        Ascending permutation of a column, memoized
+        """
+        order = self._orders.get(column)
+        if order is None:
+            values = self.data[self.columns.index(column)]
+            if isinstance(values, CategoryColumn):
+                # Bucket by code, in the order of the sorted values
+                buckets: List[List[int]] = [[] for _ in values.values]
+                for position, code in enumerate(values.codes):
+                    buckets[code].append(position)
+                order = array('Q')
+                for code in sorted(range(len(values.values)), key=lambda c: values.values[c]):
+                    order.extend(buckets[code])
+            else:
+                keys = values if isinstance(values, array) else [values[i] for i in range(len(values))]
+                order = array('Q', sorted(range(self.size), key=keys.__getitem__))
+            self._orders[column] = order
+        return order
+
+    def _matches(self, column: str, text: str) -> bytearray:
+        values = self.data[self.columns.index(column)]
+        text = text.lower()
+        if isinstance(values, CategoryColumn):
+            hits = bytes(int(text in str(value).lower()) for value in values.values)
+            return bytearray(hits[code] for code in values.codes)
+        if isinstance(values, StringColumn):
+            return values.matches(text)
+        return bytearray(text in str(values[position]).lower() for position in range(self.size))
+
+    def _update_view(self) -> None:
+        if self.sorted_by is None and self.filtered_by is None:
+            self.view = None
+            return
+        if self.sorted_by is not None:
+            column, reverse = self.sorted_by
+            order = self._order(column)
+            positions = reversed(order) if reverse else order
+        else:
+            positions = range(self.size)
+        if self.filtered_by is not None:
+            mask = self._matches(*self.filtered_by)
+            self.view = array('Q', (position for position in positions if mask[position]))
+        else:
+            self.view = array('Q', positions)
+
+    def sort(self, column: str, reverse: bool = False) -> None:
+        with self.lock:
+            self.sorted_by = (column, reverse)
+            self._update_view()
+
+    def filter(self, column: str, text: str) -> None:
+        with self.lock:
+            self.filtered_by = (column, text) if text else None
+            self._update_view()
+
+
+class SqliteSource(DataSource):
+    """
+    Rows of a SQLite table, sorting and filtering become ORDER BY and WHERE ... LIKE
+    """
+
+    def __init__(self, path: Union[str, Path], table: str, create_indexes: bool = True):
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.table = table
+        self.create_indexes = create_indexes
+        names = [row[1] for row in self.connection.execute(f'PRAGMA table_info("{table}")')]
+        if not names:
+            raise ValueError(f"No table called {table} on {path}")
+        super().__init__(names)
+        self._count: Optional[int] = None
+
+    def _quote(self, column: str) -> str:
+        if column not in self.columns:
+            raise ValueError(f"Unknown column {column}")
+        return f'"{column}"'
+
+    def _where(self) -> Tuple[str, List[Any]]:
+        if self.filtered_by is None:
+            return "", []
+        column, text = self.filtered_by
+        return f" WHERE {self._quote(column)} LIKE ? ESCAPE '\\'", [
+            "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        ]
+
+    def __len__(self) -> int:
+        with self.lock:
+            if self._count is None:
+                where, params = self._where()
+                self._count = self.connection.execute(f'SELECT COUNT(*) FROM "{self.table}"{where}', params).fetchone()[0]
+            return self._count
+
+    def rows(self, start: int, count: int) -> List[Tuple[Any, ...]]:
+        with self.lock:
+            where, params = self._where()
+            order = ""
+            if self.sorted_by is not None:
+                column, reverse = self.sorted_by
+                order = f" ORDER BY {self._quote(column)} {'DESC' if reverse else 'ASC'}, rowid"
+            columns = ", ".join(map(self._quote, self.columns))
+            return self.connection.execute(
+                f'SELECT {columns} FROM "{self.table}"{where}{order} LIMIT ? OFFSET ?',
+                params + [count, start]
+            ).fetchall()
+
+    def sort(self, column: str, reverse: bool = False) -> None:
+        with self.lock:
+            if self.create_indexes:
+                # Without an index every window would sort the whole table again
+                try:
+                    self.connection.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{self.table}_{column}_idx" ON "{self.table}" ({self._quote(column)}, rowid)'
+                    )
+                except sqlite3.OperationalError:
+                    self.create_indexes = False  # Read only database
+            self.sorted_by = (column, reverse)
+
+    def filter(self, column: str, text: str) -> None:
+        with self.lock:
+            self.filtered_by = (column, text) if text else None
+            self._count = None
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class CsvSource(DataSource):
+    """
+    CSV file read through mmap, with a header row and one record per line.
+    Opening only counts lines: the file is scanned in blocks and the position of the first line of each block
+    is remembered, a row is found by jumping to its block. Sorting and filtering parse one column of every
+    line, once, and keep the offset of every line from then on.
+    """
+
+    def __init__(self, path: Union[str, Path], encoding: str = 'utf-8'):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.encoding = encoding
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self.map.find(b"\n")
+        header_end = len(self.map) if header_end < 0 else header_end + 1
+        super().__init__(self._parse(self.map[:header_end]))
+        self.data_start = header_end
+        # Line number of the first line starting in each block, and where that line starts
+        self.block_lines = array('Q')
+        self.block_offsets = array('Q')
+        lines = 0
+        position = header_end
+        size = len(self.map)
+        while position < size:
+            self.block_lines.append(lines)
+            self.block_offsets.append(position)
+            # Blocks end after their last newline, so each one begins at the start of a line
+            last_newline = self.map.rfind(b"\n", position, min(position + CSV_BLOCK, size))
+            if last_newline < 0:
+                # A line longer than a block
+                last_newline = self.map.find(b"\n", position + CSV_BLOCK)
+                if last_newline < 0:
+                    lines += 1  # Last line, without a newline
+                    break
+            lines += self.map[position:last_newline + 1].count(b"\n")
+            position = last_newline + 1
+        self.size = lines
+        self.offsets: Optional[array] = None
+        self.view: Optional[array] = None
+        self._keys: Dict[str, StringColumn] = {}
+        self._orders: Dict[str, array] = {}
+
+    def _parse(self, line: bytes) -> List[str]:
+        text = line.decode(self.encoding, errors='replace').rstrip("\r\n")
+        return next(csv.reader([text]), [])
+
+    def _line_start(self, line: int) -> int:
+        if self.offsets is not None:
+            return self.offsets[line]
+        block = bisect_right(self.block_lines, line) - 1
+        position = self.block_offsets[block]
+        for _ in range(line - self.block_lines[block]):
+            position = self.map.find(b"\n", position) + 1
+        return position
+
+    def _line(self, start: int) -> bytes:
+        end = self.map.find(b"\n", start)
+        return self.map[start:len(self.map) if end < 0 else end]
+
+    def __len__(self) -> int:
+        return self.size if self.view is None else len(self.view)
+
+    def rows(self, start: int, count: int) -> List[Tuple[Any, ...]]:
+        with self.lock:
+            end = min(start + count, len(self))
+            if start >= end:
+                return []
+            if self.view is None:
+                rows = []
+                position = self._line_start(start)
+                for _ in range(end - start):
+                    line = self._line(position)
+                    rows.append(tuple(self._parse(line)))
+                    position += len(line) + 1
+                return rows
+            return [tuple(self._parse(self._line(self._line_start(line)))) for line in self.view[start:end]]
+
+    def _load_column(self, column: str) -> StringColumn:
+        """
+        Values of a column for every line, also keeping the offset of each line
+        """
+        keys = self._keys.get(column)
+        if keys is None:
+            index = self.columns.index(column)
+            with open(self.path, encoding=self.encoding, errors='replace', newline="") as text:
+                records = csv.reader(text)
+                next(records, None)  # Header
+                keys = StringColumn(record[index] if index < len(record) else "" for record in records)
+            if self.offsets is None:
+                offsets = array('Q')
+                position = self.data_start
+                find = self.map.find
+                for _ in range(self.size):
+                    offsets.append(position)
+                    position = find(b"\n", position) + 1
+                self.offsets = offsets
+            self._keys[column] = keys
+        return keys
+
+    @staticmethod
+    def _sort_key(value: str):
+        # Numbers before text, numbers by value
+        try:
+            return 0, float(value), ""
+        except ValueError:
+            return 1, 0.0, value
+
+    def _update_view(self) -> None:
+        if self.sorted_by is None and self.filtered_by is None:
+            self.view = None
+            return
+        if self.sorted_by is not None:
+            column, reverse = self.sorted_by
+            order = self._orders.get(column)
+            if order is None:
+                values = self._load_column(column)
+                keys = [self._sort_key(values[line]) for line in range(self.size)]
+                order = self._orders[column] = array('Q', sorted(range(self.size), key=keys.__getitem__))
+            lines = reversed(order) if reverse else order
+        else:
+            lines = range(self.size)
+        if self.filtered_by is not None:
+            column, text = self.filtered_by
+            mask = self._load_column(column).matches(text)
+            self.view = array('Q', (line for line in lines if mask[line]))
+        else:
+            self.view = array('Q', lines)
+
+    def sort(self, column: str, reverse: bool = False) -> None:
+        with self.lock:
+            self.sorted_by = (column, reverse)
+            self._update_view()
+
+    def filter(self, column: str, text: str) -> None:
+        with self.lock:
+            self.filtered_by = (column, text) if text else None
+            self._update_view()
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
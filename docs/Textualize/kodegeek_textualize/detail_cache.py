@@ -0,0 +1,126 @@
+"""
+Detail documents for the table rows, rendered once and kept on a small LRU cache.
+A document keeps the Markdown text and the tokens parsed from it, so showing it again skips the Markdown parser.
+Author: Jose Vicente Nunez
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, List, Sequence, Tuple
+
+from markdown_it import MarkdownIt
+from markdown_it.token import Token
+
+CACHE_SIZE = 256
+# Rows rendered ahead, above and below the cursor
+PREFETCH_ROWS = 5
+
+
+def detail_markdown(columns: Sequence[str], row: Sequence[Any]) -> str:
+    lines = ["## User details:", ""]
+    lines.extend(f"* **{column.title()}:** {value}" for column, value in zip(columns, row))
+    return "\n".join(lines) + "\n"
+
+
+@dataclass(frozen=True)
+class DetailDocument:
+    markdown: str
+    tokens: List[Token]
+
+
+class PreParsed:
+    """
+    Parser for the Markdown widget that hands back the tokens of a document that was already parsed
+    """
+
+    def __init__(self, document: DetailDocument):
+        self.document = document
+
+    def parse(self, markdown: str) -> List[Token]:
+        if markdown == self.document.markdown:
+            return self.document.tokens
+        return MarkdownIt("gfm-like").parse(markdown)
+
+
+class DetailCache:
+    """
+    LRU of detail documents, keyed by row key and data version, so a changed row is rendered again.
+    Safe to fill from a worker thread.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.documents: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.parser = MarkdownIt("gfm-like")
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+        self.render_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def __contains__(self, key: Tuple[Hashable, int]) -> bool:
+        return key in self.documents
+
+    def render(self, columns: Sequence[str], row: Sequence[Any]) -> DetailDocument:
+        started = time.perf_counter()
+        markdown = detail_markdown(columns, row)
+        document = DetailDocument(markdown, self.parser.parse(markdown))
+        with self.lock:
+            self.renders += 1
+            self.render_time += time.perf_counter() - started
+        return document
+
+    def get(
+            self,
+            row_key: Hashable,
+            version: int,
+            columns: Sequence[str],
+            row: Callable[[], Sequence[Any]],
+            prefetch: bool = False
+    ) -> DetailDocument:
+        """
+        Document for a row, rendered if it is not on the cache
+        :param row_key: Row key
+        :param version: Data version of the row, changes when the row does
+        :param columns: Column names
+        :param row: Returns the cells of the row, only called on a miss
+        :param prefetch: Warming up the cache, not counted as a hit or a miss
+        :return: The detail document
+        """
+        key = (row_key, version)
+        with self.lock:
+            document = self.documents.get(key)
+            if document is not None:
+                self.documents.move_to_end(key)
+                if not prefetch:
+                    self.hits += 1
+                return document
+            if not prefetch:
+                self.misses += 1
+        document = self.render(columns, row())
+        with self.lock:
+            self.documents[key] = document
+            self.documents.move_to_end(key)
+            while len(self.documents) > self.size:
+                self.documents.popitem(last=False)
+        return document
+
+    def clear(self) -> None:
+        with self.lock:
+            self.documents.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        mean = self.render_time / self.renders * 1000 if self.renders else 0.0
+        return (
+            f"hit rate={self.hit_rate:.0%} ({self.hits}/{self.hits + self.misses}), "
+            f"renders={self.renders}, mean render={mean:.2f} ms, cached={len(self)}"
+        )
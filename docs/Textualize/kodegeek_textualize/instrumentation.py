@@ -0,0 +1,326 @@
+"""
+Instrumentation for the Textual applications: event loop lag, worker start/finish spans and
+timers around the hot handlers, like JSON parsing and row insertion.
+Everything is kept in memory and saved as a Chrome trace (JSON), Perfetto (https://ui.perfetto.dev)
+and chrome://tracing can open it. An optional overlay shows the lag and the slowest spans while the
+application runs.
+Until the tracer is enabled, an instrumented function only pays for a flag check.
+
+grocery_stores --trace groceries.trace.json --overlay
+
+Shared by grocery_stores_ct and kodegeek_textualize: the canonical copy is
+grocery_stores_ct/instrumentation.py, kodegeek_textualize vendors it unchanged and its tests check
+that both copies match. Keep it on the standard library and Textual, and compatible with Python 3.9.
+Author: Jose Vicente Nunez <kodegeek.com@protonmail.com>
+"""
+from __future__ import annotations
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from textual.app import App
+from textual.widgets import Static
+from textual.worker import Worker, WorkerState
+
+# How often the event loop is asked to wake up, the lag is how late it does
+LAG_INTERVAL = 0.05
+# Oldest events are dropped after this many, so a long session does not grow forever
+MAX_EVENTS = 500_000
+OVERLAY_REFRESH = 0.5
+FINISHED_WORKER_STATES = (WorkerState.SUCCESS, WorkerState.ERROR, WorkerState.CANCELLED)
+
+
+@dataclass
+class SpanStats:
+    """
+    Calls and durations of one span name
+    """
+    count: int = 0
+    total: float = 0.0
+    slowest: float = 0.0
+    last: float = 0.0
+
+    def add(self, elapsed: float) -> None:
+        """
+        Account one more call
+        :param elapsed: Seconds it took
+        """
+        self.count += 1
+        self.total += elapsed
+        self.slowest = max(self.slowest, elapsed)
+        self.last = elapsed
+
+
+class Tracer:  # pylint: disable=too-many-instance-attributes
+    """
+    Spans and counters, in Chrome trace event format (timestamps in microseconds)
+    """
+
+    def __init__(self, max_events: int = MAX_EVENTS):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.stats: dict[str, SpanStats] = {}
+        self.lag = SpanStats()
+        self.workers: dict[int, float] = {}
+        self.threads: dict[int, str] = {}
+        self.last_tick: float | None = None
+
+    def enable(self) -> None:
+        """
+        Start recording, nothing is kept until this is called
+        """
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    def start(self, app: App, interval: float = LAG_INTERVAL) -> None:
+        """
+        Start the event loop lag monitor, a timer of the application that stops with it
+        :param app: Running application
+        :param interval: Seconds between samples
+        """
+        if self.enabled:
+            self.last_tick = time.perf_counter()
+            app.set_interval(interval, functools.partial(self.sample_lag, interval))
+
+    def sample_lag(self, interval: float) -> None:
+        """
+        A busy loop runs the timer late, missed ticks are skipped
+        :param interval: Seconds the timer should have waited
+        """
+        now = time.perf_counter()
+        lag = max(0.0, now - self.last_tick - interval)
+        self.last_tick = now
+        with self.lock:
+            self.lag.add(lag)
+        self.counter("event loop lag", ms=lag * 1000)
+
+    def _timestamp(self, moment: float) -> float:
+        return (moment - self.origin) * 1_000_000
+
+    def _thread(self) -> int:
+        thread = threading.current_thread()
+        self.threads.setdefault(thread.ident, thread.name)
+        return thread.ident
+
+    def complete(self, name: str, category: str, started: float, finished: float, **args) -> None:
+        """
+        Record a span that already finished
+        :param name: Span name
+        :param category: Trace category, viewers can filter by it
+        :param started: Start, from time.perf_counter()
+        :param finished: End, from time.perf_counter()
+        :param args: Shown with the span on the trace viewer
+        """
+        self.events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": self._timestamp(started),
+            "dur": (finished - started) * 1_000_000,
+            "pid": self.pid,
+            "tid": self._thread(),
+            "args": args
+        })
+        with self.lock:
+            self.stats.setdefault(name, SpanStats()).add(finished - started)
+
+    def counter(self, name: str, **values: float) -> None:
+        """
+        Record the current value of a counter, trace viewers show it as a graph
+        """
+        self.events.append({
+            "name": name,
+            "ph": "C",
+            "ts": self._timestamp(time.perf_counter()),
+            "pid": self.pid,
+            "args": values
+        })
+
+    @contextmanager
+    def span(self, name: str, category: str = "handler", **args) -> Iterator[None]:
+        """
+        Time the body of a with block
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, category, started, time.perf_counter(), **args)
+
+    def worker_state(self, worker: Worker, state: WorkerState) -> None:
+        """
+        Turn worker state changes into one span per worker run
+        :param worker: Worker that changed
+        :param state: Its new state
+        """
+        if not self.enabled:
+            return
+        if state == WorkerState.RUNNING:
+            self.workers[id(worker)] = time.perf_counter()
+        elif state in FINISHED_WORKER_STATES and id(worker) in self.workers:
+            started = self.workers.pop(id(worker))
+            self.complete(
+                f"worker {worker.name or worker.group}", "worker", started, time.perf_counter(),
+                group=worker.group, state=state.name
+            )
+
+    def save(self, path: Path) -> None:
+        """
+        Save everything recorded so far as a Chrome trace
+        :param path: JSON file
+        """
+        metadata = [
+            {
+                "name": "thread_name", "ph": "M", "pid": self.pid, "tid": ident,
+                "args": {"name": name}
+            }
+            for ident, name in self.threads.items()
+        ]
+        with open(path, "w", encoding="utf-8") as trace:
+            json.dump({"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms"}, trace)
+
+    def summary(self, limit: int = 5) -> str:
+        """
+        Event loop lag and the slowest spans, one per line
+        :param limit: Spans shown
+        """
+        with self.lock:
+            lag = self.lag
+            slowest = sorted(self.stats.items(), key=lambda item: item[1].slowest, reverse=True)
+        mean = lag.total / lag.count if lag.count else 0
+        lines = [
+            f"Loop lag: last {lag.last * 1000:.1f} ms, "
+            f"mean {mean * 1000:.1f} ms, max {lag.slowest * 1000:.1f} ms"
+        ]
+        for name, stats in slowest[:limit]:
+            lines.append(
+                f"{name}: {stats.count} calls, last {stats.last * 1000:.1f} ms, "
+                f"mean {stats.total / stats.count * 1000:.1f} ms, max {stats.slowest * 1000:.1f} ms"
+            )
+        return "\n".join(lines)
+
+
+TRACER = Tracer()
+
+
+def traced(
+        name: str | None = None,
+        category: str = "handler",
+        detail: Callable[..., dict[str, Any]] | None = None
+):
+    """
+    Time every call of a function, coroutine or async generator on the shared tracer.
+    An async generator span lasts until it is exhausted, including the time its consumer takes.
+    :param name: Span name, the function name if not given
+    :param category: Trace category
+    :param detail: Called with the same arguments as the function, returns the span arguments
+    """
+
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        def span(args, kwargs):
+            return TRACER.span(span_name, category, **(detail(*args, **kwargs) if detail else {}))
+
+        if inspect.isasyncgenfunction(function):
+            @functools.wraps(function)
+            async def generator_wrapper(*args, **kwargs):
+                if not TRACER.enabled:
+                    async for item in function(*args, **kwargs):
+                        yield item
+                    return
+                with span(args, kwargs):
+                    async for item in function(*args, **kwargs):
+                        yield item
+            return generator_wrapper
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def coroutine_wrapper(*args, **kwargs):
+                if not TRACER.enabled:
+                    return await function(*args, **kwargs)
+                with span(args, kwargs):
+                    return await function(*args, **kwargs)
+            return coroutine_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with span(args, kwargs):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class InstrumentationOverlay(Static):
+    """
+    Event loop lag and the slowest spans, refreshed twice per second
+    """
+    DEFAULT_CSS = """
+    InstrumentationOverlay {
+        dock: bottom;
+        height: auto;
+        max-height: 7;
+        background: $panel;
+        color: $text-muted;
+        padding: 0 1;
+    }
+    """
+
+    def on_mount(self) -> None:
+        """
+        Show the summary right away, then keep it current
+        """
+        self.update(TRACER.summary())
+        self.set_interval(OVERLAY_REFRESH, lambda: self.update(TRACER.summary()))
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    """
+    Add the --trace and --overlay options of the applications
+    :param parser: Command line of the application
+    """
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="Save a Chrome trace of the session here, Perfetto or chrome://tracing can open it"
+    )
+    parser.add_argument(
+        "--overlay",
+        action="store_true",
+        default=False,
+        help="Show the event loop lag and the slowest handlers"
+    )
+
+
+@contextmanager
+def tracing(options: Namespace) -> Iterator[None]:
+    """
+    Enable the tracer while the block runs if --trace or --overlay were given, then save the trace
+    :param options: Parsed command line, with the options of add_arguments()
+    """
+    if options.trace or options.overlay:
+        TRACER.enable()
+    try:
+        yield
+    finally:
+        if options.trace:
+            TRACER.save(options.trace)
@@ -0,0 +1,277 @@
+"""
+Browse the JSON output of commands like 'lshw -json' as a tree.
+The document is indexed while it streams in: a single pass records where each object and array
+starts and ends, nothing gets decoded. Tree nodes are created, and their values decoded, only
+when their parent is expanded.
+Author: Jose Vicente Nunez
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from rich.text import Text
+from textual.widgets import Tree
+from textual.widgets.tree import TreeNode
+
+STRUCTURE = re.compile(rb'[\[\]{}"]')
+STRING_TAIL = re.compile(rb'(?:[^"\\]|\\.)*"', re.DOTALL)
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+SCALAR = re.compile(rb'"(?:[^"\\]|\\.)*"|[^\s,\]}]+', re.DOTALL)
+SEPARATORS = re.compile(rb'[\s,:]*')
+OPENERS = b"[{"
+QUOTE = ord('"')
+MAX_CHILDREN = 500
+
+# Key (None for array items), start of the key (or of the value), start and end of the value
+Child = Tuple[Optional[str], int, int, int]
+
+
+def looks_like_json(data: bytes) -> bool:
+    return data.lstrip()[:1] in (b"{", b"[")
+
+
+class JsonIndex:
+    """
+    Raw bytes of a JSON document (or of several, one after the other), plus the position of the
+    closing bracket of every object and array.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends: Dict[int, int] = {}
+        self.roots: List[int] = []
+        self.error: Optional[str] = None
+        self._stack: List[int] = []
+        self._position = 0
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.roots) and not self._stack and self.error is None
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Index the next chunk of the document. Strings split between chunks are picked up on the next call.
+        """
+        self.data.extend(chunk)
+        if self.error:
+            return
+        data = self.data
+        stack = self._stack
+        ends = self.ends
+        position = self._position
+        while True:
+            match = STRUCTURE.search(data, position)
+            if match is None:
+                position = len(data)
+                break
+            offset = match.start()
+            char = data[offset]
+            if char == QUOTE:
+                tail = STRING_TAIL.match(data, offset + 1)
+                if tail is None:
+                    position = offset
+                    break
+                position = tail.end()
+                continue
+            if char in OPENERS:
+                if not stack:
+                    self.roots.append(offset)
+                stack.append(offset)
+            elif stack and data[stack[-1]] == char - 2:  # '[' + 2 == ']', '{' + 2 == '}'
+                ends[stack.pop()] = offset
+            else:
+                self.error = f"Unexpected {chr(char)!r} at offset {offset}"
+                break
+            position = offset + 1
+        self._position = position
+
+    def end(self, start: int) -> int:
+        """
+        End (exclusive) of the value that begins at start
+        """
+        if self.data[start] in OPENERS:
+            return self.ends[start] + 1
+        return SCALAR.match(self.data, start).end()
+
+    def is_container(self, start: int) -> bool:
+        return self.data[start] in OPENERS
+
+    def is_object(self, start: int) -> bool:
+        return self.data[start] == ord('{')
+
+    def children(self, start: int, position: Optional[int] = None) -> Iterator[Child]:
+        """
+        Direct children of the object or array at start, skipping over nested containers
+        :param start: Offset of the opening bracket
+        :param position: Resume from this offset, instead of from the first child
+        """
+        data = self.data
+        close = self.ends[start]
+        is_object = self.is_object(start)
+        position = start + 1 if position is None else position
+        while True:
+            position = SEPARATORS.match(data, position).end()
+            if position >= close:
+                return
+            key = None
+            key_start = position
+            if is_object:
+                match = STRING.match(data, position)
+                key = json.loads(match.group())
+                position = SEPARATORS.match(data, match.end()).end()
+            value_end = self.end(position)
+            yield key, key_start, position, value_end
+            position = value_end
+
+    def value(self, start: int, end: int):
+        """
+        Decode a value, meant for scalars
+        """
+        return json.loads(bytes(self.data[start:end]))
+
+    def find(self, text: str, start: int = 0) -> Optional[int]:
+        """
+        Offset of the next case-insensitive match of text, on the raw document
+        """
+        pattern = re.compile(re.escape(text.encode('utf-8')), re.IGNORECASE)
+        match = pattern.search(self.data, start)
+        return match.start() if match else None
+
+    def path(self, offset: int) -> List[Child]:
+        """
+        Chain of nested values that contain offset, from the top level value down
+        """
+        path = []
+        for root in self.roots:
+            if root <= offset < self.end(root):
+                path.append((None, root, root, self.end(root)))
+                break
+        while path and self.is_container(path[-1][2]):
+            for child in self.children(path[-1][2]):
+                if child[1] <= offset < child[3]:
+                    path.append(child)
+                    break
+            else:
+                break
+        return path
+
+
+@dataclass
+class JsonNode:
+    """
+    What a tree node shows: a whole document (start is None), a value, or the rest of
+    the children of a container that has too many of them to show at once (resume is set).
+    """
+    index: JsonIndex
+    start: Optional[int] = None
+    end: Optional[int] = None
+    resume: Optional[int] = None
+    loaded: bool = False
+
+
+class JsonTree(Tree):
+    """
+    Tree with one branch per JSON document, children are built when a branch is expanded
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__("Commands", *args, **kwargs)
+        self.show_root = False
+        self.last_match: Optional[Tuple[int, int]] = None  # Document number and offset
+
+    @property
+    def documents(self) -> List[TreeNode]:
+        return list(self.root.children)
+
+    def add_document(self, label: str, index: JsonIndex) -> TreeNode:
+        """
+        Add a document, replacing the one with the same label if any
+        """
+        for document in self.documents:
+            if str(document.label) == label:
+                document.remove()
+                self.last_match = None
+        return self.root.add(label, data=JsonNode(index), allow_expand=True)
+
+    def on_tree_node_expanded(self, event: Tree.NodeExpanded) -> None:
+        self.load_children(event.node)
+
+    def load_children(self, node: TreeNode) -> None:
+        data: JsonNode = node.data
+        if data is None or data.loaded:
+            return
+        data.loaded = True
+        index = data.index
+        if data.start is None:
+            # A document cut short has roots that never closed
+            children = ((None, root, root, index.end(root)) for root in index.roots if root in index.ends)
+        else:
+            children = index.children(data.start, data.resume)
+        parent = node.parent if data.resume is not None else node
+        if data.resume is not None:
+            node.remove()
+        count = len(parent.children)
+        for added, (key, _, start, end) in enumerate(children):
+            if added == MAX_CHILDREN and data.start is not None:
+                parent.add(
+                    Text("… more", style="italic"),
+                    data=JsonNode(index, data.start, data.end, resume=start),
+                    allow_expand=True
+                )
+                break
+            self.add_value(parent, key if key is not None else f"[{count}]", index, start, end)
+            count += 1
+
+    @staticmethod
+    def add_value(parent: TreeNode, key: str, index: JsonIndex, start: int, end: int) -> TreeNode:
+        if index.is_container(start):
+            brackets = "{…}" if index.is_object(start) else "[…]"
+            label = Text.assemble((key, "bold"), " ", (brackets, "dim"))
+            return parent.add(label, data=JsonNode(index, start, end), allow_expand=True)
+        value = index.value(start, end)
+        label = Text.assemble((key, "bold"), ": ", repr(value) if isinstance(value, str) else json.dumps(value))
+        return parent.add_leaf(label, data=JsonNode(index, start, end, loaded=True))
+
+    def reveal(self, document: TreeNode, offset: int) -> TreeNode:
+        """
+        Expand the branches down to the value at offset, and move the cursor there
+        """
+        data: JsonNode = document.data
+        node = document
+        for _, _, start, _ in data.index.path(offset):
+            self.load_children(node)
+            node.expand()
+            while True:
+                match = next((child for child in node.children if child.data.start == start), None)
+                if match is not None:
+                    break
+                more = next((child for child in node.children if child.data.resume is not None), None)
+                if more is None:
+                    return node
+                self.load_children(more)
+            node = match
+        self.call_after_refresh(self.show_node, node)
+        return node
+
+    def show_node(self, node: TreeNode) -> None:
+        self.select_node(node)
+        self.scroll_to_node(node, animate=False)
+
+    def find_next(self, text: str) -> Optional[TreeNode]:
+        """
+        Reveal the next match of text, across all the documents, wrapping around at the end
+        :return: Node with the match, None if the text is nowhere
+        """
+        documents = self.documents
+        if not text or not documents:
+            return None
+        number, offset = self.last_match or (0, -1)
+        for step in range(len(documents) + 1):
+            current = (number + step) % len(documents)
+            found = documents[current].data.index.find(text, offset + 1 if step == 0 else 0)
+            if found is not None:
+                self.last_match = (current, found)
+                return self.reveal(documents[current], found)
+        self.last_match = None
+        return None
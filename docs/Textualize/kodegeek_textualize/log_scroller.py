@@ -5,28 +5,112 @@ The application uses async to be able to return the control to the UI as soon as
 Author: Jose Vicente Nunez
 """
 import asyncio
+from argparse import ArgumentParser
+import os
 import shutil
-from typing import List
+import signal
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
 
 from textual import on, work
 from textual.app import ComposeResult, App
-from textual.reactive import reactive
 from textual.screen import ModalScreen
-from textual.widgets import Footer, Header, Button, SelectionList, Label, Log
+from textual.widgets import Footer, Header, Button, SelectionList, Label, Input
 from textual.widgets.selection_list import Selection
 from textual.worker import Worker
 
+from kodegeek_textualize.instrumentation import TRACER, InstrumentationOverlay, add_arguments, traced, tracing
+from kodegeek_textualize.json_tree import JsonIndex, JsonTree, looks_like_json
+from kodegeek_textualize.result_cache import CommandResult, ResultCache, CACHE_DIR
+from kodegeek_textualize.ring_buffer import BufferedLog, MAX_LINES
+from kodegeek_textualize.scheduler import CommandScheduler, DEFAULT_TIMEOUT, Job, Status
+
 OS_COMMANDS = {
     "LSHW": ["lshw", "-json", "-sanitize", "-notime", "-quiet"],
     "LSCPU": ["lscpu", "--all", "--extended", "--json"],
     "LSMEM": ["lsmem", "--json", "--all", "--output-all"],
     "NUMASTAT": ["numastat", "-z"]
 }
+# Lower values run first. Slow commands start early, so they do not end up running alone at the end.
+PRIORITIES = {
+    "LSHW": -1
+}
+READ_CHUNK = 64 * 1024
+MAX_FPS = 30
+MAX_PENDING_BATCHES = 16
+
+
+@dataclass
+class CommandStats:
+    """
+    How fast a command produced its output
+    """
+    cmd: str
+    started: float = field(default_factory=time.perf_counter)
+    first_line: Optional[float] = None
+    finished: Optional[float] = None
+    total_bytes: int = 0
+    total_lines: int = 0
+    returncode: Optional[int] = None
+
+    def summary(self) -> str:
+        first_line = f"{(self.first_line - self.started) * 1000:.1f} ms" if self.first_line else "n/a"
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return (f'"{self.cmd}" exit code={self.returncode}, first line after {first_line}, '
+                f"{self.total_bytes:,} bytes, {self.total_lines:,} lines in {elapsed:.2f} s")
+
+
+def kill(proc: asyncio.subprocess.Process) -> None:
+    """
+    Kill the shell and anything it started, they all share the same session
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def read_lines(
+        stream: asyncio.StreamReader,
+        queue: asyncio.Queue,
+        stats: CommandStats,
+        chunk_size: int = READ_CHUNK,
+        initial: bytes = b"",
+        capture: Optional[bytearray] = None
+) -> None:
+    """
+    Read the output in big chunks and queue it as batches of lines, None marks the end of the output.
+    When the queue is full this stops reading, the pipe fills up and the command blocks
+    until the UI catches up.
+    :param initial: Output already read from the stream
+    :param capture: If given, a copy of the raw output is kept here
+    """
+    partial = b""
+    chunk = initial or await stream.read(chunk_size)
+    while chunk:
+        if capture is not None:
+            capture.extend(chunk)
+        stats.total_bytes += len(chunk)
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        if lines:
+            if stats.first_line is None:
+                stats.first_line = time.perf_counter()
+            stats.total_lines += len(lines)
+            await queue.put([line.decode(encoding='utf-8', errors='replace') for line in lines])
+        chunk = await stream.read(chunk_size)
+    if partial:
+        stats.total_lines += 1
+        if stats.first_line is None:
+            stats.first_line = time.perf_counter()
+        await queue.put([partial.decode(encoding='utf-8', errors='replace')])
+    await queue.put(None)
 
 
 class LogScreen(ModalScreen):
-    count = reactive(0)
-    MAX_LINES = 10_000
+    MAX_LINES = MAX_LINES
     ENABLE_COMMAND_PALETTE = False
     CSS_PATH = "log_screen.tcss"
 
@@ -35,65 +119,220 @@ class LogScreen(ModalScreen):
             name: str | None = None,
             ident: str | None = None,
             classes: str | None = None,
-            selections: List = None
+            selections: List = None,
+            priorities: Optional[Dict[str, int]] = None,
+            max_parallel: Optional[int] = None,
+            timeout: Optional[float] = DEFAULT_TIMEOUT,
+            spill: bool = False,
+            structured: bool = False,
+            cache: Optional[ResultCache] = None,
+            overlay: bool = False
     ):
         super().__init__(name, ident, classes)
         self.selections = selections
+        self.spill = spill
+        self.structured = structured
+        self.cache = cache
+        self.overlay = overlay
+        self.priorities = priorities or {}
+        self.stats: dict[str, CommandStats] = {}
+        self.last_writer: Optional[str] = None
+        self.scheduler = CommandScheduler(
+            runner=self.run_process,
+            max_parallel=max_parallel,
+            timeout=timeout,
+            on_change=self.on_job_changed
+        )
 
     def compose(self) -> ComposeResult:
-        yield Label(f"Running {len(self.selections)} commands")
-        event_log = Log(
+        yield Label(f"Running {len(self.selections)} commands", id="status")
+        # Output is kept on a compact ring buffer, optionally on a temporary file, only the visible lines become strings
+        event_log = BufferedLog(
             id='event_log',
             max_lines=LogScreen.MAX_LINES,
-            highlight=True
+            highlight=True,
+            spill=self.spill
         )
         event_log.loading = True
         yield event_log
-        button = Button("Close", id="close", variant="success")
-        button.disabled = True
-        yield button
+        if self.structured:
+            # JSON output goes to a tree instead of the log, shown once the first document is complete
+            yield Input(placeholder="Search the JSON output", id="search")
+            json_tree = JsonTree(id="json_tree")
+            json_tree.display = False
+            yield json_tree
+        yield Button("Cancel", id="close", variant="warning")
+        if self.overlay:
+            yield InstrumentationOverlay()
 
     async def on_mount(self) -> None:
-        event_log = self.query_one('#event_log', Log)
+        event_log = self.query_one('#event_log', BufferedLog)
         event_log.loading = False
         event_log.clear()
         lst = '\n'.join(self.selections)
         event_log.write(f"Preparing:\n{lst}")
         event_log.write("\n")
+        event_log.write_line(f"Running up to {self.scheduler.max_parallel} commands in parallel")
 
         for command in self.selections:
-            self.count += 1
-            self.run_process(cmd=command)
+            cached = self.cache.get(command) if self.cache else None
+            if cached:
+                self.replay(cached)
+                if self.cache.is_fresh(cached):
+                    continue
+                event_log.write_line(f'"{command}" output expired, refreshing it in the background')
+            self.scheduler.submit(command, priority=self.priorities.get(command, 0))
+        self.run_commands()
+
+    def replay(self, result: CommandResult) -> None:
+        """
+        Show the cached output of a command
+        """
+        event_log = self.query_one('#event_log', BufferedLog)
+        event_log.write_line(f'Cached output of "{result.cmd}", from {result.age:.0f} seconds ago:')
+        self.last_writer = None
+        if self.structured and looks_like_json(result.output):
+            index = JsonIndex()
+            index.feed(result.output)
+            self.show_json(result.cmd, index)
+        else:
+            text = result.output.decode('utf-8', errors='replace')
+            event_log.write_lines(text.splitlines(), command=result.cmd)
+
+    @work(exclusive=True)
+    async def run_commands(self) -> None:
+        await self.scheduler.run()
+        button = self.query_one('#close', Button)
+        button.label = "Close"
+        button.variant = "success"
 
     def on_worker_state_changed(self, event: Worker.StateChanged) -> None:
-        if self.count == 0:
-            button = self.query_one('#close', Button)
-            button.disabled = False
-        self.log(event)
+        TRACER.worker_state(event.worker, event.state)
 
-    @work(exclusive=False)
-    async def run_process(self, cmd: str) -> None:
-        event_log = self.query_one('#event_log', Log)
-        event_log.write_line(f"Running: {cmd}")
+    def on_job_changed(self, job: Job) -> None:
+        scheduler = self.scheduler
+        self.query_one('#status', Label).update(
+            f"Running {scheduler.count(Status.RUNNING)}, "
+            f"waiting {scheduler.count(Status.PENDING)}, "
+            f"succeeded {scheduler.count(Status.SUCCEEDED)}, "
+            f"failed {scheduler.count(Status.FAILED, Status.TIMED_OUT, Status.CANCELLED)} "
+            f"of {len(scheduler.jobs)} commands"
+        )
+        if job.status == Status.RUNNING:
+            self.query_one('#event_log', BufferedLog).write_line(f"Running: {job.cmd}")
+        elif job.status.finished:
+            self.query_one('#event_log', BufferedLog).write_line(job.describe())
+
+    @traced("run_process", "subprocess", detail=lambda _, cmd: {"cmd": cmd})
+    async def run_process(self, cmd: str) -> int:
+        """
+        Run a command, streaming its output to the log. The command is killed if this is cancelled.
+        :return: Exit code of the command
+        """
+        event_log = self.query_one('#event_log', BufferedLog)
+        stats = CommandStats(cmd=cmd)
+        self.stats[cmd] = stats
         # Combine STDOUT and STDERR output
         proc = await asyncio.create_subprocess_shell(
             cmd,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True
         )
-        stdout, _ = await proc.communicate()
-        if proc.returncode != 0:
-            raise ValueError(f"'{cmd}' finished with errors ({proc.returncode})")
-        stdout = stdout.decode(encoding='utf-8', errors='replace')
-        if stdout:
-            event_log.write(f'\nOutput of "{cmd}":\n')
-            event_log.write(stdout)
-        self.count -= 1
+        capture = bytearray() if self.cache and self.cache.cacheable(cmd) else None
+        try:
+            first = await proc.stdout.read(READ_CHUNK) if self.structured else b""
+            if looks_like_json(first):
+                index = await self.index_json(cmd, first, proc.stdout, stats)
+                capture = index.data if capture is not None else None
+            else:
+                queue = asyncio.Queue(maxsize=MAX_PENDING_BATCHES)
+                reader = asyncio.create_task(read_lines(proc.stdout, queue, stats, initial=first, capture=capture))
+                try:
+                    await self.write_batches(cmd, queue, event_log)
+                finally:
+                    reader.cancel()
+            stats.returncode = await proc.wait()
+            if capture is not None:
+                self.cache.put(cmd, capture, stats.returncode)
+        finally:
+            if proc.returncode is None:
+                kill(proc)
+                await proc.wait()
+            stats.returncode = proc.returncode
+            stats.finished = time.perf_counter()
+            event_log.write_line(stats.summary())
+        return stats.returncode
+
+    @traced("index_json", "parse", detail=lambda _, cmd, *__: {"cmd": cmd})
+    async def index_json(self, cmd: str, first: bytes, stream: asyncio.StreamReader, stats: CommandStats) -> JsonIndex:
+        """
+        Index JSON output as it arrives, then add it to the tree. Nothing is decoded until a branch is expanded.
+        """
+        index = JsonIndex()
+        stats.first_line = time.perf_counter()
+        chunk = first
+        while chunk:
+            stats.total_bytes += len(chunk)
+            index.feed(chunk)
+            chunk = await stream.read(READ_CHUNK)
+        stats.total_lines = index.data.count(b"\n")
+        self.show_json(cmd, index)
+        return index
+
+    def show_json(self, cmd: str, index: JsonIndex) -> None:
+        event_log = self.query_one('#event_log', BufferedLog)
+        if not index.complete:
+            # Truncated or invalid documents have branches without an end, show them as text instead
+            reason = index.error or "the document is incomplete"
+            event_log.write_line(f'"{cmd}" does not look like valid JSON, {reason}:')
+            event_log.write_lines(index.data.decode('utf-8', errors='replace').splitlines(), command=cmd)
+            self.last_writer = cmd
+        else:
+            json_tree = self.query_one('#json_tree', JsonTree)
+            json_tree.add_document(cmd, index)
+            json_tree.display = True
+            event_log.write_line(f'"{cmd}" JSON output ({len(index.data):,} bytes) is on the tree below')
+
+    @on(Input.Submitted, "#search")
+    def on_search(self, event: Input.Submitted) -> None:
+        if self.query_one('#json_tree', JsonTree).find_next(event.value) is None:
+            self.notify(f"'{event.value}' not found", severity="warning")
+
+    async def write_batches(self, cmd: str, queue: asyncio.Queue, event_log: BufferedLog) -> None:
+        """
+        Write whatever lines are pending to the log, at most MAX_FPS times per second
+        """
+        frame = 1 / MAX_FPS
+        done = False
+        while not done:
+            batch = []
+            pending = [await queue.get()]
+            while not queue.empty():
+                pending.append(queue.get_nowait())
+            for lines in pending:
+                if lines is None:
+                    done = True
+                else:
+                    batch.extend(lines)
+            if batch:
+                if self.last_writer != cmd:
+                    event_log.write_line(f'Output of "{cmd}":')
+                    self.last_writer = cmd
+                with TRACER.span("write_lines", "render", lines=len(batch)):
+                    event_log.write_lines(batch, command=cmd)
+            if not done:
+                await asyncio.sleep(frame)
 
     @on(Button.Pressed, "#close")
     def on_button_pressed(self, _) -> None:
         self.app.pop_screen()
 
+    def on_unmount(self) -> None:
+        # Closing the screen stops whatever is still running
+        self.scheduler.on_change = None
+        self.scheduler.cancel()
+
 
 class OsApp(App):
     BINDINGS = [
@@ -102,9 +341,32 @@ class OsApp(App):
     CSS_PATH = "os_app.tcss"
     ENABLE_COMMAND_PALETTE = False  # Do not need the command palette
 
+    def __init__(
+            self,
+            max_parallel: Optional[int] = None,
+            timeout: Optional[float] = DEFAULT_TIMEOUT,
+            spill: bool = False,
+            structured: bool = False,
+            cache: Optional[ResultCache] = None,
+            overlay: bool = False
+    ):
+        """
+        :param overlay: Show the event loop lag and the slowest handlers, the tracer must be enabled
+        """
+        super().__init__()
+        self.max_parallel = max_parallel
+        self.timeout = timeout
+        self.spill = spill
+        self.structured = structured
+        self.cache = cache
+        self.overlay = overlay
+
     def action_quit_app(self):
         self.exit(0)
 
+    def on_mount(self) -> None:
+        TRACER.start(self)
+
     def compose(self) -> ComposeResult:
         # Create a list of commands, valid commands are assumed to be on the PATH variable.
         selections = [Selection(name.title(), ' '.join(cmd), True) for name, cmd in OS_COMMANDS.items() if shutil.which(cmd[0].strip())]
@@ -113,6 +375,8 @@ class OsApp(App):
         sel_list.tooltip = "Select one more more command to execute"
         yield sel_list
         yield Button(f"Execute {len(selections)} commands", id="exec", variant="primary")
+        if self.overlay:
+            yield InstrumentationOverlay()
         yield Footer()
 
     @on(SelectionList.SelectedChanged)
@@ -129,15 +393,42 @@ class OsApp(App):
     def on_button_click(self):
         selection_list = self.query_one('#cmds', SelectionList)
         selections = selection_list.selected
-        log_screen = LogScreen(selections=selections)
+        priorities = {' '.join(OS_COMMANDS[name]): priority for name, priority in PRIORITIES.items()}
+        log_screen = LogScreen(
+            selections=selections,
+            priorities=priorities,
+            max_parallel=self.max_parallel,
+            timeout=self.timeout,
+            spill=self.spill,
+            structured=self.structured,
+            cache=self.cache,
+            overlay=self.overlay
+        )
         self.push_screen(log_screen)
 
 
 def main():
-    app = OsApp()
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--parallel", type=int, default=None, help="Maximum commands running at the same time, defaults to the number of CPUs")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Seconds before a command is killed")
+    parser.add_argument("--spill", action="store_true", default=False, help="Keep the command output on a temporary file instead of memory")
+    parser.add_argument("--structured", action="store_true", default=False, help="Show JSON output as a tree")
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR, help="Where to keep the output of previous runs")
+    parser.add_argument("--no-cache", action="store_true", default=False, help="Always run the commands")
+    add_arguments(parser)
+    options = parser.parse_args()
+    app = OsApp(
+        max_parallel=options.parallel,
+        timeout=options.timeout,
+        spill=options.spill,
+        structured=options.structured,
+        cache=None if options.no_cache else ResultCache(directory=options.cache_dir),
+        overlay=options.overlay
+    )
     app.title = f"Output of multiple well known UNIX commands".title()
     app.sub_title = f"{len(OS_COMMANDS)} commands available"
-    app.run()
+    with tracing(options):
+        app.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+"""
+Cache for the output of OS inventory commands, in memory and on disk.
+An entry is reused while it is younger than the TTL of its command, and only on the same host state:
+a reboot, or hot plugging a CPU, memory block, disk or PCI device, invalidates everything.
+Author: Jose Vicente Nunez
+"""
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, Optional
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "kodegeek_textualize" / "results"
+# Seconds each command output stays fresh, by program name. 0 means never cache.
+TTLS = {
+    "lshw": 24 * 60 * 60,
+    "lsmem": 24 * 60 * 60,
+    "lscpu": 60 * 60,
+    "numastat": 0
+}
+DEFAULT_TTL = 5 * 60
+# Cheap to read, and they change when the hardware seen by the inventory commands changes
+STATE_FILES = [
+    "/proc/sys/kernel/random/boot_id",
+    "/sys/devices/system/cpu/online",
+    "/sys/devices/system/node/online"
+]
+STATE_DIRECTORIES = [
+    "/sys/devices/system/memory",
+    "/sys/bus/pci/devices",
+    "/sys/block"
+]
+
+
+def host_fingerprint() -> str:
+    """
+    Hash of the boot id and of the hot plug state of the machine
+    """
+    digest = hashlib.sha256()
+    for path in STATE_FILES:
+        try:
+            digest.update(Path(path).read_bytes())
+        except OSError:
+            digest.update(b"-")
+    for path in STATE_DIRECTORIES:
+        try:
+            digest.update("\0".join(sorted(os.listdir(path))).encode('utf-8'))
+        except OSError:
+            digest.update(b"-")
+    return digest.hexdigest()
+
+
+@dataclass
+class CommandResult:
+    cmd: str
+    output: bytes
+    returncode: int = 0
+    created: float = field(default_factory=time.time)
+    fingerprint: str = ""
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created
+
+
+class ResultCache:
+    """
+    Results by command line. Entries from a different host state are never returned.
+    """
+
+    def __init__(
+            self,
+            directory: Optional[Path] = CACHE_DIR,
+            ttls: Optional[Dict[str, float]] = None,
+            default_ttl: float = DEFAULT_TTL,
+            fingerprint: Optional[str] = None
+    ):
+        self.directory = directory
+        self.ttls = TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.fingerprint = fingerprint if fingerprint is not None else host_fingerprint()
+        self.results: Dict[str, CommandResult] = {}
+
+    def ttl(self, cmd: str) -> float:
+        program = os.path.basename(cmd.split()[0]) if cmd.split() else cmd
+        return self.ttls.get(program, self.default_ttl)
+
+    def cacheable(self, cmd: str) -> bool:
+        return self.ttl(cmd) > 0
+
+    def is_fresh(self, result: CommandResult) -> bool:
+        return result.age < self.ttl(result.cmd)
+
+    def _paths(self, cmd: str):
+        key = hashlib.sha256(cmd.encode('utf-8')).hexdigest()
+        return self.directory / f"{key}.out", self.directory / f"{key}.json"
+
+    def get(self, cmd: str) -> Optional[CommandResult]:
+        """
+        Last result of a command, fresh or not, as long as the host did not change since
+        """
+        if not self.cacheable(cmd):
+            return None
+        result = self.results.get(cmd)
+        if result is None and self.directory is not None:
+            result = self._load(cmd)
+        if result is None or result.fingerprint != self.fingerprint:
+            return None
+        self.results[cmd] = result
+        return result
+
+    def _load(self, cmd: str) -> Optional[CommandResult]:
+        output, meta = self._paths(cmd)
+        try:
+            metadata = json.loads(meta.read_text(encoding='utf-8'))
+            if metadata.get("cmd") != cmd:
+                return None
+            return CommandResult(
+                cmd=cmd,
+                output=output.read_bytes(),
+                returncode=metadata["returncode"],
+                created=metadata["created"],
+                fingerprint=metadata["fingerprint"]
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, cmd: str, output: bytes, returncode: int = 0) -> Optional[CommandResult]:
+        """
+        Save the output of a successful command
+        :return: The new entry, None if the command is not cacheable or failed
+        """
+        if returncode != 0 or not self.cacheable(cmd):
+            return None
+        result = CommandResult(cmd=cmd, output=bytes(output), returncode=returncode, fingerprint=self.fingerprint)
+        self.results[cmd] = result
+        if self.directory is not None:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                output_path, meta = self._paths(cmd)
+                metadata = asdict(result)
+                del metadata["output"]
+                self._write(output_path, result.output)
+                self._write(meta, json.dumps(metadata).encode('utf-8'))
+            except OSError:
+                pass  # The in memory copy is still good
+        return result
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
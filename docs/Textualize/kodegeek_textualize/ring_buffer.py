@@ -0,0 +1,313 @@
+"""
+Compact storage for very large command output, and a Log widget that renders from it.
+Lines are kept as UTF-8 bytes in a single buffer (optionally a spill file, read back through mmap)
+plus one 8-byte offset per line, instead of one Python string per line. Strings are only
+created for the lines on screen.
+Author: Jose Vicente Nunez
+"""
+import mmap
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from typing import Dict, Iterable, List, Optional, Union
+
+from rich.cells import cell_len
+from rich.segment import Segment
+from rich.style import Style
+from rich.text import Text
+from textual.geometry import Size
+from textual.strip import Strip
+from textual.widgets import Log
+
+MAX_LINES = 5_000_000
+COMPACT_MIN_LINES = 4096
+COPY_CHUNK = 1024 * 1024
+
+
+class LineBuffer(Sequence):
+    """
+    Ring buffer of text lines. Once it holds `max_lines` the oldest lines are dropped; the space
+    they used is reclaimed in bulk, once there are more dead lines than live ones.
+    Lines have an absolute number that never changes, live line `i` is `first + i`.
+    """
+
+    def __init__(self, max_lines: Optional[int] = MAX_LINES, spill: bool = False):
+        self.max_lines = max_lines
+        self.spill = spill
+        self.commands: Dict[str, array] = {}
+        self.first = 0  # Absolute number of the oldest live line
+        self._offsets = array('Q')  # Start of each stored line, relative to the data buffer
+        self._offsets_start = 0  # Absolute number of _offsets[0]
+        self._end = 0
+        self._data: Optional[bytearray] = None
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._reset_storage()
+
+    def _reset_storage(self) -> None:
+        self._close_map()
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self.spill:
+            self._file = tempfile.TemporaryFile(prefix="log_buffer")
+            self._data = None
+        else:
+            self._data = bytearray()
+
+    def _close_map(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    @property
+    def last(self) -> int:
+        """
+        Absolute number of the next line to be added
+        """
+        return self._offsets_start + len(self._offsets)
+
+    def __len__(self) -> int:
+        return self.last - self.first
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes used to store the text and the offsets, text on a spill file does not count
+        """
+        text = len(self._data) if self._data is not None else 0
+        return text + self._offsets.itemsize * len(self._offsets) + sum(
+            lines.itemsize * len(lines) for lines in self.commands.values()
+        )
+
+    def append(self, lines: Iterable[str], command: Optional[str] = None) -> int:
+        """
+        Add lines at the end of the buffer
+        :param lines: Lines, without line endings
+        :param command: Command that produced the lines, if any
+        :return: Number of lines added
+        """
+        start = self.last
+        offsets = self._offsets
+        chunks = []
+        position = self._end
+        for line in lines:
+            data = line.encode('utf-8', errors='replace')
+            offsets.append(position)
+            chunks.append(data)
+            position += len(data)
+        added = self.last - start
+        if not added:
+            return 0
+        payload = b"".join(chunks)
+        if self._file is not None:
+            self._file.seek(self._end)
+            self._file.write(payload)
+        else:
+            self._data.extend(payload)
+        self._end = position
+        if command is not None:
+            self.commands.setdefault(command, array('Q')).extend(range(start, start + added))
+        if self.max_lines is not None and len(self) > self.max_lines:
+            self.first = self.last - self.max_lines
+            if self.first - self._offsets_start > max(COMPACT_MIN_LINES, len(self)):
+                self._compact()
+        return added
+
+    def _compact(self) -> None:
+        """
+        Reclaim the space of the dropped lines
+        """
+        dead = self.first - self._offsets_start
+        base = self._offsets[dead]
+        end = self._end
+        self._offsets = array('Q', (offset - base for offset in self._offsets[dead:]))
+        self._offsets_start = self.first
+        self._end = end - base
+        if self._data is not None:
+            del self._data[:base]
+        else:
+            old = self._file
+            self._read(base, end)  # Map the whole file, unless all the live lines are empty
+            old_map = self._map
+            self._map = None
+            self._file = tempfile.TemporaryFile(prefix="log_buffer")
+            for start in range(base, end, COPY_CHUNK):
+                self._file.write(old_map[start:min(start + COPY_CHUNK, end)])
+            if old_map is not None:
+                old_map.close()
+            old.close()
+        for command, numbers in list(self.commands.items()):
+            keep = bisect_left(numbers, self.first)
+            if keep == len(numbers):
+                del self.commands[command]
+            elif keep:
+                self.commands[command] = numbers[keep:]
+
+    def _read(self, start: int, end: int) -> bytes:
+        if self._data is not None:
+            return bytes(self._data[start:end])
+        if end == start:
+            return b""
+        if self._map is None or len(self._map) < end:
+            self._close_map()
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[start:end]
+
+    def line(self, number: int) -> str:
+        """
+        Get a line by its absolute number
+        """
+        if not self.first <= number < self.last:
+            raise IndexError(f"Line {number} is not on the buffer")
+        index = number - self._offsets_start
+        start = self._offsets[index]
+        end = self._offsets[index + 1] if index + 1 < len(self._offsets) else self._end
+        return self._read(start, end).decode('utf-8', errors='replace')
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self.line(self.first + i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.line(self.first + index)
+
+    def command_lines(self, command: str) -> Sequence[int]:
+        """
+        Absolute numbers of the lines of a command still on the buffer
+        """
+        numbers = self.commands.get(command, array('Q'))
+        return numbers[bisect_left(numbers, self.first):]
+
+    def clear(self) -> None:
+        self.commands = {}
+        self.first = 0
+        self._offsets = array('Q')
+        self._offsets_start = 0
+        self._end = 0
+        self._reset_storage()
+
+    def close(self) -> None:
+        self._close_map()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class BufferedLog(Log):
+    """
+    Log that keeps its lines on a LineBuffer. Rendered lines are cached by absolute line number,
+    so dropping old lines does not invalidate what is on screen.
+    """
+
+    def __init__(
+            self,
+            highlight: bool = False,
+            max_lines: Optional[int] = MAX_LINES,
+            auto_scroll: bool = True,
+            spill: bool = False,
+            name: Optional[str] = None,
+            id: Optional[str] = None,  # pylint: disable=redefined-builtin
+            classes: Optional[str] = None,
+            disabled: bool = False,
+    ):
+        super().__init__(
+            highlight=highlight,
+            max_lines=None,
+            auto_scroll=auto_scroll,
+            name=name,
+            id=id,
+            classes=classes,
+            disabled=disabled
+        )
+        self.buffer = LineBuffer(max_lines=max_lines, spill=spill)
+        self._partial = ""
+
+    @property
+    def lines(self) -> Sequence[str]:
+        return self.buffer
+
+    @property
+    def line_count(self) -> int:
+        return len(self.buffer) + (1 if self._partial else 0)
+
+    def _line(self, y: int) -> str:
+        if y < len(self.buffer):
+            return self.buffer[y]
+        return self._partial
+
+    def write(self, data: str, scroll_end: Optional[bool] = None) -> "BufferedLog":
+        if not data:
+            return self
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()
+        self.refresh_lines(len(self.buffer))
+        return self._add(lines, None, scroll_end)
+
+    def write_lines(
+            self,
+            lines: Iterable[str],
+            scroll_end: Optional[bool] = None,
+            command: Optional[str] = None
+    ) -> "BufferedLog":
+        if self._partial:
+            lines = [self._partial, *lines]
+            self._partial = ""
+        new_lines = []
+        for line in lines:
+            new_lines.extend(line.splitlines() or [""])
+        return self._add(new_lines, command, scroll_end)
+
+    def _add(self, lines: List[str], command: Optional[str], scroll_end: Optional[bool]) -> "BufferedLog":
+        if lines:
+            # Longest string first, then its width on screen: close enough, and much cheaper than
+            # measuring every line
+            widest = max(lines, key=len)
+            self._width = max(self._width, cell_len(self._process_line(widest)))
+            self.buffer.append(lines, command)
+        self.virtual_size = Size(self._width, self.line_count)
+        auto_scroll = self.auto_scroll if scroll_end is None else scroll_end
+        if auto_scroll and not self.is_vertical_scrollbar_grabbed:
+            self.scroll_end(animate=False)
+        self.refresh()
+        return self
+
+    def clear(self) -> "BufferedLog":
+        self.buffer.clear()
+        self._partial = ""
+        return super().clear()
+
+    def _render_line(self, y: int, scroll_x: int, width: int) -> Strip:
+        rich_style = self.rich_style
+        if y >= self.line_count:
+            return Strip.blank(width, rich_style)
+        line = self._render_line_strip(y, rich_style)
+        return line.crop_extend(scroll_x, scroll_x + width, rich_style)
+
+    def _render_line_strip(self, y: int, rich_style: Style) -> Strip:
+        number = self.buffer.first + y
+        if number in self._render_line_cache:
+            return self._render_line_cache[number]
+        _line = self._process_line(self._line(y))
+        if self.highlight:
+            line_text = self.highlighter(Text(_line, style=rich_style, no_wrap=True))
+            line = Strip(line_text.render(self.app.console), cell_len(_line))
+        else:
+            line = Strip([Segment(_line, rich_style)], cell_len(_line))
+        if y < len(self.buffer):
+            # The partial line may still change
+            self._render_line_cache[number] = line
+        return line
+
+    def refresh_lines(self, y_start: int, line_count: int = 1) -> None:
+        first = self.buffer.first
+        for y in range(y_start, y_start + line_count):
+            self._render_line_cache.discard(first + y)
+        super(Log, self).refresh_lines(y_start, line_count=line_count)  # pylint: disable=bad-super-call
+
+    def on_unmount(self) -> None:
+        self.buffer.close()
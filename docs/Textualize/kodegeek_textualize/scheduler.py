@@ -0,0 +1,156 @@
+"""
+Run many commands without oversubscribing the machine: at most `max_parallel` at the same time,
+lower priority values first, each one with its own timeout.
+Author: Jose Vicente Nunez
+"""
+import asyncio
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Awaitable, Callable, List, Optional
+
+DEFAULT_TIMEOUT = 120.0
+
+
+class Status(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    TIMED_OUT = "timed out"
+    CANCELLED = "cancelled"
+
+    @property
+    def finished(self) -> bool:
+        return self not in (Status.PENDING, Status.RUNNING)
+
+
+@dataclass(order=True)
+class Job:
+    """
+    A command waiting on the scheduler queue, ordered by priority and then by submission order
+    """
+    priority: int
+    sequence: int
+    cmd: str = field(compare=False)
+    timeout: Optional[float] = field(default=DEFAULT_TIMEOUT, compare=False)
+    status: Status = field(default=Status.PENDING, compare=False)
+    returncode: Optional[int] = field(default=None, compare=False)
+    error: Optional[str] = field(default=None, compare=False)
+    started: Optional[float] = field(default=None, compare=False)
+    finished: Optional[float] = field(default=None, compare=False)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def describe(self) -> str:
+        if self.status == Status.FAILED and self.error:
+            detail = f": {self.error}"
+        elif self.returncode is not None:
+            detail = f", exit code={self.returncode}"
+        else:
+            detail = ""
+        return f'"{self.cmd}" {self.status.value} after {self.elapsed:.2f} s{detail}'
+
+
+# Runs a command and returns its exit code. Must kill the command when cancelled.
+Runner = Callable[[str], Awaitable[int]]
+
+
+class CommandScheduler:
+    """
+    Bounded pool of asyncio workers pulling jobs from a priority queue.
+    A job is cancelled (and its runner is expected to kill the process) when it runs past its timeout,
+    or when the whole scheduler is cancelled.
+    """
+
+    def __init__(
+            self,
+            runner: Runner,
+            max_parallel: Optional[int] = None,
+            timeout: Optional[float] = DEFAULT_TIMEOUT,
+            on_change: Optional[Callable[[Job], None]] = None
+    ):
+        self.runner = runner
+        self.max_parallel = max(1, max_parallel or os.cpu_count() or 1)
+        self.timeout = timeout
+        self.on_change = on_change
+        self.jobs: List[Job] = []
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._workers: List[asyncio.Task] = []
+
+    def submit(self, cmd: str, priority: int = 0, timeout: Optional[float] = None) -> Job:
+        """
+        Queue a command. Lower priority values run first, ties run in submission order.
+        """
+        job = Job(
+            priority=priority,
+            sequence=next(self._sequence),
+            cmd=cmd,
+            timeout=timeout if timeout is not None else self.timeout
+        )
+        self.jobs.append(job)
+        self._queue.put_nowait(job)
+        return job
+
+    def count(self, *statuses: Status) -> int:
+        return sum(1 for job in self.jobs if job.status in statuses)
+
+    @property
+    def done(self) -> bool:
+        return all(job.status.finished for job in self.jobs)
+
+    async def run(self) -> List[Job]:
+        """
+        Run every queued job, returns once all of them finished, failed, timed out or were cancelled
+        """
+        workers = min(self.max_parallel, self._queue.qsize())
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*self._workers)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        finally:
+            self._workers = []
+        return self.jobs
+
+    def cancel(self) -> None:
+        """
+        Stop the running jobs, and mark the ones still on the queue as cancelled
+        """
+        for worker in self._workers:
+            worker.cancel()
+        while not self._queue.empty():
+            self._set_status(self._queue.get_nowait(), Status.CANCELLED)
+
+    async def _work(self) -> None:
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            job.started = time.perf_counter()
+            self._set_status(job, Status.RUNNING)
+            try:
+                job.returncode = await asyncio.wait_for(self.runner(job.cmd), job.timeout)
+                status = Status.SUCCEEDED if job.returncode == 0 else Status.FAILED
+            except asyncio.TimeoutError:
+                status = Status.TIMED_OUT
+            except asyncio.CancelledError:
+                self._set_status(job, Status.CANCELLED)
+                raise
+            except Exception as exp:  # pylint: disable=broad-except
+                job.error = str(exp)
+                status = Status.FAILED
+            self._set_status(job, status)
+
+    def _set_status(self, job: Job, status: Status) -> None:
+        if status.finished:
+            job.finished = time.perf_counter()
+        job.status = status
+        if self.on_change:
+            self.on_change(job)
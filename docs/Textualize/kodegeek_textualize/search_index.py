@@ -0,0 +1,149 @@
+"""
+Trigram index used to search big tables from the command palette, without scanning every row on each keystroke.
+Posting lists are compact arrays of internal row ids. Removed rows leave a hole that is skipped when searching,
+and the index is rebuilt once there are more holes than rows.
+Author: Jose Vicente Nunez
+"""
+import heapq
+import re
+from array import array
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+MAX_RESULTS = 20
+MAX_FUZZY_CANDIDATES = 10_000
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    Lower cased text of each row, indexed by trigram (to find substrings) and by character
+    (to find fuzzy matches, all the characters of the query must be on the row)
+    """
+
+    def __init__(self):
+        self.keys: List[Optional[Hashable]] = []
+        self.texts: List[Optional[str]] = []
+        self.ids: Dict[Hashable, int] = {}
+        self.trigrams: Dict[str, array] = {}
+        self.chars: Dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, key: Hashable, text: str) -> None:
+        """
+        Index the text of a row, replacing the previous text if the row was already there
+        """
+        if key in self.ids:
+            self.remove(key)
+        row_id = len(self.keys)
+        text = text.lower()
+        self.keys.append(key)
+        self.texts.append(text)
+        self.ids[key] = row_id
+        for gram in trigrams(text):
+            postings = self.trigrams.get(gram)
+            if postings is None:
+                postings = self.trigrams[gram] = array('I')
+            postings.append(row_id)
+        for char in set(text):
+            postings = self.chars.get(char)
+            if postings is None:
+                postings = self.chars[char] = array('I')
+            postings.append(row_id)
+
+    def add_all(self, rows: Iterable[Tuple[Hashable, str]]) -> None:
+        for key, text in rows:
+            self.add(key, text)
+
+    def remove(self, key: Hashable) -> None:
+        row_id = self.ids.pop(key, None)
+        if row_id is None:
+            return
+        self.keys[row_id] = None
+        self.texts[row_id] = None
+        if len(self.keys) > 2 * len(self.ids) + 1024:
+            self._rebuild()
+
+    def clear(self) -> None:
+        self.keys = []
+        self.texts = []
+        self.ids = {}
+        self.trigrams = {}
+        self.chars = {}
+
+    def _rebuild(self) -> None:
+        rows = [(key, text) for key, text in zip(self.keys, self.texts) if key is not None]
+        self.clear()
+        self.add_all(rows)
+
+    def _rarest(self, postings: Dict[str, array], grams: Iterable[str]) -> array:
+        """
+        Shortest posting list among the grams, empty if any of them is not on the index
+        """
+        rarest = None
+        for gram in grams:
+            candidates = postings.get(gram)
+            if candidates is None:
+                return array('I')
+            if rarest is None or len(candidates) < len(rarest):
+                rarest = candidates
+        return rarest if rarest is not None else array('I')
+
+    def search(
+            self,
+            query: str,
+            score: Callable[[str], float],
+            limit: int = MAX_RESULTS
+    ) -> List[Tuple[float, Hashable]]:
+        """
+        Best matches of query
+        :param query: What the user typed
+        :param score: Fuzzy score of a row text, 0 if it does not match
+        :param limit: Maximum results
+        :return: Score and key of the best rows, best first
+        """
+        query = query.lower()
+        if not query:
+            return []
+        texts = self.texts
+        keys = self.keys
+        # Rows that contain the query get the best score, so they are checked first
+        grams = trigrams(query) if len(query) >= 3 else set(query)
+        exact = self._rarest(self.trigrams if len(query) >= 3 else self.chars, grams)
+        results = []
+        seen = set()
+        perfect = 0
+        for row_id in exact:
+            text = texts[row_id]
+            if text is not None and query in text:
+                seen.add(row_id)
+                points = score(text)
+                results.append((points, -row_id))
+                if points >= 1.0:
+                    perfect += 1
+                    if perfect == limit:
+                        # Nothing can score better, and ties go to the oldest rows
+                        break
+        if perfect < limit:
+            # Same test the fuzzy matcher does, without the scoring
+            subsequence = re.compile(".*?".join(map(re.escape, query)), re.DOTALL).search
+            checked = 0
+            for row_id in self._rarest(self.chars, set(query)):
+                if checked >= MAX_FUZZY_CANDIDATES:
+                    break
+                text = texts[row_id]
+                if text is None or row_id in seen or not subsequence(text):
+                    continue
+                checked += 1
+                points = score(text)
+                if points > 0:
+                    results.append((points, -row_id))
+        return [
+            (points, keys[-row_id])
+            for points, row_id in heapq.nlargest(limit, results)
+            if points > 0
+        ]
@@ -3,14 +3,27 @@
 Author: Jose Vicente Nunez
 """
 from functools import partial
-from typing import Any, List
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple
 
+from markdown_it import MarkdownIt
 from rich.style import Style
-from textual import on
+from textual import on, work
 from textual.app import ComposeResult, App
 from textual.command import Provider, Hit
+from textual.coordinate import Coordinate
 from textual.screen import ModalScreen, Screen
-from textual.widgets import DataTable, Footer, Header, Button, MarkdownViewer
+from textual.widgets import DataTable, Footer, Header, Button, MarkdownViewer, Input
+from textual.widgets.data_table import RowKey
+from textual.worker import Worker, get_current_worker
+
+from kodegeek_textualize.columnar_table import ColumnarTable
+from kodegeek_textualize.data_sources import DataSource, ColumnarSource, CsvSource, SqliteSource
+from kodegeek_textualize.detail_cache import DetailCache, DetailDocument, PreParsed, PREFETCH_ROWS, detail_markdown
+from kodegeek_textualize.instrumentation import TRACER, InstrumentationOverlay, add_arguments, traced, tracing
+from kodegeek_textualize.search_index import MAX_RESULTS
+from kodegeek_textualize.virtual_table import VirtualTable
 
 MY_DATA = [
     ("level", "name", "gender", "country", "age"),
@@ -31,39 +44,62 @@ class DetailScreen(ModalScreen):
             ident: str | None = None,
             classes: str | None = None,
             row: List[Any] | None = None,
+            columns: Sequence[str] = MY_DATA[0],
+            document: Optional[DetailDocument] = None
     ):
         super().__init__(name, ident, classes)
         self.row: List[Any] = row
+        self.columns = columns
+        self.document = document
+
+    def _parser(self):
+        return MarkdownIt("gfm-like") if self.document is None else PreParsed(self.document)
 
     def compose(self) -> ComposeResult:
         self.log.info(f"Details: {self.row}")
-        columns = MY_DATA[0]
-        row_markdown = "\n"
-        for i in range(0, len(columns)):
-            row_markdown += f"* **{columns[i].title()}:** {self.row[i]}\n"
-        yield MarkdownViewer(f"""## User details:
-        {row_markdown}
-        """)
+        markdown = detail_markdown(self.columns, self.row) if self.document is None else self.document.markdown
+        yield MarkdownViewer(markdown, parser_factory=self._parser)
         button = Button("Close", variant="primary", id="close")
         button.tooltip = "Go back to main screen"
         yield button
 
+    def show(self, document: DetailDocument) -> None:
+        """
+        Reuse the screen for another row, the document tokens are already parsed
+        """
+        self.document = document
+        if self.is_mounted:
+            viewer = self.query_one(MarkdownViewer)
+            viewer.document.update(document.markdown)
+            viewer.scroll_home(animate=False)
+
     @on(Button.Pressed, "#close")
     def on_button_pressed(self, _) -> None:
         self.app.pop_screen()
 
 
 class CustomCommand(Provider):
+    # Columns searched from the palette
+    SEARCH_COLUMNS = ("name",)
+    MAX_RESULTS = MAX_RESULTS
 
     def __init__(self, screen: Screen[Any], match_style: Style | None = None):
         super().__init__(screen, match_style)
         self.table = None
+        self.index = None
 
     async def startup(self) -> None:
         my_app = self.app
         my_app.log.info(f"Loaded provider: CustomCommand")
-        self.table = my_app.query(DataTable).first()
+        if my_app.source is not None:
+            # The source does the searching
+            self.table = my_app.query(VirtualTable).first()
+            return
+        self.table = my_app.query(ColumnarTable).first()
+        # Built the first time the palette opens, the table keeps it up to date after that
+        self.index = self.table.search_index(*self.SEARCH_COLUMNS)
 
+    @traced("CustomCommand.search", "palette", detail=lambda _, query: {"query": query})
     async def search(self, query: str) -> Hit:
         matcher = self.matcher(query)
 
@@ -71,19 +107,25 @@ class CustomCommand(Provider):
         assert isinstance(my_app, CompetitorsApp)
 
         my_app.log.info(f"Got query: {query}")
-        for row_key in self.table.rows:
-            row = self.table.get_row(row_key)
-            my_app.log.info(f"Searching {row}")
-            searchable = row[1]
-            score = matcher.match(searchable)
-            if score > 0:
-                runner_detail = DetailScreen(row=row)
+        if self.index is None:
+            source = self.table.source
+            for row in source.search(self.SEARCH_COLUMNS[0], query, limit=self.MAX_RESULTS):
+                searchable = str(row[source.columns.index(self.SEARCH_COLUMNS[0])])
                 yield Hit(
-                    score,
-                    matcher.highlight(f"{searchable}"),
-                    partial(my_app.show_detail, runner_detail),
+                    matcher.match(searchable),
+                    matcher.highlight(searchable),
+                    partial(my_app.show_source_row, row),
                     help=f"Show details about {searchable}"
                 )
+            return
+        for score, row_key in self.index.search(query, matcher.match, limit=self.MAX_RESULTS):
+            searchable = self.table.searchable_text(row_key, self.SEARCH_COLUMNS)
+            yield Hit(
+                score,
+                matcher.highlight(searchable),
+                partial(my_app.show_row_detail, row_key),
+                help=f"Show details about {searchable}"
+            )
 
 
 class CompetitorsApp(App):
@@ -95,14 +137,35 @@ class CompetitorsApp(App):
     ENABLE_COMMAND_PALETTE = True
     # Add the default commands and the TablePopulateProvider to get a row directly by name
     COMMANDS = App.COMMANDS | {CustomCommand}
+    FILTER_COLUMN = "name"
+
+    def __init__(self, source: Optional[DataSource] = None, overlay: bool = False):
+        """
+        :param source: If given, rows are read from here as they are shown, instead of copied into the table
+        :param overlay: Show the event loop lag and the slowest handlers, the tracer must be enabled
+        """
+        super().__init__()
+        self.source = source
+        self.overlay = overlay
+        self.details = DetailCache()
 
     def action_quit_app(self):
         self.exit(0)
 
     def compose(self) -> ComposeResult:
         yield Header(show_clock=True)
+        if self.overlay:
+            yield InstrumentationOverlay()
 
-        table = DataTable(id=f'competitors_table')
+        if self.source is not None:
+            yield Input(placeholder=f"Filter by {self.FILTER_COLUMN}, press enter", id="filter")
+            virtual_table = VirtualTable(self.source, id="competitors_table")
+            virtual_table.tooltip = "Select a row to get more details"
+            yield virtual_table
+            yield Footer()
+            return
+
+        table = ColumnarTable(id=f'competitors_table')
         table.cursor_type = 'row'
         table.zebra_stripes = True
         table.loading = True
@@ -110,34 +173,119 @@ class CompetitorsApp(App):
         yield Footer()
 
     def on_mount(self) -> None:
+        TRACER.start(self)
+        # One detail screen, reused for every row
+        self.install_screen(DetailScreen(), name="details")
+        if self.source is not None:
+            self.query_one(VirtualTable).focus()
+            return
         table = self.get_widget_by_id(f'competitors_table', expect_type=DataTable)
-        columns = [x.title() for x in MY_DATA[0]]
-        table.add_columns(*columns)
+        for column in MY_DATA[0]:
+            table.add_column(column.title(), key=column)
         table.add_rows(MY_DATA[1:])
         table.loading = False
         table.tooltip = "Select a row to get more details"
 
     @on(DataTable.HeaderSelected)
+    @traced("on_header_clicked")
     def on_header_clicked(self, event: DataTable.HeaderSelected):
         table = event.data_table
-        table.sort(event.column_key)
+        table.sort(event.column_key, reverse=table.sort_reverse(event.column_key.value))
+
+    @on(VirtualTable.HeaderSelected)
+    @traced("on_header_clicked")
+    def on_virtual_header_clicked(self, event: VirtualTable.HeaderSelected):
+        table = event.table
+        table.sort(event.column, reverse=table.sort_reverse(event.column))
+
+    @on(VirtualTable.RowSelected)
+    def on_virtual_row_clicked(self, event: VirtualTable.RowSelected) -> None:
+        self.show_source_row(event.row)
+
+    @on(Input.Submitted, "#filter")
+    def on_filter(self, event: Input.Submitted) -> None:
+        table = self.query_one(VirtualTable)
+        table.filter(self.FILTER_COLUMN, event.value)
+        self.sub_title = f"{table.row_count} users"
+        table.focus()
 
     @on(DataTable.RowSelected)
     def on_row_clicked(self, event: DataTable.RowSelected) -> None:
-        table = event.data_table
-        row = table.get_row(event.row_key)
-        runner_detail = DetailScreen(row=row)
-        self.show_detail(runner_detail)
+        self.show_row_detail(event.row_key)
+
+    @on(DataTable.RowHighlighted)
+    def on_row_highlighted(self, event: DataTable.RowHighlighted) -> None:
+        """
+        Take the rows next to the cursor, closest first, while on the event loop.
+        The worker thread only gets this snapshot, it never reads the table.
+        """
+        table = self.get_widget_by_id(f'competitors_table', expect_type=ColumnarTable)
+        rows = []
+        for offset in sorted(range(-PREFETCH_ROWS, PREFETCH_ROWS + 1), key=abs):
+            position = event.cursor_row + offset
+            if not 0 <= position < table.row_count:
+                continue
+            row_key = table.coordinate_to_cell_key(Coordinate(position, 0)).row_key
+            version = table.row_version(row_key)
+            if (row_key, version) not in self.details:
+                rows.append((row_key, version, table.get_row(row_key)))
+        if rows:
+            self.prefetch_details(rows)
+
+    def on_worker_state_changed(self, event: Worker.StateChanged) -> None:
+        TRACER.worker_state(event.worker, event.state)
+
+    @work(thread=True, exclusive=True, group="prefetch")
+    def prefetch_details(self, rows: List[Tuple[RowKey, int, List[Any]]]) -> None:
+        """
+        Render the rows next to the cursor before they are selected
+        """
+        worker = get_current_worker()
+        for row_key, version, row in rows:
+            if worker.is_cancelled:
+                return
+            self.details.get(row_key, version, MY_DATA[0], lambda: row, prefetch=True)
+
+    def show_document(self, document: DetailDocument) -> None:
+        screen = self.get_screen("details")
+        screen.show(document)
+        if self.screen is not screen:
+            self.push_screen(screen)
+        self.log.info(f"Detail cache: {self.details.summary()}")
+
+    def show_row_detail(self, row_key: RowKey):
+        table = self.get_widget_by_id(f'competitors_table', expect_type=ColumnarTable)
+        self.show_document(
+            self.details.get(row_key, table.row_version(row_key), MY_DATA[0], partial(table.get_row, row_key))
+        )
 
-    def show_detail(self, detailScreen: DetailScreen):
-        self.push_screen(detailScreen)
+    def show_source_row(self, row: Sequence[Any]):
+        # Rows from a data source have no key, but they are immutable tuples
+        self.show_document(self.details.get(tuple(row), 0, self.source.columns, lambda: row))
 
 
 def main():
-    app = CompetitorsApp()
+    parser = ArgumentParser(description="Competitors table")
+    sources = parser.add_mutually_exclusive_group()
+    sources.add_argument("--csv", type=Path, help="Read the competitors from a CSV file, as they are shown")
+    sources.add_argument("--sqlite", type=Path, help="Read the competitors from a SQLite database, as they are shown")
+    sources.add_argument("--columnar", action="store_true", default=False, help="Keep the sample data on a columnar source")
+    parser.add_argument("--table", default="competitors", help="SQLite table")
+    add_arguments(parser)
+    options = parser.parse_args()
+    if options.csv:
+        source = CsvSource(options.csv)
+    elif options.sqlite:
+        source = SqliteSource(options.sqlite, options.table)
+    elif options.columnar:
+        source = ColumnarSource.from_rows(MY_DATA[0], MY_DATA[1:])
+    else:
+        source = None
+    app = CompetitorsApp(source=source, overlay=options.overlay)
     app.title = f"Summary".title()
-    app.sub_title = f"{len(MY_DATA)} users"
-    app.run()
+    app.sub_title = f"{len(source) if source is not None else len(MY_DATA) - 1} users"
+    with tracing(options):
+        app.run()
 
 
 if __name__ == "__main__":
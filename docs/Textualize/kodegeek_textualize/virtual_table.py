@@ -0,0 +1,220 @@
+"""
+Table that reads its rows from a DataSource instead of owning them.
+Only the rows on screen, plus a prefetch margin above and below, are fetched and turned into strings;
+sorting and filtering are done by the source.
+Author: Jose Vicente Nunez
+"""
+from typing import Any, List, Optional, Tuple
+
+from rich.cells import cell_len
+from rich.segment import Segment
+from rich.style import Style
+from textual import events
+from textual.binding import Binding
+from textual.geometry import Size
+from textual.message import Message
+from textual.reactive import reactive
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+
+from kodegeek_textualize.column_store import sort_reverse
+from kodegeek_textualize.data_sources import DataSource
+
+PREFETCH = 100
+MAX_COLUMN_WIDTH = 40
+SEPARATOR = " "
+
+
+class VirtualTable(ScrollView, can_focus=True):
+    DEFAULT_CSS = """
+    VirtualTable {
+        background: $surface;
+        color: $text;
+    }
+    """
+    BINDINGS = [
+        Binding("enter", "select_cursor", "Select", show=False),
+        Binding("up", "cursor_up", "Cursor Up", show=False),
+        Binding("down", "cursor_down", "Cursor Down", show=False),
+        Binding("pageup", "page_up", "Page Up", show=False),
+        Binding("pagedown", "page_down", "Page Down", show=False),
+        Binding("home", "cursor_home", "Top", show=False),
+        Binding("end", "cursor_end", "Bottom", show=False),
+    ]
+    cursor_row = reactive(0)
+
+    class RowSelected(Message):
+        def __init__(self, table: "VirtualTable", position: int, row: Tuple[Any, ...]):
+            super().__init__()
+            self.table = table
+            self.position = position
+            self.row = row
+
+        @property
+        def control(self) -> "VirtualTable":
+            return self.table
+
+    class HeaderSelected(Message):
+        def __init__(self, table: "VirtualTable", column: str):
+            super().__init__()
+            self.table = table
+            self.column = column
+
+        @property
+        def control(self) -> "VirtualTable":
+            return self.table
+
+    def __init__(
+            self,
+            source: DataSource,
+            prefetch: int = PREFETCH,
+            name: Optional[str] = None,
+            id: Optional[str] = None,  # pylint: disable=redefined-builtin
+            classes: Optional[str] = None
+    ):
+        super().__init__(name=name, id=id, classes=classes)
+        self.source = source
+        self.prefetch = prefetch
+        self.widths = [cell_len(column) for column in source.columns]
+        self.current_sorts: set = set()
+        self.window_start = 0
+        self.window: List[Tuple[Any, ...]] = []
+        self.fetches = 0
+
+    @property
+    def row_count(self) -> int:
+        return len(self.source)
+
+    @property
+    def visible_rows(self) -> int:
+        # The first line is the header
+        return max(1, self.scrollable_content_region.height - 1)
+
+    def sort_reverse(self, sort_type: str) -> bool:
+        return sort_reverse(self.current_sorts, sort_type)
+
+    def sort(self, column: str, reverse: bool = False) -> None:
+        self.source.sort(column, reverse)
+        self.reload()
+
+    def filter(self, column: str, text: str) -> None:
+        self.source.filter(column, text)
+        self.reload()
+
+    def reload(self) -> None:
+        """
+        The rows on the source changed, forget what was fetched
+        """
+        self.window = []
+        self.window_start = 0
+        self.cursor_row = min(self.cursor_row, max(0, self.row_count - 1))
+        self._update_virtual_size()
+        self.refresh()
+
+    def _update_virtual_size(self) -> None:
+        self.virtual_size = Size(sum(self.widths) + len(SEPARATOR) * len(self.widths), self.row_count + 1)
+
+    def on_mount(self) -> None:
+        self._update_virtual_size()
+
+    def get_row(self, position: int) -> Optional[Tuple[Any, ...]]:
+        """
+        Row on the current view, fetching its window from the source if needed
+        """
+        if not 0 <= position < self.row_count:
+            return None
+        if not self.window_start <= position < self.window_start + len(self.window):
+            start = max(0, position - self.prefetch)
+            self.window = self.source.rows(start, self.visible_rows + 2 * self.prefetch)
+            self.window_start = start
+            self.fetches += 1
+            self._learn_widths(self.window)
+        return self.window[position - self.window_start]
+
+    def _learn_widths(self, rows: List[Tuple[Any, ...]]) -> None:
+        changed = False
+        for index, values in enumerate(zip(*rows)):
+            if index >= len(self.widths):
+                break
+            widest = min(MAX_COLUMN_WIDTH, cell_len(max(map(str, values), key=len)))
+            if widest > self.widths[index]:
+                self.widths[index] = widest
+                changed = True
+        if changed:
+            self.call_later(self._update_virtual_size)
+
+    def _format(self, values) -> str:
+        cells = []
+        for value, width in zip(values, self.widths):
+            text = "" if value is None else str(value)
+            cells.append(text[:width].ljust(width))
+        return SEPARATOR.join(cells)
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        width = self.scrollable_content_region.width
+        base = self.rich_style
+        if y == 0:
+            text = self._format(self.source.columns)
+            style = base + Style(bold=True, underline=True)
+        else:
+            position = scroll_y + y - 1
+            row = self.get_row(position)
+            if row is None:
+                return Strip.blank(width, base)
+            text = self._format(row)
+            style = base + Style(reverse=True) if position == self.cursor_row else base
+        strip = Strip([Segment(text, style)], cell_len(text))
+        return strip.crop_extend(scroll_x, scroll_x + width, base)
+
+    def watch_cursor_row(self, old: int, new: int) -> None:
+        _, scroll_y = self.scroll_offset
+        if new < scroll_y:
+            self.scroll_to(y=new, animate=False)
+        elif new >= scroll_y + self.visible_rows:
+            self.scroll_to(y=new - self.visible_rows + 1, animate=False)
+        self.refresh()
+
+    def _move_cursor(self, delta: int) -> None:
+        self.cursor_row = max(0, min(self.row_count - 1, self.cursor_row + delta))
+
+    def action_cursor_up(self) -> None:
+        self._move_cursor(-1)
+
+    def action_cursor_down(self) -> None:
+        self._move_cursor(1)
+
+    def action_page_up(self) -> None:
+        self._move_cursor(-self.visible_rows)
+
+    def action_page_down(self) -> None:
+        self._move_cursor(self.visible_rows)
+
+    def action_cursor_home(self) -> None:
+        self.cursor_row = 0
+
+    def action_cursor_end(self) -> None:
+        self.cursor_row = max(0, self.row_count - 1)
+
+    def action_select_cursor(self) -> None:
+        row = self.get_row(self.cursor_row)
+        if row is not None:
+            self.post_message(self.RowSelected(self, self.cursor_row, row))
+
+    def on_click(self, event: events.Click) -> None:
+        scroll_x, scroll_y = self.scroll_offset
+        if event.y == 0:
+            x = event.x + scroll_x
+            for column, width in zip(self.source.columns, self.widths):
+                if x < width + len(SEPARATOR):
+                    self.post_message(self.HeaderSelected(self, column))
+                    break
+                x -= width + len(SEPARATOR)
+            return
+        position = scroll_y + event.y - 1
+        if 0 <= position < self.row_count:
+            self.cursor_row = position
+            self.action_select_cursor()
+
+    def on_unmount(self) -> None:
+        self.source.close()
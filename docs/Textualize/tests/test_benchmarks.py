@@ -0,0 +1,46 @@
+import unittest
+from kodegeek_textualize.benchmarks import compare_results, measure_competitors, summarize
+
+
+class BenchmarksTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_measure_competitors(self):
+        for columnar in (False, True):
+            measured = await measure_competitors(50, columnar=columnar)
+            self.assertGreater(measured["first_row_s"], 0)
+            self.assertGreater(measured["sort_s"], 0)
+            self.assertLessEqual(
+                measured["palette_keystroke_s"], measured["palette_keystroke_max_s"]
+            )
+
+    def test_compare_results(self):
+        baseline = [
+            {"app": "os", "rows": 10, "load_s": 1.0, "peak_rss_mib": 40.0, "kept_lines": 10}
+        ]
+        results = [
+            {"app": "os", "rows": 10, "load_s": 1.5, "peak_rss_mib": 41.0, "kept_lines": 100}
+        ]
+        regressions = compare_results(baseline, results, threshold=0.2)
+        # RSS grew less than the noise floor, line counts are not timings
+        self.assertEqual(1, len(regressions))
+        self.assertIn("load_s", regressions[0])
+        self.assertEqual([], compare_results(baseline, [{**results[0], "rows": 20}]))
+
+    def test_compare_medians(self):
+        samples = [
+            {"app": "os", "rows": 10, "load_s": load, "kept_lines": 10}
+            for load in (1.0, 1.4, 0.9, 1.1, 1.0)
+        ]
+        baseline = summarize(samples)
+        self.assertEqual(
+            (1.0, 5, 10), (baseline["load_s"], baseline["samples"], baseline["kept_lines"])
+        )
+        self.assertAlmostEqual(0.5, baseline["spread"]["load_s"])
+        # Inside the spread of the baseline, then above the spread plus the threshold
+        self.assertEqual([], compare_results([baseline], [summarize(samples[1:2])], threshold=0.2))
+        regressions = compare_results([baseline], [{**baseline, "load_s": 1.9}], threshold=0.2)
+        self.assertEqual(1, len(regressions))
+        self.assertIn("load_s", regressions[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from textual.widgets import MarkdownViewer
+
+from kodegeek_textualize.columnar_table import ColumnarTable
+from kodegeek_textualize.detail_cache import DetailCache, PreParsed, PREFETCH_ROWS
+from kodegeek_textualize.table_with_detail_screen import CompetitorsApp, MY_DATA
+
+
+class DetailCacheTestCase(unittest.TestCase):
+
+    def test_lru(self):
+        cache = DetailCache(size=2)
+        columns = MY_DATA[0]
+        first = cache.get("wai", 1, columns, lambda: MY_DATA[1])
+        self.assertIn("* **Name:** Wai", first.markdown)
+        self.assertIs(first, cache.get("wai", 1, columns, lambda: self.fail("Not rendered again")))
+        # A new version of the row is rendered again
+        self.assertIsNot(first, cache.get("wai", 2, columns, lambda: MY_DATA[1]))
+        cache.get("ryoji", 1, columns, lambda: MY_DATA[2])
+        self.assertEqual(2, len(cache))
+        self.assertNotIn(("wai", 1), cache)
+        # Prefetching does not change the hit rate
+        cache.get("fabio", 1, columns, lambda: MY_DATA[3], prefetch=True)
+        self.assertEqual((1, 3), (cache.hits, cache.misses))
+        self.assertEqual(0.25, cache.hit_rate)
+        self.assertEqual(4, cache.renders)
+
+    def test_pre_parsed(self):
+        document = DetailCache().render(MY_DATA[0], MY_DATA[4])
+        parser = PreParsed(document)
+        self.assertIs(document.tokens, parser.parse(document.markdown))
+        self.assertTrue(parser.parse("# Other"))
+
+
+class DetailScreenTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def test_prefetch_and_reuse(self):
+        app = CompetitorsApp()
+        async with app.run_test() as pilot:
+            table = app.query_one(ColumnarTable)
+            for i in range(20):
+                table.add_row("Gold", f"Runner {i}", "F", "ESP", i)
+            await pilot.press("down", "down")
+            await app.workers.wait_for_complete()
+            # Rows around the cursor (on the third row) are ready before they are selected
+            self.assertEqual(2 + PREFETCH_ROWS + 1, len(app.details))
+            await pilot.press("enter")
+            await pilot.pause()
+            screen = app.screen
+            self.assertIn("Purple", screen.document.markdown)
+            await pilot.click("#close")
+            await pilot.press("down", "enter")
+            await pilot.pause()
+            # Same screen, showing the next row
+            self.assertIs(screen, app.screen)
+            self.assertIn("Blue", screen.document.markdown)
+            self.assertTrue(app.screen.query_one(MarkdownViewer).document)
+            self.assertEqual(1.0, app.details.hit_rate)
+            await pilot.click("#close")
+
+            # Changing a row renders it again
+            row_key = table.coordinate_to_cell_key(table.cursor_coordinate).row_key
+            table.update_cell(row_key, "name", "Manuela Jr")
+            await pilot.press("enter")
+            await pilot.pause()
+            self.assertIn("Manuela Jr", app.screen.document.markdown)
+            self.assertEqual(1, app.details.misses)
+            await pilot.click("#close")
+            await pilot.press("q")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import tempfile
+import unittest
+from argparse import ArgumentParser
+from pathlib import Path
+from kodegeek_textualize.instrumentation import TRACER, InstrumentationOverlay, add_arguments, traced, tracing
+from kodegeek_textualize.table_with_detail_screen import CompetitorsApp
+
+
+@traced("double")
+def double(value: int) -> int:
+    return value * 2
+
+
+@traced(detail=lambda count: {"count": count})
+async def numbers(count: int):
+    for i in range(count):
+        yield i
+
+
+class InstrumentationTestCase(unittest.IsolatedAsyncioTestCase):
+    def tearDown(self):
+        TRACER.enabled = False
+        TRACER.events.clear()
+        TRACER.stats.clear()
+
+    async def test_traced(self):
+        self.assertEqual(4, double(2))
+        self.assertEqual([0, 1, 2], [i async for i in numbers(3)])
+        self.assertFalse(TRACER.events)
+        TRACER.enable()
+        self.assertEqual(4, double(2))
+        self.assertEqual([0, 1, 2], [i async for i in numbers(3)])
+        spans = {event["name"]: event for event in TRACER.events}
+        self.assertEqual({"count": 3}, spans["numbers"]["args"])
+        self.assertEqual(1, TRACER.stats["double"].count)
+
+    async def test_app_trace(self):
+        TRACER.enable()
+        app = CompetitorsApp(overlay=True)
+        async with app.run_test() as pilot:
+            app.action_command_palette()
+            await pilot.pause()
+            for char in "man":
+                await pilot.press(char)
+            await app.workers.wait_for_complete()
+            await pilot.pause(0.2)
+            self.assertIn("Loop lag", str(app.query_one(InstrumentationOverlay).renderable))
+            await pilot.press("escape")
+            await pilot.press("q")
+        with tempfile.TemporaryDirectory() as directory:
+            trace = Path(directory) / "trace.json"
+            TRACER.save(trace)
+            events = json.loads(trace.read_text())["traceEvents"]
+        names = {event["name"] for event in events}
+        self.assertIn("CustomCommand.search", names)
+        self.assertIn("worker prefetch_details", names)
+        self.assertIn("event loop lag", names)
+
+    async def test_command_line(self):
+        parser = ArgumentParser()
+        add_arguments(parser)
+        with tracing(parser.parse_args([])):
+            double(1)
+        self.assertFalse(TRACER.enabled)
+        with tempfile.TemporaryDirectory() as directory:
+            trace = Path(directory) / "trace.json"
+            with tracing(parser.parse_args(["--trace", str(trace)])):
+                self.assertTrue(TRACER.enabled)
+                double(1)
+            events = json.loads(trace.read_text())["traceEvents"]
+        self.assertIn("double", {event["name"] for event in events})
+        self.assertTrue(parser.parse_args(["--overlay"]).overlay)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import unittest
+from textual.app import App, ComposeResult
+from kodegeek_textualize.json_tree import JsonIndex, JsonTree, MAX_CHILDREN
+from kodegeek_textualize.log_scroller import LogScreen, OsApp
+
+DOCUMENT = {
+    "id": "computer",
+    "description": "Desktop \"Computer\" [x] {y} \\ done",
+    "children": [{"id": f"memory:{i}", "size": i * 1024, "claimed": i % 2 == 0, "serial": None} for i in range(1_200)],
+    "configuration": {"boot": "normal", "chassis": "desktop"}
+}
+
+
+def index_of(raw: bytes, chunk_size: int = 7) -> JsonIndex:
+    index = JsonIndex()
+    for start in range(0, len(raw), chunk_size):
+        index.feed(raw[start:start + chunk_size])
+    return index
+
+
+def decode(index: JsonIndex, start: int):
+    if not index.is_container(start):
+        return index.value(start, index.end(start))
+    if index.is_object(start):
+        return {key: decode(index, value) for key, _, value, _ in index.children(start)}
+    return [decode(index, value) for _, _, value, _ in index.children(start)]
+
+
+class TreeApp(App):
+    def compose(self) -> ComposeResult:
+        yield JsonTree()
+
+
+class JsonIndexTestCase(unittest.TestCase):
+    def test_index(self):
+        for indent in (None, 2):
+            index = index_of(json.dumps(DOCUMENT, indent=indent).encode('utf-8'))
+            self.assertTrue(index.complete)
+            self.assertEqual(DOCUMENT, decode(index, index.roots[0]))
+
+    def test_search(self):
+        index = index_of(json.dumps(DOCUMENT).encode('utf-8'))
+        offset = index.find("MEMORY:1199")
+        self.assertEqual(
+            [None, "children", None, "id"],
+            [key for key, _, _, _ in index.path(offset)]
+        )
+        self.assertIsNone(index.find("not there"))
+
+    def test_invalid(self):
+        index = index_of(b'{"a": [1, 2}')
+        self.assertFalse(index.complete)
+        self.assertIsNotNone(index.error)
+
+
+class JsonTreeTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_lazy_tree(self):
+        app = TreeApp()
+        async with app.run_test() as pilot:
+            tree = app.query_one(JsonTree)
+            document = tree.add_document("lshw -json", index_of(json.dumps(DOCUMENT).encode('utf-8')))
+            self.assertEqual(0, len(document.children))
+            document.expand()
+            await pilot.pause()
+            root = document.children[0]
+            self.assertEqual(0, len(root.children))
+            root.expand()
+            await pilot.pause()
+            self.assertEqual(4, len(root.children))
+            children = root.children[2]
+            children.expand()
+            await pilot.pause()
+            self.assertEqual(MAX_CHILDREN + 1, len(children.children))  # The last one loads more
+
+            node = tree.find_next("memory:1150")
+            await pilot.pause()
+            self.assertEqual(tree.cursor_node, node)
+            self.assertIn("memory:1150", str(node.label))
+            self.assertEqual(1_200, len(children.children))
+
+            truncated = tree.add_document("truncated", index_of(b'{"a": 1} {"b": [1, 2'))
+            truncated.expand()
+            await pilot.pause()
+            self.assertEqual(1, len(truncated.children))
+            await pilot.press("q")
+
+    async def test_structured_log_screen(self):
+        app = OsApp(structured=True)
+        async with app.run_test() as pilot:
+            screen = LogScreen(
+                selections=[
+                    """echo '{"cpu": [{"id": "cpu:0", "vendor": "Intel"}]}'""",
+                    "echo plain text",
+                    """echo '[{"a": 1}, {"b": [1,2'"""
+                ],
+                structured=True
+            )
+            await app.push_screen(screen)
+            for _ in range(50):
+                await pilot.pause(0.1)
+                if screen.scheduler.done:
+                    break
+            tree = screen.query_one(JsonTree)
+            self.assertEqual(1, len(tree.documents))
+            self.assertTrue(tree.display)
+            lines = list(screen.query_one("#event_log").lines)
+            self.assertIn("plain text", lines)
+            self.assertIn('[{"a": 1}, {"b": [1,2', lines)
+            await pilot.click("#close")
+            await pilot.press("q")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
+import asyncio
 import unittest
 from textual.widgets import Log, Button
-from kodegeek_textualize.log_scroller import OsApp
+from kodegeek_textualize.log_scroller import OsApp, CommandStats, LogScreen, read_lines
+from kodegeek_textualize.scheduler import Status
 
 
 class LogScrollerTestCase(unittest.IsolatedAsyncioTestCase):
@@ -16,6 +18,39 @@ class LogScrollerTestCase(unittest.IsolatedAsyncioTestCase):
             await pilot.click("#close")  # Close the new screen, pop the original one
             await pilot.press("q")  # Quit the app by pressing q
 
+    async def test_timeout(self):
+        app = OsApp()
+        async with app.run_test() as pilot:
+            screen = LogScreen(selections=["echo fast", "sleep 30"], timeout=0.5)
+            await app.push_screen(screen)
+            for _ in range(50):
+                await pilot.pause(0.1)
+                if screen.scheduler.done:
+                    break
+            fast, slow = screen.scheduler.jobs
+            self.assertEqual(Status.SUCCEEDED, fast.status)
+            self.assertEqual(Status.TIMED_OUT, slow.status)
+            self.assertEqual(-9, screen.stats["sleep 30"].returncode)
+            await pilot.click("#close")
+            await pilot.press("q")
+
+    async def test_read_lines(self):
+        stream = asyncio.StreamReader()
+        stream.feed_data("first\nsecond\nthi".encode())
+        stream.feed_data("rd ñ\nlast".encode())
+        stream.feed_eof()
+        queue = asyncio.Queue(maxsize=1)
+        stats = CommandStats(cmd="test")
+        reader = asyncio.create_task(read_lines(stream, queue, stats, chunk_size=8))
+        lines = []
+        while (batch := await queue.get()) is not None:
+            lines.extend(batch)
+        await reader
+        self.assertEqual(["first", "second", "third ñ", "last"], lines)
+        self.assertEqual(4, stats.total_lines)
+        self.assertEqual(len("first\nsecond\nthird ñ\nlast".encode()), stats.total_bytes)
+        self.assertIsNotNone(stats.first_line)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from kodegeek_textualize.log_scroller import LogScreen, OsApp
+from kodegeek_textualize.result_cache import ResultCache, host_fingerprint
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory=Path(directory), ttls={"lshw": 60, "numastat": 0}, default_ttl=1)
+            self.assertIsNone(cache.put("numastat -z", b"not cached"))
+            self.assertIsNone(cache.put("lshw -json", b"failed", returncode=1))
+            self.assertIsNone(cache.get("lshw -json"))
+            cache.put("lshw -json", b'{"id": "computer"}')
+            cache.put("lsmem", b"memory")
+
+            # A new cache finds the results on disk
+            cache = ResultCache(directory=Path(directory), ttls={"lshw": 60}, default_ttl=1)
+            lshw = cache.get("lshw -json")
+            self.assertEqual(b'{"id": "computer"}', lshw.output)
+            self.assertTrue(cache.is_fresh(lshw))
+            lsmem = cache.get("lsmem")
+            lsmem.created -= 2
+            self.assertFalse(cache.is_fresh(lsmem))
+
+            # Nothing is reused after the host changes
+            cache = ResultCache(directory=Path(directory), fingerprint="rebooted")
+            self.assertIsNone(cache.get("lshw -json"))
+
+    def test_fingerprint(self):
+        self.assertEqual(host_fingerprint(), host_fingerprint())
+
+
+class CachedLogScreenTestCase(unittest.IsolatedAsyncioTestCase):
+    async def run_screen(self, app: OsApp, pilot, cache: ResultCache) -> LogScreen:
+        screen = LogScreen(selections=["echo fresh", "date +%s%N"], cache=cache)
+        await app.push_screen(screen)
+        for _ in range(50):
+            await pilot.pause(0.1)
+            if screen.scheduler.done:
+                break
+        return screen
+
+    async def test_cached_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory=Path(directory), ttls={"echo": 60, "date": 0.5})
+            app = OsApp(cache=cache)
+            async with app.run_test() as pilot:
+                screen = await self.run_screen(app, pilot, cache)
+                self.assertEqual(2, len(screen.scheduler.jobs))
+                first_date = cache.get("date +%s%N").output
+                await pilot.click("#close")
+
+                time.sleep(0.5)
+                screen = await self.run_screen(app, pilot, cache)
+                # Only the expired command runs again, both are shown right away from the cache
+                self.assertEqual(["date +%s%N"], [job.cmd for job in screen.scheduler.jobs])
+                lines = list(screen.query_one("#event_log").lines)
+                self.assertIn("fresh", lines)
+                self.assertIn(first_date.decode().strip(), lines)
+                self.assertNotEqual(first_date, cache.get("date +%s%N").output)
+                await pilot.click("#close")
+                await pilot.press("q")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from textual.app import App, ComposeResult
+from kodegeek_textualize.ring_buffer import BufferedLog, LineBuffer
+
+
+class LogApp(App):
+    def compose(self) -> ComposeResult:
+        yield BufferedLog(max_lines=1_000)
+
+
+class RingBufferTestCase(unittest.TestCase):
+    def test_ring(self):
+        for spill in (False, True):
+            buffer = LineBuffer(max_lines=10_000, spill=spill)
+            for start in range(0, 100_000, 100):
+                command = "even" if start % 200 == 0 else "odd"
+                buffer.append([f"line {i} ñ" for i in range(start, start + 100)], command=command)
+            self.assertEqual(10_000, len(buffer))
+            self.assertEqual(90_000, buffer.first)
+            self.assertEqual("line 90000 ñ", buffer[0])
+            self.assertEqual("line 99999 ñ", buffer[-1])
+            self.assertEqual(["line 90010 ñ", "line 90011 ñ"], buffer[10:12])
+            self.assertEqual([f"line {i} ñ" for i in range(90_000, 100_000)], list(buffer))
+            self.assertEqual(5_000, len(buffer.command_lines("odd")))
+            self.assertEqual("line 90100 ñ", buffer.line(buffer.command_lines("odd")[0]))
+            with self.assertRaises(IndexError):
+                buffer.line(0)
+            buffer.clear()
+            self.assertEqual(0, len(buffer))
+            buffer.close()
+
+    def test_compact_empty_lines(self):
+        for spill in (False, True):
+            buffer = LineBuffer(max_lines=10, spill=spill)
+            buffer.append(['x'] * 5_000 + [''] * 10)
+            self.assertEqual([''] * 10, list(buffer))
+            buffer.append(['y'])
+            self.assertEqual('y', buffer[-1])
+            buffer.close()
+
+
+class BufferedLogTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_buffered_log(self):
+        app = LogApp()
+        async with app.run_test() as pilot:
+            event_log = app.query_one(BufferedLog)
+            event_log.write("Preparing:\nfirst")
+            event_log.write(" command\n")
+            event_log.write_lines([f"output {i}" for i in range(5_000)], command="cmd")
+            await pilot.pause()
+            self.assertEqual(1_000, event_log.line_count)
+            self.assertEqual("output 4000", event_log.lines[0])
+            self.assertEqual("output 4999", event_log.lines[-1])
+            self.assertEqual(1_000, len(event_log.buffer.command_lines("cmd")))
+            self.assertEqual(event_log.max_scroll_y, event_log.scroll_y)
+            last = event_log.render_line(event_log.scrollable_content_region.height - 1)
+            self.assertIn("output 4999", last.text)
+            event_log.clear()
+            self.assertEqual(0, event_log.line_count)
+            await pilot.press("q")
+
+
+if __name__ == '__main__':
+    unittest.main()
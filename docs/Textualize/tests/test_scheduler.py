@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+from kodegeek_textualize.scheduler import CommandScheduler, Status
+
+
+class SchedulerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_limits_and_priorities(self):
+        running = 0
+        peak = 0
+        started = []
+
+        async def runner(cmd: str) -> int:
+            nonlocal running, peak
+            started.append(cmd)
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return 0
+
+        scheduler = CommandScheduler(runner, max_parallel=2)
+        for i in range(6):
+            scheduler.submit(f"cmd{i}")
+        scheduler.submit("urgent", priority=-1)
+        jobs = await scheduler.run()
+        self.assertEqual(2, peak)
+        self.assertEqual("urgent", started[0])
+        self.assertEqual([f"cmd{i}" for i in range(6)], started[1:])
+        self.assertTrue(all(job.status == Status.SUCCEEDED for job in jobs))
+
+    async def test_failures_and_timeouts(self):
+        async def runner(cmd: str) -> int:
+            if cmd == "slow":
+                await asyncio.sleep(10)
+            if cmd == "broken":
+                raise ValueError("broken")
+            return 0 if cmd == "ok" else 2
+
+        scheduler = CommandScheduler(runner, max_parallel=4)
+        ok = scheduler.submit("ok")
+        failed = scheduler.submit("false")
+        broken = scheduler.submit("broken")
+        slow = scheduler.submit("slow", timeout=0.05)
+        await scheduler.run()
+        self.assertEqual(Status.SUCCEEDED, ok.status)
+        self.assertEqual(Status.FAILED, failed.status)
+        self.assertEqual(2, failed.returncode)
+        self.assertEqual(Status.FAILED, broken.status)
+        self.assertEqual("broken", broken.error)
+        self.assertEqual(Status.TIMED_OUT, slow.status)
+        self.assertTrue(scheduler.done)
+
+    async def test_cancel(self):
+        async def runner(_: str) -> int:
+            await asyncio.sleep(10)
+            return 0
+
+        scheduler = CommandScheduler(runner, max_parallel=1)
+        first = scheduler.submit("first")
+        second = scheduler.submit("second")
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.01)
+        scheduler.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(Status.CANCELLED, first.status)
+        self.assertEqual(Status.CANCELLED, second.status)
+
+
+if __name__ == '__main__':
+    unittest.main()
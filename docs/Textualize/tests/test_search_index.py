@@ -0,0 +1,58 @@
+import unittest
+from textual.fuzzy import Matcher
+from kodegeek_textualize.columnar_table import ColumnarTable
+from kodegeek_textualize.search_index import SearchIndex
+from kodegeek_textualize.table_with_detail_screen import CompetitorsApp
+
+
+def search(index: SearchIndex, query: str, limit: int = 20):
+    return [key for _, key in index.search(query, Matcher(query).match, limit=limit)]
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    def test_search(self):
+        index = SearchIndex()
+        index.add_all(enumerate(["Manuela", "Mariana", "Wai", "Amanda", "Emmanuel"]))
+        self.assertEqual([0, 3, 4, 1], search(index, "man"))  # Contiguous matches first
+        self.assertEqual({0, 1, 3}, set(search(index, "mna")))  # Fuzzy matches
+        self.assertEqual([], search(index, "xyz"))
+        self.assertEqual(2, len(search(index, "a", limit=2)))
+
+    def test_updates(self):
+        index = SearchIndex()
+        index.add("a", "Manuela")
+        index.add("b", "Fabio")
+        index.remove("a")
+        self.assertEqual([], search(index, "manu"))
+        index.add("b", "Manuel")
+        self.assertEqual(["b"], search(index, "manu"))
+        self.assertEqual([], search(index, "fabio"))
+        for i in range(5_000):
+            index.add(i, f"runner {i}")
+        for i in range(4_990):
+            index.remove(i)
+        self.assertEqual(11, len(index))
+        self.assertLess(len(index.keys), 5_000)  # Holes were reclaimed
+        self.assertEqual([4_995], search(index, "runner 4995"))
+
+
+class PaletteSearchTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_table_index(self):
+        app = CompetitorsApp()
+        async with app.run_test() as pilot:
+            table = app.query_one(ColumnarTable)
+            index = table.search_index("name")
+            self.assertIs(index, table.search_index("name"))
+            new_row = table.add_row("Gold", "Manu", "F", "ESP", 7)
+            self.assertEqual(2, len(search(index, "manu")))
+            table.update_cell(new_row, "name", "Ana")
+            self.assertEqual(new_row, search(index, "ana")[0])
+            table.remove_row(new_row)
+            self.assertNotIn(new_row, search(index, "ana"))
+            table.remove_row(table.store.row_keys[0])
+            self.assertEqual({row_key: i for i, row_key in enumerate(table.store.row_keys)}, table.store.positions)
+            await pilot.press("q")
+
+
+if __name__ == '__main__':
+    unittest.main()
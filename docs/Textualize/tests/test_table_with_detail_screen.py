@@ -1,5 +1,6 @@
 import unittest
 from textual.widgets import DataTable, MarkdownViewer
+from kodegeek_textualize.columnar_table import ColumnarTable
 from kodegeek_textualize.table_with_detail_screen import CompetitorsApp
 
 
@@ -33,6 +34,27 @@ class TableWithDetailTestCase(unittest.IsolatedAsyncioTestCase):
             # Quit the app by pressing q
             await pilot.press("q")
 
+    async def test_sort(self):
+        app = CompetitorsApp()
+        async with app.run_test() as pilot:
+            table = app.screen.query_one(ColumnarTable)
+            age = table.ordered_columns[4].key
+            # Each sort on the same column flips the direction, ages are sorted as numbers
+            table.sort(age, reverse=table.sort_reverse(age.value))
+            self.assertEqual([22, 25, 30, 99], [table.get_row_at(i)[4] for i in range(table.row_count)])
+            table.sort(age, reverse=table.sort_reverse(age.value))
+            self.assertEqual([99, 30, 25, 22], [table.get_row_at(i)[4] for i in range(table.row_count)])
+            table.add_row("Gold", "Ana", "F", "ESP", 7)
+            table.sort(age)
+            self.assertEqual("Ana", table.get_row_at(0)[1])
+            # An update patches the memoized permutation instead of dropping it
+            column = table.store.columns[age]
+            table.update_cell(table.store.row_keys[0], age, 100)
+            self.assertIsNotNone(column.order)
+            table.sort(age)
+            self.assertEqual([7, 25, 30, 99, 100], [table.get_row_at(i)[4] for i in range(table.row_count)])
+            await pilot.press("q")
+
 
 if __name__ == '__main__':
     unittest.main()
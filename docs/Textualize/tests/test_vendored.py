@@ -0,0 +1,39 @@
+"""
+Some modules are shared with the grocery_stores_ct package. The canonical copies live there,
+the ones here must stay identical.
+"""
+import unittest
+from pathlib import Path
+
+import textual
+
+from kodegeek_textualize import columnar_table
+from kodegeek_textualize.textual_compat import missing_internals
+
+PACKAGE = Path(columnar_table.__file__).parent
+CANONICAL = (
+    PACKAGE.parents[1] / "Enhancing_Your_Python_Workflow_with_UV_on_Fedora" / "grocery_stores" / "src"
+    / "grocery_stores_ct"
+)
+VENDORED = ("column_store.py", "instrumentation.py", "textual_compat.py")
+
+
+class VendoredTestCase(unittest.TestCase):
+
+    def test_same_as_canonical(self):
+        if not CANONICAL.is_dir():
+            self.skipTest(f"No canonical copies on {CANONICAL}")
+        for name in VENDORED:
+            with self.subTest(name=name):
+                self.assertEqual(
+                    (CANONICAL / name).read_text(), (PACKAGE / name).read_text(),
+                    f"{name} differs from the canonical copy, copy {CANONICAL / name} over it"
+                )
+
+    def test_datatable_internals(self):
+        table = columnar_table.ColumnarTable()
+        self.assertEqual([], missing_internals(table), f"Textual {textual.__version__}")
+
+
+if __name__ == '__main__':
+    unittest.main()
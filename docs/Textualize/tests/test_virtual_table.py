@@ -0,0 +1,119 @@
+import csv
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from textual.widgets import Input, MarkdownViewer
+
+from kodegeek_textualize import data_sources
+from kodegeek_textualize.data_sources import ColumnarSource, CsvSource, SqliteSource
+from kodegeek_textualize.table_with_detail_screen import CompetitorsApp, MY_DATA
+from kodegeek_textualize.virtual_table import VirtualTable
+
+HEADER = MY_DATA[0]
+ROWS = MY_DATA[1:] + [("Gold", "Ana, Jr", "F", "ESP", 7)]
+
+
+class DataSourcesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        path = Path(self.directory.name)
+        self.csv = path / "competitors.csv"
+        with open(self.csv, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(HEADER)
+            writer.writerows(ROWS)
+        self.sqlite = path / "competitors.db"
+        with sqlite3.connect(self.sqlite) as connection:
+            connection.execute("CREATE TABLE competitors(level, name, gender, country, age INTEGER)")
+            connection.executemany("INSERT INTO competitors VALUES (?, ?, ?, ?, ?)", ROWS)
+
+    def sources(self):
+        yield ColumnarSource.from_rows(HEADER, ROWS)
+        yield SqliteSource(self.sqlite, "competitors")
+        yield CsvSource(self.csv)
+
+    def test_rows(self):
+        for source in self.sources():
+            with self.subTest(source=type(source).__name__):
+                self.assertEqual(list(HEADER), list(source.columns))
+                self.assertEqual(len(ROWS), len(source))
+                self.assertEqual(["Ryoji", "Fabio"], [str(row[1]) for row in source.rows(1, 2)])
+                self.assertEqual("Ana, Jr", source.rows(len(ROWS) - 1, 10)[0][1])
+                self.assertEqual([], source.rows(len(ROWS), 10))
+                source.close()
+
+    def test_sort_and_filter(self):
+        for source in self.sources():
+            with self.subTest(source=type(source).__name__):
+                source.sort("age")
+                self.assertEqual([7, 22, 25, 30, 99], [int(row[4]) for row in source.rows(0, 10)])
+                source.sort("age", reverse=True)
+                self.assertEqual([99, 30, 25, 22, 7], [int(row[4]) for row in source.rows(0, 10)])
+                # Filters keep the sort, and are case-insensitive
+                source.filter("name", "A")
+                self.assertEqual(["Fabio", "Manuela", "Wai", "Ana, Jr"], [row[1] for row in source.rows(0, 10)])
+                source.filter("name", "")
+                self.assertEqual(len(ROWS), len(source))
+                self.assertEqual(["Manuela"], [row[1] for row in source.search("name", "manu", 5)])
+                source.close()
+
+    def test_csv_blocks(self):
+        # Many small blocks, so rows are found through the sparse index
+        original = data_sources.CSV_BLOCK
+        data_sources.CSV_BLOCK = 32
+        self.addCleanup(setattr, data_sources, "CSV_BLOCK", original)
+        with open(self.csv, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(HEADER)
+            writer.writerows((f"L{i}", f"name{i}", "F", "USA", i) for i in range(1000))
+        source = CsvSource(self.csv)
+        self.assertEqual(1000, len(source))
+        for start in (0, 1, 37, 500, 999):
+            self.assertEqual(f"name{start}", source.rows(start, 1)[0][1])
+        source.close()
+
+
+class VirtualTableTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def test_app(self):
+        rows = [(f"L{i % 5}", f"Name{i:05}", "MF"[i % 2], "USA", i % 90) for i in range(10_000)]
+        app = CompetitorsApp(source=ColumnarSource.from_rows(HEADER, rows))
+        async with app.run_test() as pilot:
+            table = app.query_one(VirtualTable)
+            self.assertEqual(10_000, table.row_count)
+            await pilot.pause()
+            # Only the rows on screen and the prefetch margin were fetched
+            self.assertEqual(1, table.fetches)
+            self.assertLessEqual(len(table.window), table.visible_rows + 2 * table.prefetch)
+
+            await pilot.press("end")
+            await pilot.pause()
+            self.assertEqual(9_999, table.cursor_row)
+            self.assertEqual(2, table.fetches)
+
+            table.sort("age", reverse=table.sort_reverse("age"))
+            self.assertEqual(0, table.get_row(0)[4])
+            table.sort("age", reverse=table.sort_reverse("age"))
+            self.assertEqual(89, table.get_row(0)[4])
+
+            app.query_one(Input).value = "name0000"
+            await pilot.click("#filter")
+            await pilot.press("enter")
+            await pilot.pause()
+            self.assertEqual(10, table.row_count)
+            self.assertEqual(9, table.cursor_row)
+
+            await pilot.press("home", "enter")
+            await pilot.pause()
+            markdown_viewer = app.screen.query(MarkdownViewer).first()
+            self.assertTrue(markdown_viewer.document)
+            await pilot.click("#close")
+            await pilot.press("q")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Build many network diagrams (made with the 'diagrams' module) in one go, listed on a JSON manifest.
+Graphviz only runs when the topology changed: the DOT source of each diagram is hashed, and if a
+rendered image with the same hash is on the cache it is copied instead. Diagrams build on a process pool.
+The scripts must import Diagram with 'from diagrams import Diagram', that name is swapped for a
+subclass that renders through the cache.
+
+Manifest example (paths are relative to the manifest):
+
+[
+    {"script": "PythonDebugger/simple_diagram.py", "function": "generate_diagram",
+     "kwargs": {"diagram_file": "PythonDebugger/airflow_5", "workers_n": 5}},
+    {"script": "SpyOnNfs/scripts/NfsLayout.py", "function": "diagram", "args": ["SpyOnNfs/NfsLayout"]}
+]
+
+Author Jose Vicente Nunez (kodegeek.com@protonmail.com)
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "diagram_build"
+# diagrams names every node with a random UUID, the same topology gets different ids on each run
+# (quoted when the id starts with a digit)
+NODE_ID = re.compile(r'"([0-9a-f]{32})"|\b([0-9a-f]{32})\b')
+
+
+def _node_ids(line: str) -> List[str]:
+    return [quoted or bare for quoted, bare in NODE_ID.findall(line)]
+
+
+def _sorted_statements(lines: Iterator[Tuple[str, bool]]) -> List[str]:
+    """
+    Statements of one graph block, up to its closing brace: attribute statements keep their place
+    (they apply to what follows them), node and edge statements and subgraphs are sorted
+    """
+    fixed: List[str] = []
+    movable: List[str] = []
+    for line, has_nodes in lines:
+        stripped = line.strip()
+        if stripped == "}":
+            return fixed + sorted(movable) + [line]
+        if stripped.endswith("{"):
+            movable.append("\n".join([line] + _sorted_statements(lines)))
+        elif has_nodes:
+            movable.append(line)
+        else:
+            fixed.append(line)
+    return fixed + sorted(movable)
+
+
+def canonical_source(source: str) -> str:
+    """
+    DOT source that only depends on the topology: the random node ids are replaced by names given in
+    the order of what each node looks like (its declaration, the clusters around it and its edges),
+    and the node and edge statements of each graph are sorted, so the order the nodes were created
+    in does not matter either
+    """
+    lines = source.splitlines()
+    appearance = dict.fromkeys(node for line in lines for node in _node_ids(line))
+    looks: Dict[str, str] = dict.fromkeys(appearance, "")
+    clusters: List[str] = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped.endswith("{"):
+            clusters.append(stripped)
+        elif stripped == "}":
+            clusters = clusters[:-1]
+        elif "->" not in stripped and len(_node_ids(stripped)) == 1:
+            looks[_node_ids(stripped)[0]] = " ".join(clusters + [NODE_ID.sub("", stripped)])
+    edges: Dict[str, List[str]] = {node: [] for node in appearance}
+    for line in lines:
+        nodes = _node_ids(line)
+        if "->" in line and len(nodes) == 2:
+            tail, head = nodes
+            attributes = NODE_ID.sub("", line).strip()
+            edges[tail].append(f"{attributes} to {looks[head]}")
+            edges[head].append(f"{attributes} from {looks[tail]}")
+    order = sorted(appearance, key=lambda node: (looks[node], sorted(edges[node])))
+    names = {node: f"n{index}" for index, node in enumerate(order)}
+    renamed = (
+        (NODE_ID.sub(lambda match: names[match.group(1) or match.group(2)], line), bool(_node_ids(line)))
+        for line in lines
+    )
+    return "\n".join(_sorted_statements(renamed))
+
+
+def topology_hash(source: str, outformat: str) -> str:
+    try:
+        diagrams_version = version("diagrams")
+    except PackageNotFoundError:
+        diagrams_version = "unknown"
+    digest = hashlib.sha256()
+    for part in (diagrams_version, outformat, canonical_source(source)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    Rendered images by topology hash. Scripts built by this module get a Diagram subclass whose
+    render goes through the cache, the diagrams library itself is left alone.
+    """
+
+    def __init__(self, directory: Path = CACHE_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def diagram_class(self):
+        """
+        diagrams.Diagram, rendering through this cache
+        """
+        from diagrams import Diagram
+        cache = self
+
+        class CachedDiagram(Diagram):
+
+            def render(self) -> None:
+                cache.render(self, super().render)
+
+        return CachedDiagram
+
+    def wrap(self, module) -> int:
+        """
+        Point the names a script module bound to diagrams.Diagram ('from diagrams import Diagram')
+        to diagram_class()
+        :return: How many names were replaced
+        """
+        from diagrams import Diagram
+        names = [name for name, value in vars(module).items() if value is Diagram]
+        cached_diagram = self.diagram_class()
+        for name in names:
+            setattr(module, name, cached_diagram)
+        return len(names)
+
+    def render(self, diagram, render: Callable[[], None]) -> None:
+        """
+        Copy the images of the diagram from the cache, or call render and keep what it wrote
+        """
+        formats = diagram.outformat if isinstance(diagram.outformat, list) else [diagram.outformat]
+        source = diagram.dot.source
+        cached = [(self.directory / f"{topology_hash(source, outformat)}.{outformat}", outformat) for outformat in formats]
+        if all(path.exists() for path, _ in cached):
+            self.hits += 1
+            for path, outformat in cached:
+                shutil.copyfile(path, f"{diagram.filename}.{outformat}")
+            # Diagram.__exit__ removes the DOT file that Graphviz would have written
+            Path(diagram.filename).write_text(source)
+            return
+        self.misses += 1
+        render()
+        for path, outformat in cached:
+            # Write and rename, so a parallel build never sees half an image
+            with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as partial:
+                with open(f"{diagram.filename}.{outformat}", "rb") as rendered:
+                    shutil.copyfileobj(rendered, partial)
+            os.replace(partial.name, path)
+
+
+def load_module(script: Path):
+    spec = importlib.util.spec_from_file_location(f"diagram_{hashlib.sha1(str(script).encode()).hexdigest()}", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_one(entry: Dict[str, Any], base: Path, cache_dir: Path) -> Dict[str, Any]:
+    """
+    Build one diagram of the manifest, from the manifest directory
+    """
+    started = time.perf_counter()
+    os.chdir(base)
+    module = load_module(base / entry["script"])
+    cache = RenderCache(cache_dir)
+    if not cache.wrap(module):
+        print(f"{entry['script']} does not use 'from diagrams import Diagram', rendering without the cache", file=sys.stderr)
+    getattr(module, entry["function"])(*entry.get("args", []), **entry.get("kwargs", {}))
+    return {
+        "script": entry["script"],
+        "args": entry.get("args", []),
+        "kwargs": entry.get("kwargs", {}),
+        "cached": cache.hits > 0 and cache.misses == 0,
+        "seconds": time.perf_counter() - started
+    }
+
+
+def build_all(manifest: Path, workers: int, cache_dir: Path = CACHE_DIR) -> List[Dict[str, Any]]:
+    with open(manifest, "r") as manifest_file:
+        entries = json.load(manifest_file)
+    base = manifest.resolve().parent
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(build_one, entry, base, cache_dir) for entry in entries]
+        for future in as_completed(futures):
+            result = future.result()
+            print(
+                f"{'cached' if result['cached'] else 'rendered':<8} {result['seconds']:6.2f}s "
+                f"{result['script']} {result['args']} {result['kwargs']}"
+            )
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument("manifest", type=Path, help="JSON list of diagrams to build")
+    PARSER.add_argument("--workers", type=int, default=os.cpu_count(), help="Diagrams built at the same time")
+    PARSER.add_argument("--cache_dir", type=Path, default=CACHE_DIR, help="Where rendered images are kept")
+    PARSER.add_argument("--clear_cache", action="store_true", default=False, help="Render everything again")
+    ARGS = PARSER.parse_args()
+    if ARGS.clear_cache:
+        shutil.rmtree(ARGS.cache_dir, ignore_errors=True)
+    STARTED = time.perf_counter()
+    RESULTS = build_all(ARGS.manifest, ARGS.workers, ARGS.cache_dir)
+    HITS = sum(result["cached"] for result in RESULTS)
+    print(f"{len(RESULTS)} diagrams, {HITS} from cache, {time.perf_counter() - STARTED:.2f}s", file=sys.stderr)
@@ -0,0 +1,602 @@
+#!/usr/bin/env python3
+"""
+Runner for the NPB (NAS Parallel Benchmarks) Java kernels, replaces the testAllS and testAllW wrappers.
+Runs a matrix of kernels, classes and thread counts, each run pinned to its own CPUs and as many at the
+same time as the CPUs allow. Results are kept on a SQLite history, and runs that got slower than before are flagged.
+Runs that shared the host with other runs compete for memory bandwidth and cache, so each run is only compared
+with previous runs that were alone too, or that shared the host too.
+With --samples each configuration repeats, after some warmup runs, until the confidence interval of its Mop/s is
+tight enough or its time budget runs out. Speedup and parallel efficiency across thread counts can be exported.
+
+./npb_runner.py --kernels MG CG --classes S W --threads 1 2 4
+./npb_runner.py --kernels MG --threads 1 2 4 --samples 5 30 --warmup 1 --budget 300 --scaling scaling.csv
+./npb_runner.py --analyze --scaling scaling.json
+Author: kodegeek.com@protonmail.com
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import re
+import shlex
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, Dict, Iterable, List, Optional, Set, Tuple
+
+KERNELS = ("MG", "CG", "BT", "SP", "LU", "FT", "IS")
+CLASSES = ("S", "W", "A", "B", "C")
+# Like the wrappers, these kernels get a bigger heap from class W up. The wrappers stopped at W, the heaps of
+# the bigger classes are sized from their arrays with room to spare (FT keeps three complex grids of the problem)
+JVM_HEAP = {
+    "CG": {"W": "200M", "A": "512M", "B": "1G", "C": "2G"},
+    "FT": {"W": "200M", "A": "1G", "B": "3G", "C": "12G"}
+}
+JVM_OPTIONS = {(kernel, clss): [f"-mx{heap}"] for kernel, heaps in JVM_HEAP.items() for clss, heap in heaps.items()}
+DEFAULT_JAVA_HOME = "/usr/lib/jvm/java-11-openjdk-11.0.12.0.7-4.fc33.x86_64"
+DEFAULT_CLASSPATH = "/usr/lib64/NPB3.0-JAV.jar"
+HISTORY = Path.home() / ".local" / "share" / "npb" / "history.db"
+# Compare with the median of this many previous runs (the mean Mop/s of each, when it was sampled)
+HISTORY_RUNS = 5
+REGRESSION_THRESHOLD = 0.10
+POLL_INTERVAL = 0.05
+# Half width of the 95% confidence interval, relative to the mean Mop/s, that counts as stable
+CONFIDENCE_WIDTH = 0.05
+# Student's t for a two-sided 95% interval, by degrees of freedom, normal approximation after that
+T_95 = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042
+)
+
+REPORT_FIELDS = {
+    "seconds": re.compile(r"Time in seconds\s*=\s*([0-9.eE+-]+)"),
+    "mops": re.compile(r"Mops?(?:/s)?\s+total\s*=\s*([0-9.eE+-]+)", re.IGNORECASE),
+    "verification": re.compile(r"Verification\s*=\s*(\S+)")
+}
+
+
+@dataclass(frozen=True)
+class Config:
+    kernel: str
+    clss: str
+    threads: int
+
+    def arguments(self) -> List[str]:
+        return [f"NPB3_0_JAV.{self.kernel}", "-serial" if self.threads == 1 else f"-np{self.threads}", f"CLASS={self.clss}"]
+
+
+@dataclass
+class NpbResult:
+    config: Config
+    returncode: int
+    seconds: Optional[float]
+    mops: Optional[float]
+    verification: str
+    cpus: str
+    wall: float
+    output: str = ""
+    warmup: bool = False
+    # Another run was going on at the same time, on other CPUs of the host
+    shared: bool = False
+
+    @property
+    def successful(self) -> bool:
+        return self.returncode == 0 and self.verification == "SUCCESSFUL"
+
+
+def parse_report(output: str) -> Dict[str, Optional[str]]:
+    """
+    Time, Mop/s and verification from the report NPB prints at the end of a run
+    """
+    values = {}
+    for name, pattern in REPORT_FIELDS.items():
+        found = pattern.findall(output)
+        values[name] = found[-1] if found else None
+    return values
+
+
+def default_command() -> List[str]:
+    java_home = os.environ.get("JAVA_HOME", DEFAULT_JAVA_HOME)
+    classpath = os.environ.get("NPB_CLASSPATH", DEFAULT_CLASSPATH)
+    return [os.path.join(java_home, "bin", "java"), "-classpath", classpath]
+
+
+def build_command(prefix: List[str], config: Config) -> List[str]:
+    return prefix + JVM_OPTIONS.get((config.kernel, config.clss), []) + config.arguments()
+
+
+def t_95(degrees: int) -> float:
+    return T_95[degrees - 1] if degrees <= len(T_95) else 1.96
+
+
+@dataclass
+class Samples:
+    """
+    Measured runs of one configuration
+    """
+    config: Config
+    mops: List[float] = field(default_factory=list)
+    seconds: List[float] = field(default_factory=list)
+    failures: int = 0
+    warmups: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def mean(self) -> Optional[float]:
+        return statistics.mean(self.mops) if self.mops else None
+
+    def half_width(self) -> Optional[float]:
+        """
+        Half width of the 95% confidence interval of the mean Mop/s, None with less than two samples
+        """
+        if len(self.mops) < 2:
+            return None
+        return t_95(len(self.mops) - 1) * statistics.stdev(self.mops) / math.sqrt(len(self.mops))
+
+    def stable(self, width: float) -> bool:
+        half_width = self.half_width()
+        return half_width is not None and self.mean > 0 and half_width / self.mean <= width
+
+
+class Sampler:
+    """
+    Decides if a configuration runs again: warmup runs are thrown away, then it repeats until there are at
+    least min_samples and the confidence interval is within width, max_samples, or the budget (seconds spent
+    running it, warmup included) runs out. A failed run stops the configuration.
+    """
+
+    def __init__(
+            self,
+            min_samples: int = 1,
+            max_samples: int = 1,
+            warmup: int = 0,
+            width: float = CONFIDENCE_WIDTH,
+            budget: Optional[float] = None
+    ):
+        self.min_samples = min_samples
+        self.max_samples = max(min_samples, max_samples)
+        self.warmup = warmup
+        self.width = width
+        self.budget = budget
+        self.samples: Dict[Config, Samples] = {}
+
+    def add(self, result: NpbResult) -> bool:
+        """
+        Keep the result, marking it when it is a warmup run
+        :return: True if the configuration needs another run
+        """
+        samples = self.samples.setdefault(result.config, Samples(result.config))
+        samples.elapsed += result.wall
+        if not result.successful or result.mops is None:
+            samples.failures += 1
+            return False
+        if samples.warmups < self.warmup:
+            samples.warmups += 1
+            result.warmup = True
+            return True
+        samples.mops.append(result.mops)
+        samples.seconds.append(result.seconds if result.seconds is not None else result.wall)
+        if len(samples.mops) >= self.max_samples:
+            return False
+        if self.budget is not None and samples.elapsed >= self.budget:
+            return False
+        return len(samples.mops) < self.min_samples or not samples.stable(self.width)
+
+
+@dataclass
+class RunningProcess:
+    process: subprocess.Popen
+    config: Config
+    assigned: List[int]
+    output: IO[str]
+    started: float
+    shared: bool = False
+
+
+class Runner:
+    """
+    Starts each configuration once enough CPUs are free, pinned to them. Children are polled from a single
+    thread, so setting the CPU affinity between fork and exec is safe. With a sampler, configurations go back
+    to the queue until the sampler has enough runs of them.
+    """
+
+    def __init__(
+            self,
+            command: List[str],
+            cpus: Optional[Set[int]] = None,
+            exclusive: bool = False,
+            sampler: Optional[Sampler] = None
+    ):
+        self.command = command
+        self.cpus = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+        self.exclusive = exclusive
+        self.sampler = sampler
+
+    def run(self, configs: Iterable[Config], on_result=None) -> List[NpbResult]:
+        pending = list(configs)
+        free = list(self.cpus)
+        running = []
+        results = []
+        while pending or running:
+            # First fit, in order, so the matrix order is kept as much as possible
+            for config in list(pending):
+                if self.exclusive and running:
+                    break
+                wanted = min(config.threads, len(self.cpus))
+                if self.exclusive:
+                    wanted = len(self.cpus)
+                if wanted > len(free):
+                    continue
+                assigned, free = free[:wanted], free[wanted:]
+                pending.remove(config)
+                try:
+                    started = self._start(config, assigned)
+                except OSError as os_error:
+                    # Missing or not executable (bad JAVA_HOME or --command), failed like the shell would report it
+                    free = sorted(free + assigned)
+                    self._finish(self._result(config, 127, str(os_error), assigned, 0.0), pending, results, on_result)
+                    continue
+                if running:
+                    started.shared = True
+                    for run in running:
+                        run.shared = True
+                running.append(started)
+            time.sleep(POLL_INTERVAL)
+            for run in list(running):
+                if run.process.poll() is None:
+                    continue
+                running.remove(run)
+                free = sorted(free + run.assigned)
+                run.output.seek(0)
+                text = run.output.read()
+                run.output.close()
+                wall = time.monotonic() - run.started
+                result = self._result(run.config, run.process.returncode, text, run.assigned, wall)
+                result.shared = run.shared
+                self._finish(result, pending, results, on_result)
+        return results
+
+    def _start(self, config: Config, assigned: List[int]) -> RunningProcess:
+        output = tempfile.TemporaryFile("w+")
+        try:
+            process = subprocess.Popen(
+                build_command(self.command, config),
+                stdout=output,
+                stderr=subprocess.STDOUT,
+                text=True,
+                preexec_fn=lambda: os.sched_setaffinity(0, assigned)
+            )
+        except OSError:
+            output.close()
+            raise
+        return RunningProcess(process, config, assigned, output, time.monotonic())
+
+    def _finish(self, result: NpbResult, pending: List[Config], results: List[NpbResult], on_result) -> None:
+        if self.sampler and self.sampler.add(result):
+            pending.append(result.config)
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    @staticmethod
+    def _result(config: Config, returncode: int, output: str, assigned: List[int], wall: float) -> NpbResult:
+        report = parse_report(output)
+        return NpbResult(
+            config=config,
+            returncode=returncode,
+            seconds=float(report["seconds"]) if report["seconds"] else None,
+            mops=float(report["mops"]) if report["mops"] else None,
+            verification=report["verification"] or "MISSING",
+            cpus=",".join(map(str, assigned)),
+            wall=wall,
+            output=output
+        )
+
+
+class History:
+    """
+    Results of every run, by host, to compare new runs with the previous ones
+    """
+
+    def __init__(self, path: Path = HISTORY):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                batch TEXT NOT NULL,
+                started REAL NOT NULL,
+                host TEXT NOT NULL,
+                kernel TEXT NOT NULL,
+                class TEXT NOT NULL,
+                threads INTEGER NOT NULL,
+                seconds REAL,
+                mops REAL,
+                verification TEXT,
+                returncode INTEGER,
+                cpus TEXT,
+                shared INTEGER
+            )
+        """)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(runs)")}
+        if "shared" not in columns:
+            # Older histories did not record it, their runs are never used as a baseline
+            self.connection.execute("ALTER TABLE runs ADD COLUMN shared INTEGER")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS runs_config ON runs (host, kernel, class, threads, started)")
+        self.host = socket.gethostname()
+
+    def previous_mops(self, config: Config, before: str, shared: bool, limit: int = HISTORY_RUNS) -> List[float]:
+        """
+        Mean Mop/s of the configuration on the latest batches, counting only the runs that shared the host
+        with other runs, or only the ones that did not
+        """
+        rows = self.connection.execute(
+            """
+            SELECT AVG(mops) FROM runs
+            WHERE host = ? AND kernel = ? AND class = ? AND threads = ? AND batch != ? AND shared = ?
+              AND verification = 'SUCCESSFUL' AND mops IS NOT NULL
+            GROUP BY batch ORDER BY MAX(started) DESC LIMIT ?
+            """,
+            (self.host, config.kernel, config.clss, config.threads, before, int(shared), limit)
+        )
+        return [row[0] for row in rows]
+
+    def last_batch(self) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT batch FROM runs WHERE host = ? ORDER BY started DESC LIMIT 1", (self.host,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def samples(self, batch: str) -> List[Samples]:
+        """
+        Runs of a batch, by configuration, to analyze them again without running anything
+        """
+        by_config: Dict[Config, Samples] = {}
+        rows = self.connection.execute(
+            """
+            SELECT kernel, class, threads, seconds, mops, verification, returncode FROM runs
+            WHERE batch = ? ORDER BY started
+            """,
+            (batch,)
+        )
+        for kernel, clss, threads, seconds, mops, verification, returncode in rows:
+            config = Config(kernel, clss, threads)
+            samples = by_config.setdefault(config, Samples(config))
+            if returncode == 0 and verification == "SUCCESSFUL" and mops is not None and seconds is not None:
+                samples.mops.append(mops)
+                samples.seconds.append(seconds)
+                samples.elapsed += seconds
+            else:
+                samples.failures += 1
+        return list(by_config.values())
+
+    def add(self, batch: str, result: NpbResult) -> None:
+        with self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO runs (
+                    batch, started, host, kernel, class, threads, seconds, mops, verification, returncode, cpus, shared
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    batch, time.time(), self.host, result.config.kernel, result.config.clss, result.config.threads,
+                    result.seconds, result.mops, result.verification, result.returncode, result.cpus, int(result.shared)
+                )
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+def slower(mops: Optional[float], previous: List[float], threshold: float = REGRESSION_THRESHOLD) -> Optional[str]:
+    """
+    Why Mop/s look worse than the previous runs of the same configuration, None if they do not
+    """
+    if previous and mops is not None:
+        baseline = statistics.median(previous)
+        if mops < baseline * (1 - threshold):
+            return f"{mops:.2f} Mop/s is {(1 - mops / baseline):.0%} below the median of {len(previous)} runs ({baseline:.2f})"
+    return None
+
+
+def regression(result: NpbResult, previous: List[float], threshold: float = REGRESSION_THRESHOLD) -> Optional[str]:
+    if not result.successful:
+        return f"failed (exit code {result.returncode}, verification {result.verification})"
+    return slower(result.mops, previous, threshold)
+
+
+def scaling(samples: Iterable[Samples], width: float = CONFIDENCE_WIDTH) -> List[Dict]:
+    """
+    Speedup and parallel efficiency of each kernel and class across thread counts, from the mean time of the
+    runs. The baseline is the serial run, or the fewest threads measured: efficiency is then relative to it.
+    """
+    by_kernel: Dict[Tuple[str, str], List[Samples]] = {}
+    for sample in samples:
+        if sample.mops:
+            by_kernel.setdefault((sample.config.kernel, sample.config.clss), []).append(sample)
+    rows = []
+    for (kernel, clss), measured in sorted(by_kernel.items()):
+        measured.sort(key=lambda sample: sample.config.threads)
+        base = measured[0]
+        base_seconds = statistics.mean(base.seconds)
+        for sample in measured:
+            seconds = statistics.mean(sample.seconds)
+            speedup = base_seconds / seconds if seconds and base_seconds else None
+            half_width = sample.half_width()
+            rows.append({
+                "kernel": kernel,
+                "class": clss,
+                "threads": sample.config.threads,
+                "samples": len(sample.mops),
+                "failures": sample.failures,
+                "mops": round(sample.mean, 3),
+                "mops_ci95": round(half_width, 3) if half_width is not None else None,
+                "stable": sample.stable(width),
+                "seconds": round(seconds, 6),
+                "baseline_threads": base.config.threads,
+                "speedup": round(speedup, 4) if speedup is not None else None,
+                "efficiency": round(speedup * base.config.threads / sample.config.threads, 4) if speedup is not None else None
+            })
+    return rows
+
+
+def export_scaling(rows: List[Dict], path: Path) -> None:
+    """
+    Save the scaling rows as JSON when the file name ends with .json, CSV otherwise
+    """
+    with open(path, "w", newline="") as export:
+        if path.suffix.lower() == ".json":
+            json.dump(rows, export, indent=2)
+        else:
+            writer = csv.DictWriter(export, fieldnames=list(rows[0].keys()) if rows else ["kernel"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def print_scaling(rows: List[Dict]) -> None:
+    for row in rows:
+        ci = f"±{row['mops_ci95']:.2f}" if row["mops_ci95"] is not None else ""
+        print(
+            f"{row['kernel']:<3} class={row['class']} threads={row['threads']:<3} n={row['samples']:<3} "
+            f"mops={row['mops']:10.2f}{ci:<10} {'stable' if row['stable'] else 'noisy ':<6} "
+            + (f"speedup={row['speedup']:6.2f} efficiency={row['efficiency']:6.1%}" if row["speedup"] is not None else "")
+        )
+
+
+def matrix(kernels: Iterable[str], classes: Iterable[str], threads: Iterable[int]) -> List[Config]:
+    return [Config(kernel, clss, count) for clss, kernel, count in itertools.product(classes, kernels, threads)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kernels", nargs="+", choices=KERNELS, default=list(KERNELS))
+    parser.add_argument("--classes", nargs="+", choices=CLASSES, default=["S"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 2], help="1 runs the serial version")
+    parser.add_argument(
+        "--command",
+        help="Command that runs a kernel, instead of $JAVA_HOME/bin/java -classpath $NPB_CLASSPATH (for example a fake for tests)"
+    )
+    parser.add_argument("--cpus", help="CPUs to use, comma separated (default: all the ones this process can use)")
+    parser.add_argument("--exclusive", action="store_true", default=False, help="One run at a time, with all the CPUs")
+    parser.add_argument("--history", type=Path, default=HISTORY, help="SQLite history of the runs")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Mop/s drop flagged as a regression")
+    parser.add_argument("--verbose", action="store_true", default=False, help="Print the NPB output of every run")
+    sampling = parser.add_argument_group("Sampling")
+    sampling.add_argument(
+        "--samples",
+        nargs=2,
+        type=int,
+        metavar=("MIN", "MAX"),
+        default=[1, 1],
+        help="Repeat each configuration at least MIN and at most MAX times, stopping once it is stable"
+    )
+    sampling.add_argument("--warmup", type=int, default=0, help="Runs thrown away before sampling each configuration")
+    sampling.add_argument(
+        "--confidence",
+        type=float,
+        default=CONFIDENCE_WIDTH,
+        help="Stable when the 95%% confidence interval half width is within this fraction of the mean Mop/s"
+    )
+    sampling.add_argument("--budget", type=float, help="Seconds each configuration can run, warmup included")
+    sampling.add_argument(
+        "--scaling",
+        type=Path,
+        help="Save speedup and parallel efficiency by thread count (.json for JSON, CSV otherwise)"
+    )
+    sampling.add_argument(
+        "--analyze",
+        nargs="?",
+        const="latest",
+        metavar="BATCH",
+        help="Do not run anything, show the scaling of a batch on the history (default: the latest one)"
+    )
+    options = parser.parse_args()
+
+    history = History(options.history)
+    if options.analyze:
+        try:
+            batch = history.last_batch() if options.analyze == "latest" else options.analyze
+            samples = history.samples(batch) if batch else []
+        finally:
+            history.close()
+        if not samples:
+            parser.error(f"no runs for batch {options.analyze} on {options.history}")
+        print(f"batch {batch}")
+        rows = scaling(samples, options.confidence)
+        print_scaling(rows)
+        if options.scaling:
+            export_scaling(rows, options.scaling)
+        return
+
+    command = shlex.split(options.command) if options.command else default_command()
+    cpus = {int(cpu) for cpu in options.cpus.split(",")} if options.cpus else None
+    sampler = Sampler(options.samples[0], options.samples[1], options.warmup, options.confidence, options.budget)
+    sampled = sampler.max_samples > 1
+    runner = Runner(command, cpus, options.exclusive, sampler)
+    batch = time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+    flagged = []
+    # Baselines by configuration and by whether the run shared the host
+    previous: Dict[Tuple[Config, bool], List[float]] = {}
+
+    def report(result: NpbResult):
+        if options.verbose:
+            print(result.output)
+        config = result.config
+        key = (config, result.shared)
+        if key not in previous:
+            previous[key] = history.previous_mops(config, batch, result.shared)
+        # Sampled configurations are compared by their mean, once they are done
+        problem = regression(result, previous[key], options.threshold) if not sampled or not result.successful else None
+        if not result.warmup:
+            history.add(batch, result)
+        print(
+            f"{config.kernel:<3} class={config.clss} threads={config.threads:<3} cpus={result.cpus:<12} "
+            f"time={result.seconds if result.seconds is not None else float('nan'):9.3f}s "
+            f"mops={result.mops if result.mops is not None else float('nan'):10.2f} {result.verification}"
+            + (" (shared)" if result.shared else "")
+            + (" (warmup)" if result.warmup else "")
+            + (f"  REGRESSION: {problem}" if problem else "")
+        )
+        if problem:
+            flagged.append(config)
+
+    try:
+        results = runner.run(matrix(options.kernels, options.classes, options.threads), on_result=report)
+    finally:
+        history.close()
+    if sampled:
+        measured: Dict[Tuple[Config, bool], List[float]] = {}
+        for result in results:
+            if result.successful and not result.warmup and result.mops is not None:
+                measured.setdefault((result.config, result.shared), []).append(result.mops)
+        for (config, shared), mops in measured.items():
+            problem = slower(statistics.mean(mops), previous[(config, shared)], options.threshold)
+            if problem:
+                print(
+                    f"{config.kernel:<3} class={config.clss} threads={config.threads:<3}"
+                    f"{' (shared)' if shared else ''} REGRESSION: {problem}"
+                )
+                flagged.append(config)
+    rows = scaling(sampler.samples.values(), options.confidence)
+    if sampled or options.scaling:
+        print(f"batch {batch}")
+        print_scaling(rows)
+    if options.scaling:
+        export_scaling(rows, options.scaling)
+    if flagged:
+        print(f"{len(flagged)} regressions", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
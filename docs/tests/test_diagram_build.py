@@ -0,0 +1,114 @@
+"""
+Cache key and render wrapper of diagram_build.py
+"""
+import importlib.util
+import sys
+import tempfile
+import types
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from diagram_build import NODE_ID, RenderCache, canonical_source, topology_hash  # noqa: E402
+
+HEADER = """digraph demo {
+\tgraph [fontcolor="#2D3436" label=demo rankdir=LR splines=ortho]
+\tnode [fixedsize=true shape=box style=rounded width=1.4]
+\tedge [color="#7B8894"]"""
+
+
+def node_id() -> str:
+    node = uuid.uuid4().hex
+    # Like graphviz, quote the ids that start with a digit
+    return f'"{node}"' if node[0].isdigit() else node
+
+
+def topology(workers=("w0", "w1"), reverse: bool = False, edge_label: str = "x") -> str:
+    """
+    DOT source like the one made by diagrams: a database feeding a cluster of workers, new node ids
+    on every call
+    """
+    database = node_id()
+    ids = {worker: node_id() for worker in workers}
+    order = list(reversed(workers)) if reverse else list(workers)
+    lines = [HEADER, f'\t{database} [label=db image="postgresql.png" shape=none]', "\tsubgraph cluster_workers {",
+             "\t\tgraph [bgcolor=\"#E5F5FD\" label=workers]"]
+    lines += [f'\t\t{ids[worker]} [label={worker} image="airflow.png" shape=none]' for worker in order]
+    lines.append("\t}")
+    lines += [f"\t{database} -> {ids[worker]} [label={edge_label} dir=forward]" for worker in order]
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+class CanonicalSourceTestCase(unittest.TestCase):
+
+    def test_same_topology(self):
+        key = topology_hash(topology(), "png")
+        self.assertEqual(key, topology_hash(topology(), "png"))
+        self.assertEqual(key, topology_hash(topology(reverse=True), "png"))
+        self.assertIsNone(NODE_ID.search(canonical_source(topology())))
+
+    def test_changed_topology(self):
+        key = topology_hash(topology(), "png")
+        self.assertNotEqual(key, topology_hash(topology(workers=("w0", "w1", "w2")), "png"))
+        self.assertNotEqual(key, topology_hash(topology(workers=("w0", "w9")), "png"))
+        self.assertNotEqual(key, topology_hash(topology(edge_label="y"), "png"))
+        self.assertNotEqual(key, topology_hash(topology(), "svg"))
+
+    def test_edges_of_identical_nodes(self):
+        database, first, second = node_id(), node_id(), node_id()
+        nodes = [f"\t{node} [label=worker]" for node in (first, second)]
+        one_edge = "\n".join([HEADER, f"\t{database} [label=db]"] + nodes + [f"\t{database} -> {first}", "}"])
+        other_edge = "\n".join([HEADER, f"\t{database} [label=db]"] + nodes + [f"\t{database} -> {second}", "}"])
+        self_edge = "\n".join([HEADER, f"\t{database} [label=db]"] + nodes + [f"\t{first} -> {second}", "}"])
+        self.assertEqual(canonical_source(one_edge), canonical_source(other_edge))
+        self.assertNotEqual(canonical_source(one_edge), canonical_source(self_edge))
+
+
+def fake_graphviz(dot, format, **_):  # pylint: disable=redefined-builtin
+    """
+    Stands in for graphviz.Digraph.render: writes the DOT file and a placeholder image
+    """
+    Path(dot.filepath).write_text(dot.source)
+    Path(f"{dot.filepath}.{format}").write_bytes(b"image of " + str(dot.filepath).encode())
+
+
+@unittest.skipUnless(importlib.util.find_spec("diagrams"), "Needs the diagrams module")
+class RenderCacheTestCase(unittest.TestCase):
+
+    def test_wrap(self):
+        import diagrams  # pylint: disable=import-outside-toplevel
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(Path(directory) / "cache")
+            script = types.ModuleType("script")
+            script.Diagram = diagrams.Diagram
+            script.Cluster = diagrams.Cluster
+            self.assertEqual(1, cache.wrap(script))
+            self.assertIsNot(diagrams.Diagram, script.Diagram)
+            self.assertTrue(issubclass(script.Diagram, diagrams.Diagram))
+            self.assertIs(diagrams.Cluster, script.Cluster)
+
+    def test_hit(self):
+        from diagrams.onprem.workflow import Airflow  # pylint: disable=import-outside-toplevel
+        with tempfile.TemporaryDirectory() as directory:
+            cache = RenderCache(Path(directory) / "cache")
+            cached_diagram = cache.diagram_class()
+            with mock.patch("graphviz.Digraph.render", autospec=True, side_effect=fake_graphviz) as graphviz:
+                for name, labels in (("first", ("a", "b")), ("second", ("b", "a")), ("third", ("a", "c"))):
+                    filename = str(Path(directory) / name)
+                    with cached_diagram("Workers", filename=filename, show=False):
+                        for label in labels:
+                            Airflow(label)
+                    self.assertTrue(Path(f"{filename}.png").exists())
+            self.assertEqual((1, 2), (cache.hits, cache.misses))
+            self.assertEqual(2, graphviz.call_count)
+            self.assertEqual(
+                (Path(directory) / "first.png").read_bytes(), (Path(directory) / "second.png").read_bytes()
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
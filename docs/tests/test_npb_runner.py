@@ -0,0 +1,266 @@
+"""
+Report parsing, history and regression checks of npb_runner.py, with a fake NPB kernel
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from npb_runner import (  # noqa: E402
+    Config, History, NpbResult, Runner, Sampler, Samples, parse_report, scaling, slower, t_95
+)
+
+RUNNER = Path(__file__).parents[1] / "npb_runner.py"
+REPORT = """
+ ***** NAS Parallel Benchmarks Java version (NPB3_0_JAV) MG *****
+ MG Benchmark Completed
+ Class           =                        S
+ Size            =               32x 32x 32
+ Time in seconds =                    0.125
+ Mop/s total     =                  1234.50
+ Operation type  =           floating point
+ Verification    =               SUCCESSFUL
+"""
+# Prints a report like the NPB kernels, Mop/s from FAKE_MOPS
+FAKE_NPB = textwrap.dedent("""
+    import os
+    import sys
+    import time
+    time.sleep(float(os.environ.get("FAKE_SECONDS", "0.3")))
+    mops = float(os.environ["FAKE_MOPS"])
+    print(f" {sys.argv[1]} Class = {sys.argv[-1][6:]}")
+    print(f" Time in seconds = {100 / mops:.4f}")
+    print(f" Mop/s total = {mops:.2f}")
+    print(" Verification = SUCCESSFUL")
+""")
+
+
+def result(mops: float, config: Config = Config("MG", "S", 1), shared: bool = False, wall: float = 0.1) -> NpbResult:
+    return NpbResult(config, 0, 100 / mops, mops, "SUCCESSFUL", "0", wall, shared=shared)
+
+
+def failed(config: Config = Config("MG", "S", 1), wall: float = 0.1) -> NpbResult:
+    return NpbResult(config, 1, None, None, "MISSING", "0", wall)
+
+
+class ParseReportTestCase(unittest.TestCase):
+
+    def test_report(self):
+        self.assertEqual(
+            {"seconds": "0.125", "mops": "1234.50", "verification": "SUCCESSFUL"}, parse_report(REPORT)
+        )
+
+    def test_missing(self):
+        self.assertEqual(
+            {"seconds": None, "mops": None, "verification": None},
+            parse_report("Exception in thread \"main\" java.lang.OutOfMemoryError: Java heap space")
+        )
+
+    def test_last_value(self):
+        report = parse_report(REPORT + " Mops total = 99.0\n Verification = UNSUCCESSFUL\n")
+        self.assertEqual("99.0", report["mops"])
+        self.assertEqual("UNSUCCESSFUL", report["verification"])
+
+
+class RegressionTestCase(unittest.TestCase):
+
+    def test_slower(self):
+        self.assertIsNone(slower(91.0, [100.0, 95.0, 105.0], 0.10))
+        self.assertIn("below the median of 3 runs (100.00)", slower(89.0, [100.0, 95.0, 105.0], 0.10))
+        self.assertIsNone(slower(10.0, [], 0.10))
+        self.assertIsNone(slower(None, [100.0], 0.10))
+
+    def test_previous_mops(self):
+        config = Config("MG", "S", 1)
+        with tempfile.TemporaryDirectory() as directory:
+            history = History(Path(directory) / "history.db")
+            try:
+                for batch, mops in enumerate((100.0, 200.0, 300.0, 400.0)):
+                    history.add(f"b{batch}", result(mops))
+                history.add("b1", result(600.0))
+                history.add("b3", result(10.0, shared=True))
+                history.add("b3", result(10.0, Config("MG", "S", 2)))
+                history.add("b3", failed())
+                # Newest batch first, mean of each batch, the batch being run left out
+                self.assertEqual([400.0, 300.0, 100.0], history.previous_mops(config, "b3", shared=False))
+                self.assertEqual([400.0, 300.0], history.previous_mops(config, "b3", shared=False, limit=2))
+                self.assertEqual([10.0], history.previous_mops(config, "b0", shared=True))
+            finally:
+                history.close()
+
+
+class SamplerTestCase(unittest.TestCase):
+
+    def test_single_run(self):
+        sampler = Sampler()
+        self.assertFalse(sampler.add(result(100.0)))
+        self.assertEqual([100.0], sampler.samples[Config("MG", "S", 1)].mops)
+
+    def test_warmup(self):
+        sampler = Sampler(min_samples=2, max_samples=5, warmup=2)
+        warmups = [result(10.0), result(20.0)]
+        self.assertEqual([True, True], [sampler.add(run) for run in warmups])
+        self.assertEqual([True, True], [run.warmup for run in warmups])
+        samples = sampler.samples[Config("MG", "S", 1)]
+        self.assertEqual(([], 2), (samples.mops, samples.warmups))
+        measured = result(100.0)
+        self.assertTrue(sampler.add(measured))
+        self.assertFalse(measured.warmup)
+        self.assertEqual([100.0], samples.mops)
+        self.assertAlmostEqual(0.3, samples.elapsed)
+
+    def test_stable(self):
+        sampler = Sampler(min_samples=3, max_samples=30, width=0.05)
+        # Tight from the start, but at least min_samples runs
+        self.assertEqual([True, True, False], [sampler.add(result(mops)) for mops in (100.0, 101.0, 100.5)])
+        samples = sampler.samples[Config("MG", "S", 1)]
+        self.assertTrue(samples.stable(0.05))
+        self.assertLessEqual(samples.half_width() / samples.mean, 0.05)
+
+    def test_noisy(self):
+        sampler = Sampler(min_samples=2, max_samples=30, width=0.05)
+        self.assertEqual([True, True], [sampler.add(result(mops)) for mops in (100.0, 150.0)])
+        self.assertFalse(sampler.samples[Config("MG", "S", 1)].stable(0.05))
+        # Settles around 125: the interval shrinks as runs come in
+        needed = 2
+        while sampler.add(result(125.0)):
+            needed += 1
+        self.assertTrue(sampler.samples[Config("MG", "S", 1)].stable(0.05))
+        self.assertLess(needed, 30)
+
+    def test_max_samples(self):
+        sampler = Sampler(min_samples=2, max_samples=4, width=0.0001)
+        self.assertEqual(
+            [True, True, True, False], [sampler.add(result(mops)) for mops in (100.0, 150.0, 100.0, 150.0)]
+        )
+
+    def test_budget(self):
+        sampler = Sampler(min_samples=2, max_samples=30, warmup=1, budget=25.0)
+        # The warmup counts against the budget
+        runs = [result(mops, wall=10.0) for mops in (50.0, 100.0, 150.0)]
+        self.assertEqual([True, True, False], [sampler.add(run) for run in runs])
+        samples = sampler.samples[Config("MG", "S", 1)]
+        self.assertEqual(([100.0, 150.0], 30.0), (samples.mops, samples.elapsed))
+
+    def test_failure(self):
+        sampler = Sampler(min_samples=3, max_samples=5)
+        self.assertTrue(sampler.add(result(100.0)))
+        self.assertFalse(sampler.add(failed()))
+        unverified = result(100.0)
+        unverified.verification = "UNSUCCESSFUL"
+        self.assertFalse(sampler.add(unverified))
+        samples = sampler.samples[Config("MG", "S", 1)]
+        self.assertEqual(([100.0], 2), (samples.mops, samples.failures))
+        self.assertTrue(sampler.add(result(100.0, Config("CG", "S", 1))))
+
+    def test_t_95(self):
+        self.assertEqual(12.706, t_95(1))
+        self.assertEqual(2.042, t_95(30))
+        self.assertEqual(1.96, t_95(31))
+        samples = Samples(Config("MG", "S", 1), mops=[1.0, 2.0, 3.0])
+        self.assertAlmostEqual(4.303 / 3 ** 0.5, samples.half_width())
+        self.assertIsNone(Samples(Config("MG", "S", 1), mops=[1.0]).half_width())
+
+
+class ScalingTestCase(unittest.TestCase):
+
+    @staticmethod
+    def samples(threads: int, seconds, kernel: str = "MG") -> Samples:
+        return Samples(Config(kernel, "S", threads), mops=[100 / value for value in seconds], seconds=list(seconds))
+
+    def test_scaling(self):
+        rows = scaling([
+            self.samples(4, [5.5, 5.5]),
+            self.samples(1, [10.0, 12.0]),
+            self.samples(2, [6.0]),
+            Samples(Config("MG", "S", 8), failures=1)
+        ])
+        self.assertEqual([1, 2, 4], [row["threads"] for row in rows])
+        self.assertEqual([1, 1, 1], [row["baseline_threads"] for row in rows])
+        self.assertEqual([1.0, round(11 / 6, 4), 2.0], [row["speedup"] for row in rows])
+        self.assertEqual([1.0, round(11 / 12, 4), 0.5], [row["efficiency"] for row in rows])
+        self.assertEqual([2, 1, 2], [row["samples"] for row in rows])
+        self.assertIsNone(rows[1]["mops_ci95"])
+
+    def test_no_serial_run(self):
+        rows = scaling([self.samples(2, [8.0]), self.samples(4, [5.0]), self.samples(1, [3.0], kernel="CG")])
+        self.assertEqual([("CG", 1), ("MG", 2), ("MG", 4)], [(row["kernel"], row["threads"]) for row in rows])
+        mg_4 = rows[2]
+        self.assertEqual((2, 1.6), (mg_4["baseline_threads"], mg_4["speedup"]))
+        # Relative to the 2 thread run
+        self.assertEqual(0.8, mg_4["efficiency"])
+
+
+class FakeKernelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        fake = Path(self.directory.name) / "fake_npb.py"
+        fake.write_text(FAKE_NPB)
+        self.command = f"{sys.executable} {fake}"
+        self.history = Path(self.directory.name) / "history.db"
+
+    def run_batch(self, mops: float, *arguments: str) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, str(RUNNER), "--command", self.command, "--history", str(self.history), *arguments],
+            env={**os.environ, "FAKE_MOPS": str(mops)},
+            capture_output=True,
+            text=True,
+            timeout=120,
+            check=False
+        )
+
+    def test_regression(self):
+        for mops in (1000, 1010, 990):
+            self.assertEqual(0, self.run_batch(mops, "--kernels", "MG", "--threads", "1", "2").returncode)
+        done = self.run_batch(500, "--kernels", "MG", "--threads", "1", "2", "--exclusive")
+        self.assertEqual(1, done.returncode, done.stdout + done.stderr)
+        self.assertIn("REGRESSION: 500.00 Mop/s is 50% below the median of 3 runs (1000.00)", done.stdout)
+        self.assertIn("2 regressions", done.stderr)
+
+    def test_sampled(self):
+        done = self.run_batch(1000, "--kernels", "MG", "--threads", "1", "--samples", "2", "3", "--warmup", "1")
+        self.assertEqual(0, done.returncode, done.stdout + done.stderr)
+        self.assertEqual(1, done.stdout.count("(warmup)"))
+        done = self.run_batch(800, "--kernels", "MG", "--threads", "1", "--samples", "2", "3")
+        self.assertEqual(1, done.returncode, done.stdout + done.stderr)
+        self.assertIn("REGRESSION: 800.00 Mop/s is 20% below the median of 1 runs (1000.00)", done.stdout)
+
+    def test_shared(self):
+        configs = [Config("MG", "S", 1), Config("CG", "S", 1), Config("MG", "S", 2)]
+        os.environ["FAKE_MOPS"] = "1000"
+        self.addCleanup(os.environ.pop, "FAKE_MOPS")
+        # Two made up CPUs, the children are not pinned
+        with mock.patch("os.sched_setaffinity"):
+            results = Runner(self.command.split(), cpus={0, 1}).run(configs)
+            self.assertEqual(
+                {(Config("MG", "S", 1), True), (Config("CG", "S", 1), True), (Config("MG", "S", 2), False)},
+                {(result.config, result.shared) for result in results}
+            )
+            results = Runner(self.command.split(), cpus={0, 1}, exclusive=True).run(configs)
+            self.assertEqual([False] * 3, [result.shared for result in results])
+            self.assertEqual(["0,1"] * 3, [result.cpus for result in results])
+
+    @unittest.skipIf(len(os.sched_getaffinity(0)) < 2, "Needs two CPUs to run two kernels at the same time")
+    def test_shared_compared_with_shared(self):
+        self.assertEqual(0, self.run_batch(1000, "--kernels", "MG", "--threads", "1", "--exclusive").returncode)
+        # Next to another kernel: slower, but there is no baseline of shared runs yet
+        done = self.run_batch(700, "--kernels", "MG", "CG", "--threads", "1", "--cpus", "0,1")
+        self.assertEqual(0, done.returncode, done.stdout + done.stderr)
+        self.assertEqual(2, done.stdout.count("(shared)"))
+        done = self.run_batch(690, "--kernels", "MG", "CG", "--threads", "1", "--cpus", "0,1")
+        self.assertEqual(0, done.returncode, done.stdout + done.stderr)
+        done = self.run_batch(500, "--kernels", "MG", "--threads", "1", "--cpus", "0,1")
+        self.assertEqual(1, done.returncode, done.stdout + done.stderr)
+        self.assertIn("median of 1 runs (1000.00)", done.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1 @@
+docs/npb_runner.py
\ No newline at end of file